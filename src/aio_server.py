@@ -0,0 +1,57 @@
+# aio_server.py
+# Modalità server asyncio: le stesse azioni del server threaded, su un solo event
+# loop invece di un thread per client. Qui c'è solo il trasporto: per ogni
+# connessione `new_client(out, addr)` crea lo stato della connessione (main.Client),
+# i frame letti passano a login()/handle() nel thread del loop e tutto ciò che esce
+# (risposte, broadcast, timer) passa da una outbound.LoopOutbound.
+# Le azioni non aspettano mai i socket degli altri: si fermano solo su lock brevi
+# e sulle letture dello storico SQLite.
+import asyncio
+from protocollo import recv_msg_async
+from outbound import LoopOutbound
+
+
+class AsyncServer:
+    def __init__(self, new_client, log=print):
+        self.new_client = new_client
+        self.log = log
+        self.running = False
+        self._server = None
+        self._loop = None
+
+    async def client_handler(self, reader, writer):
+        client = self.new_client(LoopOutbound(self._loop, writer.transport), writer.get_extra_info("peername"))
+        try:
+            if client.login(await recv_msg_async(reader)):
+                while client.handle(await recv_msg_async(reader)): pass
+        except Exception as e:
+            client.error(e)
+        finally:
+            client.close()
+
+    # --- CICLO DI VITA ---
+    async def serve(self, sock):
+        self._loop = asyncio.get_running_loop()
+        self.running = True
+        self._server = await asyncio.start_server(self.client_handler, sock=sock)
+        self.log(f"--- SERVER ONLINE SU PORTA {sock.getsockname()[1]} (asyncio) ---")
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.running = False
+            self.log("--- SERVER OFFLINE ---")
+
+    def run(self, sock):
+        # Entry point per il thread del listener: un event loop dedicato.
+        try: asyncio.run(self.serve(sock))
+        except Exception as e: self.log(f"Errore listener: {e}")
+
+    def stop(self):
+        # Thread-safe: chiamato dalla GUI. Chiude solo il socket in ascolto; le
+        # connessioni le chiude chi le ha registrate (main.active_connections).
+        if self._loop and self._server:
+            try: self._loop.call_soon_threadsafe(self._server.close)
+            except RuntimeError: pass
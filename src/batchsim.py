@@ -0,0 +1,259 @@
+# batchsim.py
+# Simulatore di partite a blocchi per tornei di bot e controlli delle regole.
+# Tiene `batch` board in un array NumPy (una riga per partita, una cella per
+# byte come GridBoard: 0 vuota, 1 X, 2 O) e a ogni passo gioca una mossa su
+# tutte le partite ancora aperte. La vittoria si cerca come in GridBoard solo
+# sulle linee che passano per la cella appena giocata, ma per tutto il blocco
+# con un'unica operazione di maschera.
+# - politiche: "random" e, sul 3x3, i livelli di bot.py ("easy", "medium",
+#   "hard") letti da una tabella di tutte le 3^9 board;
+# - ogni blocco viene confrontato con GameRoom.apply_move su un campione di
+#   partite (stesso esito e stesso numero di mosse);
+# - i blocchi si distribuiscono su un pool di processi e le statistiche
+#   (esiti per mossa di apertura, durata delle partite) si sommano.
+#
+# Richiede numpy (pip install numpy, oppure l'extra "sim" del progetto).
+#
+#   python batchsim.py --games 1000000 --workers 4
+#   python batchsim.py --x hard --o random --json stats.json
+#   python batchsim.py --size 15 --win 5 --games 20000
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import bot
+from gameroom import GameRoom, MAX_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RESULTS = ("X_wins", "O_wins", "draw")
+POLICIES = ("random",) + tuple(bot.LEVELS)
+RUNNING, X_WINS, O_WINS, DRAW = 0, 1, 2, 3
+_lines_cache = {}
+_bot_table = None
+
+
+def lines_through(size, win):
+    # (celle, M, win): per ogni cella le linee di `win` celle che la contengono.
+    # Le righe mancanti puntano alla cella sentinella `size*size`, sempre vuota.
+    key = (size, win)
+    if key in _lines_cache: return _lines_cache[key]
+    cells = size * size
+    per_cell = [[] for _ in range(cells)]
+    for r in range(size):
+        for c in range(size):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                er, ec = r + dr * (win - 1), c + dc * (win - 1)
+                if not (0 <= er < size and 0 <= ec < size): continue
+                line = [(r + dr * i) * size + c + dc * i for i in range(win)]
+                for pos in line: per_cell[pos].append(line)
+    width = max(len(lines) for lines in per_cell)
+    table = np.full((cells, width, win), cells, dtype=np.intp)
+    for pos, lines in enumerate(per_cell):
+        if lines: table[pos, :len(lines)] = lines
+    _lines_cache[key] = table
+    return table
+
+
+def bot_table():
+    # Punteggi di bot.py per tutte le 3^9 board (indice: sum(cella_i * 3^i)),
+    # -inf sulle celle occupate e sulle posizioni non raggiungibili.
+    global _bot_table
+    if _bot_table is None:
+        scores = np.full((3 ** 9, 9), -np.inf)
+        for index in range(3 ** 9):
+            x = o = 0
+            n = index
+            for i in range(9):
+                n, v = divmod(n, 3)
+                if v == 1: x |= 1 << i
+                elif v == 2: o |= 1 << i
+            if bin(x).count("1") - bin(o).count("1") not in (0, 1): continue
+            try: row = bot.scores(x, o)
+            except KeyError: continue       # partita finita o posizione impossibile
+            scores[index] = [-np.inf if s is None else s for s in row]
+        _bot_table = scores
+    return _bot_table
+
+
+class BatchBoards:
+    def __init__(self, n, size=3, win=3):
+        self.n = n
+        self.size = size
+        self.win = win
+        self.cells = np.zeros((n, size * size + 1), dtype=np.int8)  # +1: sentinella
+        self.result = np.zeros(n, dtype=np.int8)
+        self.moves = np.full((n, size * size), -1, dtype=np.int16)
+        self.played = 0
+        self._lines = lines_through(size, win)
+
+    def live(self):
+        return np.flatnonzero(self.result == RUNNING)
+
+    def step(self, live, pos):
+        # Una mossa su ognuna delle partite aperte `live` (pos allineato a live):
+        # tutte hanno giocato lo stesso numero di mosse, quindi muove lo stesso simbolo.
+        symbol = 1 if self.played % 2 == 0 else 2
+        if (self.cells[live, pos] != 0).any(): raise ValueError("Mossa su una cella occupata")
+        self.cells[live, pos] = symbol
+        self.moves[live, self.played] = pos
+        self.played += 1
+        lines = self._lines[pos]                                    # (live, M, win)
+        won = (self.cells[live[:, None, None], lines] == symbol).all(axis=2).any(axis=1)
+        self.result[live[won]] = X_WINS if symbol == 1 else O_WINS
+        if self.played == self.size * self.size: self.result[live[~won]] = DRAW
+
+
+def pick(allowed, rng):
+    # Una cella a caso tra quelle ammesse, per riga.
+    keys = rng.random(allowed.shape)
+    keys[~allowed] = -1.0
+    return keys.argmax(axis=1)
+
+
+def choose(boards, live, policy, rng):
+    # Una posizione per ogni partita aperta secondo `policy`, tra le celle libere.
+    cells = boards.cells[live]
+    if policy == "random":
+        # Estrazione con rifiuto: sulle board grandi e quasi vuote costa O(1) a partita
+        # invece di una chiave per cella; le poche rimaste occupate si scelgono tra le libere.
+        pos = rng.integers(boards.size * boards.size, size=len(live))
+        taken = np.flatnonzero(cells[np.arange(len(live)), pos])
+        for _ in range(4):
+            if not len(taken): return pos
+            pos[taken] = rng.integers(boards.size * boards.size, size=len(taken))
+            taken = taken[cells[taken, pos[taken]] != 0]
+        if len(taken): pos[taken] = pick(cells[taken, :-1] == 0, rng)
+        return pos
+    free = cells[:, :-1] == 0
+    scores = bot_table()[cells[:, :-1].astype(np.intp) @ 3 ** np.arange(9)]
+    best = scores == scores.max(axis=1, keepdims=True)
+    accurate = rng.random(len(live)) < bot.LEVELS[policy]
+    return pick(np.where(accurate[:, None], best & free, free), rng)
+
+
+def simulate(n, seed, size=3, win=3, x_policy="random", o_policy="random"):
+    rng = np.random.default_rng(seed)
+    boards = BatchBoards(n, size, win)
+    policies = (x_policy, o_policy)
+    while True:
+        live = boards.live()
+        if not len(live): return boards
+        boards.step(live, choose(boards, live, policies[boards.played % 2], rng))
+
+
+def result_name(code):
+    return RESULTS[code - 1]
+
+
+def check_against_gameroom(boards, sample):
+    # Stesse partite rigiocate con GameRoom.apply_move: None se tutto coincide,
+    # altrimenti la descrizione della prima differenza. Anche il tempo impiegato.
+    start = time.perf_counter()
+    for i in range(min(sample, boards.n)):
+        room = GameRoom("x", size=boards.size, win=boards.win)
+        room.players = {"x": "X", "o": "O"}
+        room.turn = "X"
+        room.status = "running"
+        moves = [int(p) for p in boards.moves[i] if p >= 0]
+        for k, pos in enumerate(moves):
+            res = room.apply_move("x" if k % 2 == 0 else "o", pos)
+            if not res["ok"] or (res["status"] == "ended") != (k == len(moves) - 1):
+                return f"partita {i}, mossa {k}: {res}", time.perf_counter() - start
+        if res["result"] != result_name(boards.result[i]):
+            return f"partita {i}: GameRoom {res['result']}, batch {result_name(boards.result[i])}", time.perf_counter() - start
+    return None, time.perf_counter() - start
+
+
+def stats_of(boards):
+    # Conteggi per mossa di apertura e esito, e durate delle partite.
+    cells = boards.size * boards.size
+    by_opening = np.zeros((cells, len(RESULTS)), dtype=np.int64)
+    np.add.at(by_opening, (boards.moves[:, 0], boards.result - 1), 1)
+    lengths = np.bincount((boards.moves >= 0).sum(axis=1), minlength=cells + 1)
+    return by_opening, lengths
+
+
+def run_chunk(args):
+    # Lavoro di un processo del pool: simulazione, controllo e statistiche.
+    n, seed, size, win, x_policy, o_policy, sample = args
+    start = time.perf_counter()
+    boards = simulate(n, seed, size, win, x_policy, o_policy)
+    secs = time.perf_counter() - start
+    mismatch, check_secs = check_against_gameroom(boards, sample)
+    by_opening, lengths = stats_of(boards)
+    return by_opening, lengths, secs, mismatch, min(sample, n), check_secs
+
+
+def report(by_opening, lengths, size, win, x_policy, o_policy):
+    games = int(by_opening.sum())
+    totals = by_opening.sum(axis=0)
+    openings = []
+    for pos in range(size * size):
+        played = int(by_opening[pos].sum())
+        if not played: continue
+        row = {"pos": pos, "games": played}
+        row.update({name: by_opening[pos, k] / played for k, name in enumerate(RESULTS)})
+        openings.append(row)
+    return {"size": size, "win": win, "x": x_policy, "o": o_policy, "games": games,
+            "rates": {name: totals[k] / games for k, name in enumerate(RESULTS)},
+            "mean_moves": float((np.arange(len(lengths)) * lengths).sum() / games),
+            "by_opening": openings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulatore di partite a blocchi (NumPy)")
+    parser.add_argument("--games", type=int, default=1_000_000)
+    parser.add_argument("--batch", type=int, default=100_000, help="partite per blocco")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win", type=int, default=3)
+    parser.add_argument("--x", choices=POLICIES, default="random", help="politica di X")
+    parser.add_argument("--o", choices=POLICIES, default="random", help="politica di O")
+    parser.add_argument("--check", type=int, default=1000, help="partite per blocco rigiocate con GameRoom")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="file in cui scrivere le statistiche")
+    args = parser.parse_args()
+    if np is None: parser.error("serve numpy: pip install numpy (oppure l'extra 'sim')")
+    if not (3 <= args.size <= MAX_SIZE and 3 <= args.win <= args.size): parser.error("variante non valida")
+    if args.size != 3 and (args.x, args.o) != ("random", "random"):
+        parser.error("i bot giocano solo sul 3x3")
+
+    chunks = [(min(args.batch, args.games - i), args.seed * 1_000_003 + k, args.size, args.win, args.x, args.o, args.check)
+              for k, i in enumerate(range(0, args.games, args.batch))]
+    cells = args.size * args.size
+    by_opening = np.zeros((cells, len(RESULTS)), dtype=np.int64)
+    lengths = np.zeros(cells + 1, dtype=np.int64)
+    sim_secs = checked = check_secs = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for chunk_opening, chunk_lengths, secs, mismatch, n_checked, c_secs in pool.map(run_chunk, chunks):
+            if mismatch: raise SystemExit(f"Differenza con GameRoom: {mismatch}")
+            by_opening += chunk_opening
+            lengths += chunk_lengths
+            sim_secs += secs
+            checked += n_checked
+            check_secs += c_secs
+    wall = time.perf_counter() - start
+
+    stats = report(by_opening, lengths, args.size, args.win, args.x, args.o)
+    print(f"{stats['games']:,} partite {args.size}x{args.size} ({args.win} in fila), X={args.x} O={args.o}, "
+          f"{len(chunks)} blocchi su {args.workers} processi in {wall:.1f} s")
+    print(f"Batch: {stats['games'] / sim_secs:12,.0f} partite/s per processo; "
+          f"GameRoom: {checked / check_secs:10,.0f} partite/s ({checked:,} rigiocate, esiti identici)")
+    print("Esiti: " + ", ".join(f"{name} {rate:.2%}" for name, rate in stats["rates"].items())
+          + f"; mosse medie {stats['mean_moves']:.2f}")
+    print("Apertura   partite   " + "  ".join(f"{name:>7}" for name in RESULTS))
+    for row in sorted(stats["by_opening"], key=lambda r: -r["X_wins"])[:9]:
+        print(f"{row['pos']:>8} {row['games']:>9,}   " + "  ".join(f"{row[name]:>7.2%}" for name in RESULTS))
+    if args.json:
+        with open(args.json, "w") as f: json.dump(stats, f, indent=1)
+        print(f"Statistiche in {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# bench_bot.py
+# Benchmark del bot: migliaia di partite contemporanee in un solo thread, mossa
+# per mossa a turno su tutte le stanze (come farebbe la ruota dei timer), passando
+# da GameRoom.apply_move. Controlla anche il gioco perfetto: "hard" contro "hard"
+# pareggia sempre e contro mosse casuali non perde mai.
+#
+#   python bench_bot.py --games 5000
+import argparse
+import random
+import time
+import bot
+from gameroom import GameRoom
+
+
+def new_room(x_id, o_id):
+    room = GameRoom(x_id)
+    room.players = {x_id: "X", o_id: "O"}
+    room.turn = "X"
+    room.status = "running"
+    return room
+
+
+def run(games, x_level, o_level, seed=1):
+    # x_level/o_level: livello del bot oppure None per mosse casuali.
+    rng = random.Random(seed)
+    players = {"X": bot.Bot(x_level, rng) if x_level else None, "O": bot.Bot(o_level, rng) if o_level else None}
+    rooms = [new_room("x", "o") for _ in range(games)]
+    live, results, decisions = rooms, [], 0
+    start = time.perf_counter()
+    while live:
+        still = []
+        for room in live:
+            player = players[room.turn]
+            if player is None: pos = rng.choice([i for i, c in enumerate(room.board) if c is None])
+            else:
+                pos = player.choose(room.move_history)
+                decisions += 1
+            res = room.apply_move("x" if room.turn == "X" else "o", pos)
+            if res["status"] == "ended": results.append(res["result"])
+            else: still.append(room)
+        live = still
+    return decisions, time.perf_counter() - start, results
+
+
+def minimax_scores(x, o, played):
+    # Riferimento senza tabella: negamax completo a ogni mossa.
+    scores = {}
+    for i in range(9):
+        if (x | o) >> i & 1: continue
+        nx, no = (x | 1 << i, o) if played % 2 == 0 else (x, o | 1 << i)
+        if bot._won(nx if played % 2 == 0 else no): scores[i] = 10 - (played + 1)
+        elif played + 1 == 9: scores[i] = 0
+        else: scores[i] = -max(minimax_scores(nx, no, played + 1).values())
+    return scores
+
+
+def minimax_move(moves):
+    scores = minimax_scores(*bot.bits_of(moves), len(moves))
+    return max(scores, key=scores.get)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bot")
+    parser.add_argument("--games", type=int, default=5000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    classes = len(bot.table())
+    print(f"Tabella: {classes} posizioni canoniche in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    for x_level, o_level in (("hard", "hard"), ("hard", None), (None, "hard"), ("easy", "medium")):
+        decisions, secs, results = run(args.games, x_level, o_level)
+        tally = {r: results.count(r) for r in sorted(set(results))}
+        print(f"X={x_level or 'casuale':>7} O={o_level or 'casuale':>7}: {args.games} partite contemporanee, "
+              f"{decisions / secs:10,.0f} mosse del bot/s, {len(results) / secs:8,.0f} partite/s  {tally}")
+        if x_level == o_level == "hard" and set(results) != {"draw"}: raise SystemExit("hard contro hard deve pareggiare")
+        if (x_level == "hard" and "O_wins" in tally) or (o_level == "hard" and "X_wins" in tally):
+            raise SystemExit("hard ha perso contro mosse casuali")
+
+    start = time.perf_counter()
+    n = 20
+    for _ in range(n): minimax_move(b"")
+    print(f"Minimax senza tabella dalla board vuota: {n / (time.perf_counter() - start):,.1f} mosse/s")
+
+
+if __name__ == "__main__":
+    main()
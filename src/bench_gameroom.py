@@ -0,0 +1,130 @@
+# bench_gameroom.py
+# Micro-benchmark dei motori di GameRoom: mosse al secondo con il motore a lista
+# (storico), con quello a bitboard e con quello a griglia, sulle stesse partite casuali.
+# Con --size/--win (es. gomoku 15x15, 5 in fila) gira solo il motore a griglia,
+# confrontato con una scansione completa della board a ogni mossa.
+#
+#   python bench_gameroom.py                         (5000 partite)
+#   python bench_gameroom.py --size 15 --win 5        (100 partite: la scansione
+#                                                      completa costa ~30 ms l'una)
+import argparse
+import random
+import time
+from gameroom import GameRoom, ENGINES
+
+
+def random_games(n, cells=9, seed=1):
+    rng = random.Random(seed)
+    games = []
+    for _ in range(n):
+        order = list(range(cells))
+        rng.shuffle(order)
+        games.append(order)
+    return games
+
+
+def new_room(engine, size=3, win=3):
+    room = GameRoom("a", engine=engine, size=size, win=win)
+    room.players = {"a": "X", "b": "O"}
+    room.turn = "X"
+    room.status = "running"
+    return room
+
+
+def play(engine, games, size=3, win=3):
+    # Restituisce (mosse giocate, secondi, risultati) passando da apply_move.
+    moves = 0
+    results = []
+    rooms = [new_room(engine, size, win) for _ in games]
+    start = time.perf_counter()
+    for room, cells in zip(rooms, games):
+        player = "a"
+        for pos in cells:
+            res = room.apply_move(player, pos)
+            moves += 1
+            if res["status"] == "ended": break
+            player = "b" if player == "a" else "a"
+        results.append((res["result"], res["moves"]))
+    return moves, time.perf_counter() - start, results
+
+
+def play_engine(engine, games):
+    # Solo il motore, senza lock e dict di risposta di apply_move.
+    cls = ENGINES[engine]
+    moves = 0
+    start = time.perf_counter()
+    for cells in games:
+        board = cls()
+        symbol = "X"
+        for pos in cells:
+            board.place(pos, symbol)
+            moves += 1
+            if board.winner_after(pos, symbol) or board.is_full(): break
+            symbol = "O" if symbol == "X" else "X"
+    return moves, time.perf_counter() - start
+
+
+def scan_winner(cells, n, k):
+    # Riferimento: tutte le file di k celle della board, a ogni mossa.
+    for r in range(n):
+        for c in range(n):
+            v = cells[r * n + c]
+            if v is None: continue
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                er, ec = r + dr * (k - 1), c + dc * (k - 1)
+                if not (0 <= er < n and 0 <= ec < n): continue
+                if all(cells[(r + dr * i) * n + c + dc * i] == v for i in range(k)): return v
+    return None
+
+
+def play_scan(games, n, k):
+    moves = 0
+    results = []
+    start = time.perf_counter()
+    for order in games:
+        cells = [None] * (n * n)
+        symbol, result = "X", "draw"
+        for i, pos in enumerate(order):
+            cells[pos] = symbol
+            moves += 1
+            if scan_winner(cells, n, k):
+                result = f"{symbol}_wins"
+                break
+            symbol = "O" if symbol == "X" else "X"
+        results.append((result, i + 1))
+    return moves, time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark motori GameRoom")
+    parser.add_argument("--games", type=int, help="default 5000 sul 3x3, 100 altrimenti")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win", type=int, default=3)
+    args = parser.parse_args()
+
+    grid = (args.size, args.win) != (3, 3)
+    if args.games is None: args.games = 100 if grid else 5000
+    games = random_games(args.games, args.size * args.size)
+    if grid:
+        moves, secs, results = play("grid", games, args.size, args.win)
+        scan_moves, scan_secs, reference = play_scan(games, args.size, args.win)
+        if results != reference: raise SystemExit("Risultati diversi dalla scansione completa")
+        print(f"{args.size}x{args.size}, {args.win} in fila: {moves / secs:12,.0f} mosse/s incrementale, "
+              f"{scan_moves / scan_secs:12,.0f} mosse/s con scansione completa")
+        return
+
+    reference = None
+    for engine in ENGINES:
+        best = None
+        for _ in range(args.rounds):
+            moves, secs, results = play(engine, games)
+            best = secs if best is None else min(best, secs)
+        if reference is None: reference = results
+        elif results != reference: raise SystemExit(f"Risultati diversi con il motore '{engine}'")
+        raw = min(play_engine(engine, games)[1] for _ in range(args.rounds))
+        print(f"{engine:>9}: {moves / best:12,.0f} mosse/s con apply_move, {moves / raw:12,.0f} mosse/s solo motore")
+
+
+if __name__ == "__main__":
+    main()
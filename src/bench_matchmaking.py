@@ -0,0 +1,85 @@
+# bench_matchmaking.py
+# Load test del matchmaker: N giocatori cercano partita nello stesso momento da
+# più thread (una parte annulla subito la ricerca), poi si misurano i passaggi
+# di abbinamento fino a svuotare la coda e la creazione in blocco delle stanze.
+#
+#   python bench_matchmaking.py --searchers 10000
+import argparse
+import contextlib
+import io
+import random
+import threading
+import time
+from gameroom import GameRoom
+from matchmaking import Matchmaker
+from registry import RoomRegistry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test matchmaking")
+    parser.add_argument("--searchers", type=int, default=10000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--cancel", type=float, default=0.1, help="quota di ricerche annullate")
+    parser.add_argument("--spread", type=int, default=400, help="deviazione standard del punteggio")
+    args = parser.parse_args()
+
+    rooms = RoomRegistry()
+    clock = [0.0]
+    created = []
+
+    def on_pairs(pairs):
+        # Come main.start_matches: tutte le stanze del passaggio insieme.
+        # GameRoom stampa il sorteggio: qui lo si butta via.
+        with contextlib.redirect_stdout(io.StringIO()):
+            for host, guest in pairs:
+                room = GameRoom(host.player_id)
+                room.connections[host.player_id] = host.conn
+                room.add_player(guest.player_id, guest.conn)
+                rooms.add(room)
+        created.append(len(pairs))
+
+    mm = Matchmaker(on_pairs, clock=lambda: clock[0], autostart=False)
+    rng = random.Random(1)
+    ratings = [max(0, int(rng.gauss(1000, args.spread))) for _ in range(args.searchers)]
+    barrier = threading.Barrier(args.threads)
+    cancelled = [0] * args.threads
+
+    def searcher(t):
+        barrier.wait()
+        for i in range(t, args.searchers, args.threads):
+            pid = f"p{i}"
+            mm.enqueue(pid, None, ratings[i])
+            if (i * 7919) % 1000 < args.cancel * 1000 and mm.cancel(pid): cancelled[t] += 1
+
+    threads = [threading.Thread(target=searcher, args=(t,)) for t in range(args.threads)]
+    start = time.perf_counter()
+    for th in threads: th.start()
+    for th in threads: th.join()
+    enqueue_secs = time.perf_counter() - start
+    queued = len(mm)
+    print(f"Accodati {args.searchers} ({sum(cancelled)} annullati) in {enqueue_secs * 1000:.1f} ms, in coda {queued}")
+
+    # Un passaggio ogni tick simulato: la finestra si allarga finché la coda non si
+    # svuota o non raggiunge max_window (oltre restano solo i punteggi isolati).
+    saturated = (mm.max_window - mm.initial_window) / mm.widen_per_sec
+    passes = 0
+    match_secs = rooms_secs = 0.0
+    while len(mm) > 1:
+        t0 = time.perf_counter()
+        pairs = mm.match_once()
+        t1 = time.perf_counter()
+        if pairs: on_pairs(pairs)
+        match_secs += t1 - t0
+        rooms_secs += time.perf_counter() - t1
+        passes += 1
+        if pairs: print(f"  passaggio {passes:3}: {len(pairs):6} coppie in {(t1 - t0) * 1000:8.1f} ms, restano {len(mm)}")
+        elif clock[0] > saturated: break
+        clock[0] += mm.tick
+
+    print(f"Stanze create: {len(rooms)} in {passes} passaggi, senza avversario: {len(mm)}")
+    print(f"Abbinamento: {match_secs * 1000:.1f} ms totali, creazione stanze: {rooms_secs * 1000:.1f} ms"
+          f" ({len(rooms) / rooms_secs if rooms_secs else 0:,.0f} stanze/s)")
+
+
+if __name__ == "__main__":
+    main()
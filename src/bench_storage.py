@@ -0,0 +1,68 @@
+# bench_storage.py
+# Benchmark dello storico partite: partite accodate al secondo dal thread di gioco,
+# partite scritte al secondo dal thread scrittore e latenza delle letture della lobby.
+#
+#   python bench_storage.py --games 100000 --players 2000
+import argparse
+import os
+import random
+import tempfile
+import time
+from gameroom import GameRoom
+from storage import GameStore
+
+
+class _Room:
+    # Solo i campi letti da GameStore.record: niente lock né sorteggio di GameRoom.
+    __slots__ = GameRoom.__slots__
+
+
+def fake_rooms(n, players, seed=1):
+    rng = random.Random(seed)
+    rooms = []
+    for i in range(n):
+        room = _Room()
+        x, o = rng.sample(range(players), 2)
+        room.id = f"g{i}"
+        room.players = {f"p{x}": "X", f"p{o}": "O"}
+        cells = list(range(9))
+        rng.shuffle(cells)
+        room.move_history = bytearray(cells[:rng.randint(5, 9)])
+        room.size = room.win = 3
+        room.created_at = i
+        room.ended_at = i + 30
+        rooms.append((room, rng.choice(("X_wins", "O_wins", "draw", "X_disconnected"))))
+    return rooms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark storico partite")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    store = GameStore(log=print)
+    store.open(path)
+    rooms = fake_rooms(args.games, args.players)
+
+    start = time.perf_counter()
+    for room, result in rooms: store.record(room, result)
+    queued = time.perf_counter() - start
+    while store.written < args.games: time.sleep(0.01)
+    written = time.perf_counter() - start
+    print(f"record(): {args.games / queued:12,.0f} partite/s (thread di gioco)")
+    print(f"scrittura: {args.games / written:12,.0f} partite/s, file {os.path.getsize(path) / 2**20:.1f} MiB")
+
+    rng = random.Random(2)
+    for name, query in (("storico", lambda: store.recent_games(f"p{rng.randrange(args.players)}")),
+                        ("statistiche", lambda: store.stats(f"p{rng.randrange(args.players)}")),
+                        ("replay", lambda: store.replay(f"g{rng.randrange(args.games)}"))):
+        start = time.perf_counter()
+        for _ in range(args.queries): query()
+        print(f"{name:>12}: {(time.perf_counter() - start) / args.queries * 1e6:8.1f} µs per lettura")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# bot.py
+# Avversario del server per il tris 3x3.
+# La tabella di gioco perfetto copre tutte le posizioni raggiungibili non finite,
+# ridotte per le 8 simmetrie della board (627 classi invece di 4520 posizioni).
+# Si calcola al primo uso con un negamax memoizzato (qualche decina di ms); da lì
+# ogni mossa del bot costa 8 letture per trovare la forma canonica più una
+# lettura nella tabella.
+#
+# Punteggi dal punto di vista di chi muove: vittoria 10 - mosse giocate (prima è
+# meglio), pareggio 0, sconfitta negativa (più tardi è meglio).
+import random
+import threading
+
+BOT_PREFIX = "bot:"
+# Probabilità di scegliere una mossa ottima invece di una a caso.
+LEVELS = {"easy": 0.3, "medium": 0.7, "hard": 1.0}
+DEFAULT_LEVEL = "medium"
+
+_LINES = ((0, 1, 2), (3, 4, 5), (6, 7, 8), (0, 3, 6), (1, 4, 7), (2, 5, 8), (0, 4, 8), (2, 4, 6))
+_WIN_MASKS = tuple(sum(1 << i for i in line) for line in _LINES)
+
+
+def _rotate(i):
+    r, c = divmod(i, 3)
+    return c * 3 + (2 - r)
+
+
+def _mirror(i):
+    r, c = divmod(i, 3)
+    return r * 3 + (2 - c)
+
+
+def _symmetries():
+    # perm[i] = dove finisce la cella i: 4 rotazioni, ognuna anche specchiata.
+    perms = []
+    perm = list(range(9))
+    for _ in range(4):
+        perms.append(tuple(perm))
+        perms.append(tuple(_mirror(p) for p in perm))
+        perm = [_rotate(p) for p in perm]
+    return tuple(perms)
+
+
+SYMMETRIES = _symmetries()
+# _PERM_BITS[t][bits]: i 9 bit permutati con la simmetria t, per tutte le 512 maschere.
+_PERM_BITS = tuple(tuple(sum(1 << perm[i] for i in range(9) if bits >> i & 1) for bits in range(512))
+                   for perm in SYMMETRIES)
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def canonical(x, o):
+    # -> (chiave canonica, indice della simmetria che ci porta)
+    best, best_t = None, 0
+    for t, table in enumerate(_PERM_BITS):
+        key = table[x] << 9 | table[o]
+        if best is None or key < best: best, best_t = key, t
+    return best, best_t
+
+
+def _won(bits):
+    return any(bits & m == m for m in _WIN_MASKS)
+
+
+def _solve():
+    table = {}      # chiave canonica -> punteggi delle 9 celle (None = occupata)
+
+    def value(x, o, played):
+        key, t = canonical(x, o)
+        scores = table.get(key)
+        if scores is None:
+            scores = table[key] = _scores(x, o, played, t)
+        return max(s for s in scores if s is not None)
+
+    def _scores(x, o, played, t):
+        mover_x = played % 2 == 0
+        canon = [None] * 9
+        perm = SYMMETRIES[t]
+        for i in range(9):
+            if (x | o) >> i & 1: continue
+            nx, no = (x | 1 << i, o) if mover_x else (x, o | 1 << i)
+            if _won(nx if mover_x else no): score = 10 - (played + 1)
+            elif played + 1 == 9: score = 0
+            else: score = -value(nx, no, played + 1)
+            canon[perm[i]] = score
+        return tuple(canon)
+
+    value(0, 0, 0)
+    return table
+
+
+def table():
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None: _table = _solve()
+    return _table
+
+
+def scores(x, o):
+    # Punteggi delle 9 celle nella posizione reale (None = occupata).
+    key, t = canonical(x, o)
+    canon = table()[key]
+    perm = SYMMETRIES[t]
+    return [canon[perm[i]] for i in range(9)]
+
+
+def bits_of(moves):
+    # Dalla sequenza delle mosse (X per primo) alle due maschere a 9 bit.
+    x = o = 0
+    for n, pos in enumerate(moves):
+        if n % 2 == 0: x |= 1 << pos
+        else: o |= 1 << pos
+    return x, o
+
+
+def is_bot(player_id):
+    return type(player_id) is str and player_id.startswith(BOT_PREFIX)
+
+
+def level_of(player_id):
+    return player_id[len(BOT_PREFIX):]
+
+
+class Bot:
+    def __init__(self, level=DEFAULT_LEVEL, rng=None):
+        if level not in LEVELS: raise ValueError(f"Livello sconosciuto: {level}")
+        self.level = level
+        self.player_id = BOT_PREFIX + level
+        self.accuracy = LEVELS[level]
+        self.rng = rng or random.Random()
+
+    def choose(self, moves):
+        cell_scores = scores(*bits_of(moves))
+        free = [i for i, s in enumerate(cell_scores) if s is not None]
+        if not free: return None
+        if self.rng.random() >= self.accuracy: return self.rng.choice(free)
+        best = max(cell_scores[i] for i in free)
+        return self.rng.choice([i for i in free if cell_scores[i] == best])
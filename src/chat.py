@@ -0,0 +1,189 @@
+# chat.py
+# Chat a canali: "lobby", "room:<id>" per ogni partita, "dm:<a>:<b>" per i
+# messaggi privati. Ogni canale ha il suo insieme di iscritti e uno storico
+# circolare degli ultimi `history` messaggi, mandato a chi si iscrive.
+# - i canali sono divisi in `stripes` partizioni col proprio lock: le chat di
+#   partite diverse non si contendono niente;
+# - publish() accoda e torna subito; un thread dedicato raccoglie i messaggi di
+#   una finestra, li serializza una volta per codec e li accoda agli iscritti
+#   (il writer di ogni Outbound li scrive poi con un solo sendall);
+# - limite per utente a secchiello: `burst` messaggi di fila, poi `rate` al secondo.
+import collections
+import threading
+import time
+from protocollo import pack_for
+from outbound import post
+from metrics import BROADCAST_FANOUT, BROADCAST_SECONDS
+
+LOBBY = "lobby"
+
+
+def room_channel(room_id):
+    return f"room:{room_id}"
+
+
+def dm_channel(a, b):
+    return "dm:" + ":".join(sorted((a, b)))
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "stamp")
+
+    def __init__(self, tokens, stamp):
+        self.tokens = tokens
+        self.stamp = stamp
+
+
+class Channel:
+    __slots__ = ("name", "members", "history", "pending")
+
+    def __init__(self, name, history):
+        self.name = name
+        self.members = {}       # member_id -> conn
+        self.history = collections.deque(maxlen=history)
+        self.pending = []       # messaggi non ancora inviati
+
+
+class _Shard:
+    __slots__ = ("lock", "channels", "dirty")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}      # nome -> Channel
+        self.dirty = set()      # canali con messaggi in attesa
+
+
+class ChatHub:
+    def __init__(self, history=50, rate=1.0, burst=5, max_length=500, window=0.02, stripes=16,
+                 log=print, clock=time.monotonic):
+        self.history = history
+        self.rate = rate
+        self.burst = burst
+        self.max_length = max_length
+        self.window = window
+        self.log = log
+        self.clock = clock
+        self._shards = [_Shard() for _ in range(stripes)]
+        self._memberships = {}  # member_id -> set di canali
+        self._members_lock = threading.Lock()
+        self._buckets = {}      # member_id -> TokenBucket
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _shard(self, channel):
+        return self._shards[hash(channel) % len(self._shards)]
+
+    # --- Iscrizioni ---
+    def join(self, channel, member_id, conn, history=True):
+        # Idempotente. Con `history` il nuovo iscritto riceve lo storico del canale.
+        shard = self._shard(channel)
+        with shard.lock:
+            ch = shard.channels.get(channel)
+            if ch is None: ch = shard.channels[channel] = Channel(channel, self.history)
+            new = ch.members.get(member_id) is not conn
+            ch.members[member_id] = conn
+            backlog = [m["data"] for m in ch.history] if history and new else None
+        with self._members_lock: self._memberships.setdefault(member_id, set()).add(channel)
+        if backlog:
+            try: post(conn, pack_for(conn, {"type": "chat_history", "data": {"channel": channel, "messages": backlog}}))
+            except Exception: pass
+
+    def leave(self, channel, member_id):
+        shard = self._shard(channel)
+        with shard.lock:
+            ch = shard.channels.get(channel)
+            if ch is not None:
+                ch.members.pop(member_id, None)
+                # I canali privati vuoti si eliminano; lobby e stanze vivono finché servono.
+                if not ch.members and channel.startswith("dm:"): del shard.channels[channel]
+        with self._members_lock:
+            channels = self._memberships.get(member_id)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels: del self._memberships[member_id]
+
+    def leave_all(self, member_id):
+        with self._members_lock: channels = self._memberships.pop(member_id, set())
+        for channel in channels: self.leave(channel, member_id)
+        self._buckets.pop(member_id, None)
+
+    def history_of(self, channel):
+        shard = self._shard(channel)
+        with shard.lock:
+            ch = shard.channels.get(channel)
+            return [m["data"] for m in ch.history] if ch is not None else []
+
+    def close(self, channel):
+        # Fine partita: i messaggi già accodati partono, poi il canale sparisce.
+        shard = self._shard(channel)
+        with shard.lock: ch = shard.channels.pop(channel, None)
+        if ch is None: return
+        if ch.pending: self._send([(ch.pending, list(ch.members.values()))])
+        with self._members_lock:
+            for member_id in ch.members:
+                channels = self._memberships.get(member_id)
+                if channels is not None:
+                    channels.discard(channel)
+                    if not channels: del self._memberships[member_id]
+
+    def __len__(self):
+        return sum(len(shard.channels) for shard in self._shards)
+
+    # --- Messaggi ---
+    def allow(self, member_id):
+        # Secchiello: un gettone per messaggio, ne rientrano `rate` al secondo.
+        now = self.clock()
+        bucket = self._buckets.get(member_id)
+        if bucket is None: bucket = self._buckets[member_id] = TokenBucket(self.burst, now)
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.stamp) * self.rate)
+        bucket.stamp = now
+        if bucket.tokens < 1: return False
+        bucket.tokens -= 1
+        return True
+
+    def publish(self, channel, msg_obj):
+        shard = self._shard(channel)
+        with shard.lock:
+            ch = shard.channels.get(channel)
+            if ch is None: return False
+            ch.history.append(msg_obj)
+            ch.pending.append(msg_obj)
+            shard.dirty.add(channel)
+        self._wake.set()
+        return True
+
+    # --- Invio ---
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.window)   # raccoglie i messaggi della finestra
+            self._wake.clear()
+            try: self.flush()
+            except Exception as e: self.log(f"[Chat] Errore flush: {e}")
+
+    def flush(self):
+        work = []
+        for shard in self._shards:
+            if not shard.dirty: continue
+            with shard.lock:
+                dirty, shard.dirty = shard.dirty, set()
+                for name in dirty:
+                    ch = shard.channels.get(name)
+                    if ch is None or not ch.pending: continue
+                    work.append((ch.pending, list(ch.members.values())))
+                    ch.pending = []
+        if work: self._send(work)
+
+    def _send(self, work):
+        start = time.perf_counter()
+        sent = 0
+        for messages, conns in work:
+            caches = [{} for _ in messages]     # un frame per messaggio e codec
+            for conn in conns:
+                try:
+                    for msg_obj, cache in zip(messages, caches): post(conn, pack_for(conn, msg_obj, cache))
+                except Exception: pass
+            sent += len(conns)
+        BROADCAST_FANOUT.observe(sent, "chat")
+        BROADCAST_SECONDS.observe(time.perf_counter() - start, "chat")
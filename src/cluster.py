@@ -0,0 +1,290 @@
+# cluster.py
+# Modalità multi-processo: N worker condividono la porta con SO_REUSEPORT e
+# ognuno esegue il server threaded di main.py. Il processo padre fa da
+# coordinatore: tiene la directory globale dei giocatori e instrada inviti,
+# matchmaking, chat di lobby e player_list_update tra i worker.
+# Ogni GameRoom vive in un solo worker (quello che l'ha creata): i giocatori
+# connessi ad altri worker vi partecipano tramite RemoteConn.
+#
+#   python cluster.py --workers 4 --port 5000
+import argparse
+import itertools
+import multiprocessing as mp
+import queue
+import socket
+import threading
+from matchmaking import Matchmaker
+
+
+def create_reuseport_socket(host, port):
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise OSError("SO_REUSEPORT non disponibile su questa piattaforma.")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen()
+    return sock
+
+
+class RemoteConn:
+    # Socket "virtuale" di un giocatore connesso a un altro worker:
+    # send_msg() lo usa come un socket vero, i byte viaggiano sul bus.
+    def __init__(self, bus, player_id):
+        self.bus = bus
+        self.player_id = player_id
+
+    def sendall(self, data):
+        self.bus.send("raw", self.player_id, bytes(data))
+
+    def close(self):
+        pass
+
+
+# --- LATO WORKER ---
+class WorkerBus:
+    def __init__(self, worker_id, inbox, hub, server):
+        self.worker_id = worker_id
+        self.inbox = inbox
+        self.hub = hub
+        self.server = server        # modulo main del worker
+        self.remote_rooms = {}      # player_id locale -> worker proprietario della stanza
+        self.directory = {}         # player_id -> status (ultima lista globale ricevuta)
+        self._pending = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    # Messaggi verso il coordinatore
+    def send(self, op, *args):
+        self.hub.put((op, self.worker_id) + args)
+
+    def call(self, op, *args, timeout=5.0):
+        with self._lock:
+            req_id = next(self._ids)
+            slot = self._pending[req_id] = [threading.Event(), None]
+        self.send(op, req_id, *args)
+        ok = slot[0].wait(timeout)
+        with self._lock: self._pending.pop(req_id, None)
+        return slot[1] if ok else None
+
+    def claim(self, player_id): return bool(self.call("claim", player_id))
+    def release(self, player_id): self.send("release", player_id)
+    def publish_presence(self, statuses): self.send("presence", statuses)
+    def lobby_chat(self, msg_obj): self.send("lobby_chat", msg_obj)
+    def search(self, player_id): self.send("search", player_id)
+    def unsearch(self, player_id): self.send("unsearch", player_id)
+    def invite(self, from_id, target_id): return bool(self.call("invite", from_id, target_id))
+    def attach(self, player_id): self.send("attach", player_id)
+    def remote_conn(self, player_id): return RemoteConn(self, player_id)
+
+    def to_owner(self, player_id, op, *args):
+        owner = self.remote_rooms.get(player_id)
+        if owner is not None: self.send("forward", owner, op, args)
+
+    # Messaggi dal coordinatore
+    def run(self):
+        while True:
+            op, *args = self.inbox.get()
+            handler = getattr(self, f"on_{op}", None)
+            if handler is None: continue
+            try: handler(*args)
+            except Exception as e: self.server.log(f"[Cluster] Errore su '{op}': {e}")
+
+    def on_reply(self, req_id, value):
+        with self._lock: slot = self._pending.get(req_id)
+        if slot:
+            slot[1] = value
+            slot[0].set()
+
+    def _local_conn(self, player_id):
+        with self.server.players_lock:
+            p = self.server.players_data.get(player_id)
+        return p["conn"] if p else None
+
+    def on_raw(self, player_id, data):
+        conn = self._local_conn(player_id)
+        if conn:
+            # Il worker proprietario non conosce il codec del client: si adatta qui.
+            try: conn.sendall(self.server.recode_frame(data, self.server.codec_of(conn)))
+            except Exception: pass
+
+    def on_deliver(self, player_id, obj):
+        conn = self._local_conn(player_id)
+        if conn:
+            try: self.server.send_msg(conn, obj)
+            except Exception: pass
+
+    def on_player_list(self, users_list):
+        self.directory = {u["name"]: u["status"] for u in users_list}
+        # PresenceHub calcola i delta rispetto all'ultima lista e li invia ai client locali.
+        self.server.presence.sync(self.directory)
+
+    def on_lobby_chat(self, msg_obj):
+        self.server.lobby_chat(msg_obj)
+
+    def on_attach(self, player_id, owner):
+        # Un nostro giocatore è entrato in una stanza che vive su un altro worker.
+        self.remote_rooms[player_id] = owner
+        self.server.set_status(player_id, "ingame")
+        self.server.broadcast_player_list()
+
+    def on_pair(self, host_id, player_id, player_worker):
+        host_conn = self._local_conn(host_id)
+        if host_conn is None:
+            # L'host è sparito nel frattempo: il secondo giocatore torna in coda.
+            self.hub.put(("search", player_worker, player_id))
+            return
+        conn = self._local_conn(player_id) if player_worker == self.worker_id else self.remote_conn(player_id)
+        if conn is None: return
+        self.server.start_match(host_id, host_conn, player_id, conn)
+        if player_worker != self.worker_id: self.attach(player_id)
+
+    def on_move(self, player_id, pos):
+        room = self.server.find_room(player_id)
+        if room: self.server.play_move(player_id, room, pos)
+
+    def on_room_chat(self, player_id, text):
+        room = self.server.find_room(player_id)
+        if room: self.server.room_chat(player_id, room, text)
+
+    def on_leave_game(self, player_id, room_id):
+        self.server.leave_room(player_id, room_id)
+
+    def on_player_gone(self, player_id):
+        self.server.close_player_room(player_id)
+
+
+def worker_main(worker_id, host, port, inbox, hub):
+    import main as server
+    bus = WorkerBus(worker_id, inbox, hub, server)
+    server.cluster = bus
+    sock = create_reuseport_socket(host, port)
+    server.server_running = True
+    threading.Thread(target=bus.run, daemon=True).start()
+    server.log(f"[Cluster] Worker {worker_id} in ascolto su {host}:{port}")
+    server.run_server_listener(sock)
+
+
+# --- COORDINATORE ---
+class Coordinator:
+    def __init__(self, hub, inboxes, log=print):
+        self.hub = hub
+        self.inboxes = inboxes
+        self.log = log
+        self.directory = {}     # player_id -> [worker_id, status]
+        # Coda globale: il "conn" di ogni ticket è il worker del giocatore.
+        self.matchmaker = Matchmaker(on_pairs=self._on_pairs, log=log)
+        self._dirty = False
+
+    def run(self):
+        while True:
+            msg = self.hub.get()
+            self._dispatch(msg)
+            # Svuota il backlog prima di ridistribuire la lista: un solo invio per raffica.
+            while True:
+                try: msg = self.hub.get_nowait()
+                except queue.Empty: break
+                self._dispatch(msg)
+            if self._dirty:
+                self._dirty = False
+                users_list = [{"name": pid, "status": e[1]} for pid, e in self.directory.items()]
+                for inbox in self.inboxes: inbox.put(("player_list", users_list))
+
+    def _dispatch(self, msg):
+        op, worker_id, *args = msg
+        handler = getattr(self, f"op_{op}", None)
+        if handler is None: return
+        try: handler(worker_id, *args)
+        except Exception as e: self.log(f"[Coordinator] Errore su '{op}': {e}")
+
+    def _to_player(self, player_id, *msg):
+        entry = self.directory.get(player_id)
+        if entry: self.inboxes[entry[0]].put(msg)
+
+    def _reply(self, worker_id, req_id, value):
+        self.inboxes[worker_id].put(("reply", req_id, value))
+
+    def op_claim(self, worker_id, req_id, player_id):
+        ok = player_id not in self.directory
+        if ok:
+            self.directory[player_id] = [worker_id, "online"]
+            self._dirty = True
+        self._reply(worker_id, req_id, ok)
+
+    def op_release(self, worker_id, player_id):
+        entry = self.directory.get(player_id)
+        if entry and entry[0] == worker_id:
+            del self.directory[player_id]
+            self._dirty = True
+        self.matchmaker.cancel(player_id)
+
+    def op_presence(self, worker_id, statuses):
+        for pid, status in statuses.items():
+            entry = self.directory.get(pid)
+            if entry and entry[0] == worker_id and entry[1] != status:
+                entry[1] = status
+                self._dirty = True
+
+    def op_raw(self, worker_id, player_id, data):
+        self._to_player(player_id, "raw", player_id, data)
+
+    def op_deliver(self, worker_id, player_id, obj):
+        self._to_player(player_id, "deliver", player_id, obj)
+
+    def op_lobby_chat(self, worker_id, msg_obj):
+        for inbox in self.inboxes: inbox.put(("lobby_chat", msg_obj))
+
+    def op_invite(self, worker_id, req_id, from_id, target_id):
+        entry = self.directory.get(target_id)
+        ok = bool(entry and entry[1] == "online")
+        if ok: self._to_player(target_id, "deliver", target_id, {"type": "incoming_invite", "from": from_id})
+        self._reply(worker_id, req_id, ok)
+
+    def op_search(self, worker_id, player_id):
+        if player_id not in self.directory: return
+        self.matchmaker.enqueue(player_id, worker_id)
+        self._to_player(player_id, "deliver", player_id, {"type": "match_status", "status": "waiting"})
+
+    def op_unsearch(self, worker_id, player_id):
+        self.matchmaker.cancel(player_id)
+
+    def _on_pairs(self, pairs):
+        # Thread del matchmaker: la stanza nasce sul worker di chi aspettava da più tempo.
+        for host, guest in pairs:
+            alive = [t for t in (host, guest) if t.player_id in self.directory]
+            if len(alive) < 2:
+                for t in alive: self.matchmaker.requeue(t)
+                continue
+            self.inboxes[host.conn].put(("pair", host.player_id, guest.player_id, guest.conn))
+
+    def op_attach(self, owner_worker, player_id):
+        self._to_player(player_id, "attach", player_id, owner_worker)
+
+    def op_forward(self, worker_id, target_worker, op, args):
+        self.inboxes[target_worker].put((op,) + tuple(args))
+
+
+def run_cluster(workers, host="0.0.0.0", port=5000):
+    # Verifica subito che SO_REUSEPORT sia disponibile, prima di avviare i worker.
+    create_reuseport_socket(host, port).close()
+    hub = mp.Queue()
+    inboxes = [mp.Queue() for _ in range(workers)]
+    procs = [mp.Process(target=worker_main, args=(i, host, port, inboxes[i], hub), daemon=True) for i in range(workers)]
+    for p in procs: p.start()
+    print(f"--- CLUSTER ONLINE SU PORTA {port} ({workers} worker) ---")
+    try:
+        Coordinator(hub, inboxes).run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs: p.terminate()
+        print("--- CLUSTER OFFLINE ---")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tris server multi-processo (SO_REUSEPORT)")
+    parser.add_argument("--workers", type=int, default=mp.cpu_count())
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    run_cluster(args.workers, args.host, args.port)
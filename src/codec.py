@@ -0,0 +1,291 @@
+# codec.py
+# Codec binario versionato per i messaggi di protocollo.
+# Payload: [magic 0xB7][versione][codice schema][maschera campi u16][campi...]
+# Ogni schema descrive un tipo di messaggio come lista di campi a layout fisso;
+# la maschera indica quali campi sono presenti. I messaggi che non rientrano in
+# nessuno schema viaggiano come JSON (codice 0), mai come pickle.
+import json
+import struct
+
+BIN_MAGIC = 0xB7
+BIN_VERSION = 1
+
+_HEADER = struct.Struct("!BBBH")
+_U8 = struct.Struct("!B")
+_U16 = struct.Struct("!H")
+_U32 = struct.Struct("!I")
+
+
+class CodecError(Exception):
+    pass
+
+
+class _NoFit(Exception):
+    # Il valore non rientra nel layout del campo: si ripiega su JSON.
+    pass
+
+
+# --- TIPI DI CAMPO ---
+def _enum(*values):
+    index = {v: i for i, v in enumerate(values)}
+
+    def enc(v, out):
+        try: out.append(index[v])
+        except (KeyError, TypeError): raise _NoFit()
+
+    def dec(buf, off):
+        i = buf[off]
+        if i >= len(values): raise CodecError(f"Valore enum non valido: {i}")
+        return values[i], off + 1
+    return enc, dec
+
+
+def _enc_u8(v, out):
+    if type(v) is not int or not 0 <= v < 256: raise _NoFit()
+    out.append(v)
+
+
+def _dec_u8(buf, off):
+    return buf[off], off + 1
+
+
+def _enc_u32(v, out):
+    if type(v) is not int or not 0 <= v <= 0xFFFFFFFF: raise _NoFit()
+    out += _U32.pack(v)
+
+
+def _dec_u32(buf, off):
+    return _U32.unpack_from(buf, off)[0], off + 4
+
+
+def _enc_bool(v, out):
+    if type(v) is not bool: raise _NoFit()
+    out.append(1 if v else 0)
+
+
+def _dec_bool(buf, off):
+    return bool(buf[off]), off + 1
+
+
+def _enc_str(v, out):
+    if type(v) is not str: raise _NoFit()
+    raw = v.encode("utf-8")
+    if len(raw) > 0xFFFF: raise _NoFit()
+    out += _U16.pack(len(raw))
+    out += raw
+
+
+def _dec_str(buf, off):
+    (n,) = _U16.unpack_from(buf, off)
+    off += 2
+    return str(buf[off:off + n], "utf-8"), off + n
+
+
+def _enc_strs(v, out):
+    if type(v) is not list or len(v) > 0xFFFF: raise _NoFit()
+    out += _U16.pack(len(v))
+    for item in v: _enc_str(item, out)
+
+
+def _dec_strs(buf, off):
+    (n,) = _U16.unpack_from(buf, off)
+    off += 2
+    items = []
+    for _ in range(n):
+        item, off = _dec_str(buf, off)
+        items.append(item)
+    return items, off
+
+
+_CELL = {None: 0, "X": 1, "O": 2}
+_CELL_SYM = (None, "X", "O")
+
+
+def _enc_board(v, out):
+    # 9 celle da 2 bit -> 18 bit in 3 byte
+    if type(v) is not list or len(v) != 9: raise _NoFit()
+    packed = 0
+    try:
+        for i, cell in enumerate(v): packed |= _CELL[cell] << (2 * i)
+    except (KeyError, TypeError):
+        raise _NoFit()
+    out += packed.to_bytes(3, "big")
+
+
+def _dec_board(buf, off):
+    packed = int.from_bytes(buf[off:off + 3], "big")
+    board = []
+    for i in range(9):
+        c = (packed >> (2 * i)) & 3
+        if c == 3: raise CodecError("Cella non valida")
+        board.append(_CELL_SYM[c])
+    return board, off + 3
+
+
+_USER_STATUS = ("online", "waiting", "ingame")
+_enc_ustatus, _dec_ustatus = _enum(*_USER_STATUS)
+
+
+def _enc_users(v, out):
+    if type(v) is not list or len(v) > 0xFFFF: raise _NoFit()
+    out += _U16.pack(len(v))
+    for u in v:
+        if type(u) is not dict or u.keys() != {"name", "status"}: raise _NoFit()
+        _enc_str(u["name"], out)
+        _enc_ustatus(u["status"], out)
+
+
+def _dec_users(buf, off):
+    (n,) = _U16.unpack_from(buf, off)
+    off += 2
+    users = []
+    for _ in range(n):
+        name, off = _dec_str(buf, off)
+        status, off = _dec_ustatus(buf, off)
+        users.append({"name": name, "status": status})
+    return users, off
+
+
+FIELD_TYPES = {
+    "u8": (_enc_u8, _dec_u8),
+    "u32": (_enc_u32, _dec_u32),
+    "bool": (_enc_bool, _dec_bool),
+    "str": (_enc_str, _dec_str),
+    "strs": (_enc_strs, _dec_strs),
+    "board": (_enc_board, _dec_board),
+    "sym": _enum(None, "X", "O"),
+    "status": _enum(None, "running", "ended", "waiting", "lobby"),
+    "result": _enum(None, "running", "draw", "X_wins", "O_wins", "disconnected", "X_disconnected", "O_disconnected"),
+    "response": _enum("accept", "decline"),
+    "users": (_enc_users, _dec_users),
+}
+
+
+# --- SCHEMI ---
+# (codice, chiave discriminante, valore, campi): un campo è (percorso, tipo),
+# dove il percorso "data.board" indica obj["data"]["board"].
+SCHEMAS = [
+    # client -> server
+    (1, "action", "ping", ()),
+    (2, "action", "chat", (("message", "str"),)),
+    (3, "action", "start_search", ()),
+    (4, "action", "send_invite", (("target_id", "str"),)),
+    (5, "action", "respond_invite", (("target_id", "str"), ("response", "response"))),
+    (6, "action", "move", (("pos", "u8"),)),
+    (7, "action", "leave_game", (("room_id", "str"),)),
+    (8, "action", "leave_queue", ()),
+    (9, "action", "back_to_lobby", ()),
+    (10, "action", "presence_resync", ()),
+    # server -> client
+    (32, "type", "game_state", (("data.ok", "bool"), ("data.reason", "str"), ("data.board", "board"),
+                                ("data.turn", "sym"), ("data.status", "status"), ("data.result", "result"),
+                                ("data.move", "u8"), ("data.moves", "u8"))),
+    (33, "type", "chat_message", (("data.sender", "str"), ("data.message", "str"))),
+    (34, "type", "player_list_update", (("data", "users"), ("version", "u32"))),
+    (35, "type", "match_found", (("data.game_id", "str"), ("data.you_are", "sym"), ("data.opponent", "str"))),
+    (36, "type", "match_status", (("status", "status"),)),
+    (37, "type", "incoming_invite", (("from", "str"),)),
+    (38, "type", "invite_error", (("message", "str"),)),
+    (39, "type", "invite_declined", (("from", "str"),)),
+    (40, "type", "player_list_delta", (("data.base", "u32"), ("data.version", "u32"), ("data.joined", "users"),
+                                       ("data.left", "strs"), ("data.changed", "users"))),
+]
+
+_JSON_CODE = 0
+
+
+class _Schema:
+    def __init__(self, code, key, value, fields):
+        self.code = code
+        self.key = key
+        self.value = value
+        self.fields = [(tuple(path.split(".")), FIELD_TYPES[kind]) for path, kind in fields]
+        # chiavi ammesse per livello: top-level e sotto-dizionari
+        self.top = {key} | {p[0] for p, _ in self.fields}
+        self.nested = {}
+        for p, _ in self.fields:
+            if len(p) == 2: self.nested.setdefault(p[0], set()).add(p[1])
+
+    def fits(self, obj):
+        if not obj.keys() <= self.top: return False
+        for name, allowed in self.nested.items():
+            sub = obj.get(name)
+            if sub is None and name not in obj: continue
+            if type(sub) is not dict or not sub or not sub.keys() <= allowed: return False
+        return True
+
+
+_BY_CODE = {}
+_BY_KEY = {}
+for _s in SCHEMAS:
+    _schema = _Schema(*_s)
+    _BY_CODE[_schema.code] = _schema
+    _BY_KEY[(_schema.key, _schema.value)] = _schema
+
+
+def _lookup(obj):
+    for key in ("type", "action"):
+        value = obj.get(key)
+        if type(value) is str:
+            return _BY_KEY.get((key, value))
+    return None
+
+
+def _encode_json(obj):
+    try:
+        body = json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    except (TypeError, ValueError) as e:
+        raise CodecError(f"Messaggio non serializzabile: {e}")
+    return _HEADER.pack(BIN_MAGIC, BIN_VERSION, _JSON_CODE, 0) + body
+
+
+def encode(obj):
+    if type(obj) is not dict: return _encode_json(obj)
+    schema = _lookup(obj)
+    if schema is None or not schema.fits(obj): return _encode_json(obj)
+
+    mask = 0
+    body = bytearray()
+    try:
+        for i, (path, (enc, _)) in enumerate(schema.fields):
+            node = obj
+            for part in path:
+                if part not in node: break
+                node = node[part]
+            else:
+                mask |= 1 << i
+                enc(node, body)
+    except _NoFit:
+        return _encode_json(obj)
+    return _HEADER.pack(BIN_MAGIC, BIN_VERSION, schema.code, mask) + body
+
+
+def decode(payload):
+    buf = memoryview(payload)
+    try:
+        magic, version, code, mask = _HEADER.unpack_from(buf, 0)
+    except struct.error as e:
+        raise CodecError(f"Header binario troncato: {e}")
+    if magic != BIN_MAGIC: raise CodecError("Magic byte non valido")
+    if version != BIN_VERSION: raise CodecError(f"Versione codec non supportata: {version}")
+
+    off = _HEADER.size
+    if code == _JSON_CODE:
+        try: return json.loads(str(buf[off:], "utf-8"))
+        except ValueError as e: raise CodecError(f"JSON non valido: {e}")
+
+    schema = _BY_CODE.get(code)
+    if schema is None: raise CodecError(f"Schema sconosciuto: {code}")
+
+    obj = {schema.key: schema.value}
+    try:
+        for i, (path, (_, dec)) in enumerate(schema.fields):
+            if not mask & (1 << i): continue
+            value, off = dec(buf, off)
+            node = obj
+            for part in path[:-1]: node = node.setdefault(part, {})
+            node[path[-1]] = value
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise CodecError(f"Record troncato: {e}")
+    if off != len(buf): raise CodecError("Byte in eccesso nel record")
+    return obj
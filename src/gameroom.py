@@ -3,22 +3,165 @@ import time
 import threading
 import random 
 
+# Linee vincenti del tris
+WIN_LINES = (
+    (0, 1, 2), (3, 4, 5), (6, 7, 8),
+    (0, 3, 6), (1, 4, 7), (2, 5, 8),
+    (0, 4, 8), (2, 4, 6)
+)
+# Per ogni cella, le maschere a 9 bit delle sole linee che la attraversano
+CELL_WIN_MASKS = tuple(
+    tuple(sum(1 << i for i in line) for line in WIN_LINES if pos in line)
+    for pos in range(9)
+)
+FULL_BOARD = (1 << 9) - 1
+# (x << 9 | o) -> tupla delle celle: le posizioni legali sono poche migliaia
+_BOARD_CACHE = {}
+
+
+class ListBoard:
+    # Motore storico: lista di None/"X"/"O", scansione di tutte le linee a ogni mossa.
+    __slots__ = ("cells",)
+
+    def __init__(self):
+        self.cells = [None] * 9
+
+    def is_free(self, pos):
+        return self.cells[pos] is None
+
+    def place(self, pos, symbol):
+        self.cells[pos] = symbol
+
+    def winner_after(self, pos, symbol):
+        for a, b, c in WIN_LINES:
+            if self.cells[a] is not None and self.cells[a] == self.cells[b] == self.cells[c]:
+                return self.cells[a]
+        return None
+
+    def is_full(self):
+        return all(cell is not None for cell in self.cells)
+
+    def to_list(self):
+        return self.cells.copy()
+
+
+class BitBoard:
+    # Due interi a 9 bit (uno per simbolo): si controllano solo le linee della cella giocata.
+    __slots__ = ("x", "o")
+
+    def __init__(self):
+        self.x = 0
+        self.o = 0
+
+    def is_free(self, pos):
+        return not ((self.x | self.o) >> pos) & 1
+
+    def place(self, pos, symbol):
+        if symbol == "X": self.x |= 1 << pos
+        else: self.o |= 1 << pos
+
+    def winner_after(self, pos, symbol):
+        bits = self.x if symbol == "X" else self.o
+        for mask in CELL_WIN_MASKS[pos]:
+            if bits & mask == mask: return symbol
+        return None
+
+    def is_full(self):
+        return (self.x | self.o) == FULL_BOARD
+
+    def to_list(self):
+        key = self.x << 9 | self.o
+        cells = _BOARD_CACHE.get(key)
+        if cells is None:
+            x, o = self.x, self.o
+            cells = _BOARD_CACHE[key] = tuple("X" if (x >> i) & 1 else "O" if (o >> i) & 1 else None for i in range(9))
+        return list(cells)
+
+
+class GridBoard:
+    # Varianti N×N con K in fila (es. gomoku 15×15, 5 in fila): una cella per byte
+    # (0 vuota, 1 X, 2 O). La vittoria si cerca solo nelle quattro direzioni che
+    # passano per l'ultima mossa, al massimo 2·(K-1) celle per direzione.
+    __slots__ = ("size", "win", "cells", "filled")
+
+    def __init__(self, size=3, win=3):
+        self.size = size
+        self.win = win
+        self.cells = bytearray(size * size)
+        self.filled = 0
+
+    def is_free(self, pos):
+        return not self.cells[pos]
+
+    def place(self, pos, symbol):
+        self.cells[pos] = 1 if symbol == "X" else 2
+        self.filled += 1
+
+    def winner_after(self, pos, symbol):
+        n, cells = self.size, self.cells
+        value = cells[pos]
+        row, col = divmod(pos, n)
+        for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            count = 1
+            for step in (1, -1):
+                r, c = row + dr * step, col + dc * step
+                while count < self.win and 0 <= r < n and 0 <= c < n and cells[r * n + c] == value:
+                    count += 1
+                    r += dr * step
+                    c += dc * step
+            if count >= self.win: return symbol
+        return None
+
+    def is_full(self):
+        return self.filled == len(self.cells)
+
+    def to_list(self):
+        return [_SYMBOLS[v] for v in self.cells]
+
+
+_SYMBOLS = (None, "X", "O")
+ENGINES = {"list": ListBoard, "bitboard": BitBoard, "grid": GridBoard}
+DEFAULT_ENGINE = "bitboard"
+# Lato massimo: le posizioni devono stare in un byte (move_history, storico).
+MAX_SIZE = 16
+
+
 class GameRoomError(Exception):
     pass
 
 class GameRoom:
-    def __init__(self, creator_id):
+    __slots__ = ("lock", "id", "players", "connections", "engine", "size", "win", "turn", "status",
+                 "move_history", "created_at", "ended_at", "recorded")
+
+    def __init__(self, creator_id, engine=DEFAULT_ENGINE, size=3, win=3):
+        if not (3 <= size <= MAX_SIZE and 3 <= win <= size):
+            raise GameRoomError(f"Variante non valida: {size}x{size}, {win} in fila")
         self.lock = threading.Lock()
         self.id = str(uuid.uuid4())
         self.players = {creator_id: None} 
         
         self.connections = {} 
-        self.board = [None] * 9
+        # I motori a 9 celle valgono solo per il tris classico.
+        self.size = size
+        self.win = win
+        self.engine = ENGINES[engine]() if (size, win) == (3, 3) else GridBoard(size, win)
         self.turn = None
         self.status = "waiting"
-        self.move_history = []
+        # Una posizione per byte: X muove sempre per primo e i turni si alternano,
+        # quindi il simbolo (e il giocatore) di ogni mossa si ricava dall'indice.
+        self.move_history = bytearray()
         self.created_at = time.time()
         self.ended_at = None
+        self.recorded = False   # già passata a GameStore.record
+
+    @property
+    def board(self):
+        return self.engine.to_list()
+
+    def replay_moves(self, moves):
+        # Ricostruisce board e storico da una sequenza di mosse (riavvio con handoff).
+        for i, pos in enumerate(moves): self.engine.place(pos, "X" if i % 2 == 0 else "O")
+        self.move_history = bytearray(moves)
 
     def add_player(self, player_id, conn):
         with self.lock:
@@ -59,21 +202,21 @@ class GameRoom:
             if self.turn != player_symbol:
                 return {"ok": False, "reason": "Not your turn"}
             
-            if not (0 <= pos < 9) or self.board[pos] is not None:
+            if type(pos) is not int or not (0 <= pos < self.size * self.size) or not self.engine.is_free(pos):
                 return {"ok": False, "reason": "Invalid move"}
 
-            self.board[pos] = player_symbol
-            self.move_history.append({"player": player_id, "pos": pos})
+            self.engine.place(pos, player_symbol)
+            self.move_history.append(pos)
             
             # CONTROLLA VINCITORE
-            winner = self._check_winner()
+            winner = self.engine.winner_after(pos, player_symbol)
             
             if winner:
                 self.status = "ended"
                 self.ended_at = time.time()
                 result = f"{winner}_wins"
                 next_turn = None
-            elif all(cell is not None for cell in self.board):
+            elif self.engine.is_full():
                 self.status = "ended"
                 self.ended_at = time.time()
                 result = "draw"
@@ -83,21 +226,12 @@ class GameRoom:
                 next_turn = self.turn
                 result = "running"
 
+            # Solo la mossa: la board completa la aggiunge chi invia, se serve.
             return {
                 "ok": True,
-                "board": self.board.copy(),
+                "move": pos,
+                "moves": len(self.move_history),
                 "turn": next_turn,
                 "status": self.status,
                 "result": result
             }
-
-    def _check_winner(self):
-        lines = [
-            (0, 1, 2), (3, 4, 5), (6, 7, 8),
-            (0, 3, 6), (1, 4, 7), (2, 5, 8),
-            (0, 4, 8), (2, 4, 6)
-        ]
-        for a, b, c in lines:
-            if self.board[a] is not None and self.board[a] == self.board[b] == self.board[c]:
-                return self.board[a]
-        return None
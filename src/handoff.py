@@ -0,0 +1,175 @@
+# handoff.py
+# Riavvio senza interruzioni (solo Unix, server threaded). Il processo nuovo si
+# collega al socket Unix di controllo di quello in servizio, che:
+# - chiude la Gate: i thread dei client si fermano tra un frame e l'altro e
+#   lasciano il proprio stato, compresi i byte già letti e non ancora interpretati;
+# - passa con SCM_RIGHTS il socket in ascolto e i socket di tutti i client;
+# - manda una fotografia dello stato in un frame del protocollo (pickle ristretto
+#   di protocollo.py: solo tipi base) e aspetta la conferma.
+# I client restano sullo stesso socket TCP: niente riconnessione né nuovo login.
+# Se qualcosa va storto prima della conferma la Gate si riapre e il processo
+# vecchio continua come se niente fosse.
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from protocollo import pack_msg, recv_msg, recv_exact
+
+MAX_SNAPSHOT = 256 << 20
+TIMEOUT = 30.0
+ACK = b"K"
+_FDS_PER_MSG = 250      # SCM_MAX_FD su Linux è 253
+_COUNT = struct.Struct("!I")
+
+
+class HandoffError(Exception):
+    pass
+
+
+def available():
+    return hasattr(socket, "AF_UNIX") and hasattr(socket, "send_fds")
+
+
+class Gate:
+    # Davanti a ogni recv dei client (FrameReader.wait) e all'accept del listener.
+    def __init__(self):
+        self.frozen = False
+        self.done = False
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._cond = threading.Condition()
+        self._parked = {}       # socket -> stato della connessione
+
+    def _ready(self, sock):
+        # True se `sock` ha dati (o è chiuso), False se ci ha svegliato freeze().
+        if sock.fileno() < 0: return True
+        if hasattr(select, "poll"):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            poller.register(self._wake_r, select.POLLIN)
+            wake = self._wake_r.fileno()
+            return any(fd != wake for fd, _ in poller.poll())
+        readable, _, _ = select.select([sock, self._wake_r], [], [])
+        return sock in readable
+
+    def wait(self, sock, state):
+        # Client: torna quando ci sono dati. A gate chiusa il thread si ferma qui
+        # lasciando state(); dopo un passaggio riuscito non riparte più.
+        while True:
+            with self._cond:
+                if self.frozen:
+                    self._parked[sock] = state()
+                    self._cond.notify_all()
+                    while self.frozen: self._cond.wait()
+            if self._ready(sock) and not self.frozen: return
+
+    def accepting(self, sock):
+        # Listener: True con una connessione da accettare, False dopo il passaggio.
+        while True:
+            with self._cond:
+                while self.frozen and not self.done: self._cond.wait()
+                if self.done: return False
+            if self._ready(sock) and not self.frozen: return True
+
+    def freeze(self):
+        with self._cond:
+            self.frozen = True
+            self._wake_w.send(b"x")
+
+    def wait_parked(self, count, timeout):
+        # Stato delle connessioni ferme (socket -> stato) quando lo sono tutte le
+        # count(); None se non succede entro `timeout`.
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self._parked) < count():
+                left = deadline - time.monotonic()
+                if left <= 0: return None
+                self._cond.wait(min(left, 0.05))
+            return dict(self._parked)
+
+    def thaw(self):
+        with self._cond:
+            self.frozen = False
+            self._parked.clear()
+            self._wake_r.recv(16)
+            self._cond.notify_all()
+
+    def finish(self):
+        # Passaggio riuscito: i client restano fermi per sempre, il listener esce.
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+
+# --- Processo in servizio ---
+def serve(path, on_request, log=print):
+    # Socket di controllo: ogni connessione è una richiesta di passaggio, gestita
+    # da on_request(channel) -> True se il processo nuovo ha confermato.
+    try: os.unlink(path)
+    except FileNotFoundError: pass
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)     # solo lo stesso utente può prendere il posto del server
+    try: server.bind(path)
+    finally: os.umask(old_umask)
+    server.listen(1)
+
+    def run():
+        while True:
+            try: channel, _ = server.accept()
+            except OSError: return
+            channel.settimeout(TIMEOUT)
+            with channel:
+                try: done = on_request(channel)
+                except Exception as e:
+                    log(f"[Handoff] Errore: {e}")
+                    done = False
+            # Il path ora è del processo nuovo: non si cancella.
+            if done:
+                server.close()
+                return
+
+    threading.Thread(target=run, daemon=True).start()
+    return server
+
+
+def send(channel, listen_sock, socks, snapshot):
+    # Socket in ascolto per primo, poi i client a blocchi, poi la fotografia.
+    fds = [listen_sock.fileno()] + [s.fileno() for s in socks]
+    channel.sendall(_COUNT.pack(len(fds)))
+    for i in range(0, len(fds), _FDS_PER_MSG):
+        chunk = fds[i:i + _FDS_PER_MSG]
+        socket.send_fds(channel, [_COUNT.pack(len(chunk))], chunk)
+    channel.sendall(pack_msg(snapshot))
+
+
+def confirmed(channel):
+    try: return channel.recv(1) == ACK
+    except OSError: return False
+
+
+# --- Processo nuovo ---
+def receive(path):
+    # (canale, socket in ascolto, socket dei client, fotografia); None se su
+    # `path` non c'è un processo da sostituire.
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    channel.settimeout(TIMEOUT)
+    try: channel.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        channel.close()
+        return None
+    fds = []
+    try:
+        (total,) = _COUNT.unpack(recv_exact(channel, _COUNT.size))
+        while len(fds) < total:
+            data, chunk, _, _ = socket.recv_fds(channel, _COUNT.size, _FDS_PER_MSG)
+            fds.extend(chunk)
+            if len(data) != _COUNT.size or _COUNT.unpack(data)[0] != len(chunk):
+                raise HandoffError("Passaggio dei socket interrotto")
+        snapshot = recv_msg(channel, MAX_SNAPSHOT)
+    except Exception:
+        for fd in fds: os.close(fd)
+        channel.close()
+        raise
+    socks = [socket.socket(fileno=fd) for fd in fds]
+    return channel, socks[0], socks[1:], snapshot
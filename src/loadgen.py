@@ -0,0 +1,392 @@
+# loadgen.py
+# Generatore di carico senza GUI: N client simulati (asyncio, un solo processo)
+# che parlano il framing di protocollo.py. Ogni client fa login, scrive in chat,
+# trova partita con start_search o con un invito diretto, gioca mosse casuali
+# legali per --games partite; una parte si disconnette a metà partita.
+# Riporta connessioni/s, mosse/s, latenza mossa -> game_state (p50/p99) e, se
+# conosce il pid del server, memoria per connessione e CPU (da /proc, solo Linux).
+#
+#   python server.py --mode threaded --quiet &
+#   python loadgen.py --clients 2000 --server-pid $!
+#   python loadgen.py --clients 2000 --spawn threaded,asyncio,cluster
+# threaded e asyncio eseguono le stesse azioni (main.Client) e differiscono solo
+# nel trasporto: il confronto misura il modello di I/O. Vale finché nessuna modalità
+# lascia più dell'1% dei client senza avversario o in timeout (colonna "falliti").
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+from protocollo import send_msg_async, recv_msg_async, set_codec, ProtocolError, SUPPORTED_CODECS
+from server import MODES, raise_fd_limit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Messaggi che il client simulato non guarda: li scarta già il lettore.
+IGNORED = {"player_list_update", "player_list_delta", "chat_message", "match_status", "ping"}
+
+
+class Stats:
+    def __init__(self):
+        self.connect_times = []
+        self.refused = 0
+        self.moves = 0
+        self.latencies = []
+        self.games = 0
+        self.abandoned = 0
+        self.invites = 0
+        self.chats = 0
+        self.unmatched = 0
+        self.last_move = None
+        self.timeouts = 0
+        self.errors = 0
+
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+# --- Risorse del server da /proc ---
+def proc_tree(pid):
+    # Il pid e i suoi discendenti (in modalità cluster: coordinatore + worker).
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit(): continue
+        try:
+            with open(f"/proc/{entry}/stat") as f: ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError): continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        tree.append(p)
+        todo.extend(children.get(p, ()))
+    return tree
+
+
+def proc_usage(pid):
+    # (RSS in byte, secondi di CPU utente + sistema) sommati su tutto l'albero.
+    if not pid: return None
+    page, tick = os.sysconf("SC_PAGE_SIZE"), os.sysconf("SC_CLK_TCK")
+    rss = cpu = 0
+    for p in proc_tree(pid):
+        try:
+            with open(f"/proc/{p}/statm") as f: rss += int(f.read().split()[1]) * page
+            with open(f"/proc/{p}/stat") as f: fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / tick
+        except (OSError, IndexError, ValueError): continue
+    return rss, cpu
+
+
+# --- Client simulato ---
+class Client:
+    def __init__(self, index, args, stats, peers):
+        self.index = index
+        self.name = f"{args.prefix}{index}"
+        self.args = args
+        self.stats = stats
+        self.peers = peers
+        self.rng = random.Random(args.seed * 100003 + index)
+        self.reader = self.writer = None
+        self.inbox = asyncio.Queue()
+        self.ready = asyncio.Event()    # in lobby e libero: si può invitare
+        self.gone = False
+        self._reader_task = None
+
+    async def connect(self):
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        login = {"player_id": self.name}
+        if not self.args.legacy: login["features"] = ["presence_delta", "move_delta"]
+        if self.args.codec != "pickle": login["codecs"] = [self.args.codec]
+        await send_msg_async(self.writer, login)
+        reply = await asyncio.wait_for(recv_msg_async(self.reader), self.args.timeout)
+        if not reply or not reply.get("ok"): raise ProtocolError(f"Login rifiutato: {reply}")
+        if reply.get("codec"): set_codec(self.writer, reply["codec"])
+        self.stats.connect_times.append(time.perf_counter() - start)
+        self._reader_task = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        # Un lettore per client: expect() aspetta sulla coda, così un timeout non
+        # interrompe mai la lettura a metà frame.
+        try:
+            while True:
+                msg = await recv_msg_async(self.reader)
+                if msg.get("type") not in IGNORED: self.inbox.put_nowait(msg)
+        except Exception:
+            self.inbox.put_nowait(None)
+
+    async def send(self, obj):
+        await send_msg_async(self.writer, obj)
+
+    async def expect(self, *types, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.args.timeout if timeout is None else timeout)
+        while True:
+            msg = await asyncio.wait_for(self.inbox.get(), max(0.0, deadline - loop.time()))
+            if msg is None: raise ConnectionError("Connessione chiusa dal server")
+            if msg.get("type") in types: return msg
+
+    async def quit(self):
+        # logout prima di chiudere: senza, il server terrebbe la sessione (e la
+        # partita) in sospeso per il periodo di grazia.
+        if not self.gone:
+            try: await self.send({"action": "logout"})
+            except Exception: pass
+        self.close()
+
+    def close(self):
+        self.gone = True
+        if self._reader_task: self._reader_task.cancel()
+        if self.writer:
+            try: self.writer.close()
+            except Exception: pass
+
+    # --- Scenario ---
+    async def run(self, start):
+        await start.wait()
+        try:
+            for _ in range(self.args.games):
+                if self.rng.random() < self.args.chat:
+                    await self.send({"action": "chat", "message": f"ciao da {self.name}"})
+                    self.stats.chats += 1
+                match = await self.find_match()
+                if match is None:
+                    # Rimasto senza avversario (gli altri hanno finito o abbandonato).
+                    self.stats.unmatched += 1
+                    return
+                if not await self.play(match): return
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+        except Exception:
+            self.stats.errors += 1
+        finally:
+            await self.quit()
+
+    async def find_match(self):
+        # Le coppie (2k, 2k+1) con k < invite_pairs giocano su invito, gli altri in coda.
+        if self.index < 2 * self.args.invite_pairs:
+            partner = self.peers[self.index ^ 1]
+            if partner is not None and not partner.gone:
+                match = await (self.invite(partner) if self.index % 2 == 0 else self.wait_invite())
+                if match: return match
+        await self.send({"action": "start_search"})
+        try: return await self.expect("match_found", timeout=self.args.match_wait)
+        except asyncio.TimeoutError:
+            await self.send({"action": "leave_queue"})
+            return None
+
+    async def invite(self, partner):
+        try: await asyncio.wait_for(partner.ready.wait(), self.args.invite_wait)
+        except asyncio.TimeoutError: return None
+        partner.ready.clear()
+        await self.send({"action": "send_invite", "target_id": partner.name})
+        msg = await self.expect("match_found", "invite_error", "invite_declined")
+        if msg["type"] != "match_found": return None
+        self.stats.invites += 1
+        return msg
+
+    async def wait_invite(self):
+        self.ready.set()
+        try: msg = await self.expect("incoming_invite", timeout=self.args.invite_wait)
+        except asyncio.TimeoutError: return None
+        finally: self.ready.clear()
+        await self.send({"action": "respond_invite", "target_id": msg["from"], "response": "accept"})
+        return await self.expect("match_found")
+
+    async def play(self, match):
+        data = match["data"]
+        me, game_id = data["you_are"], data["game_id"]
+        board, turn = [None] * 9, "X"
+        quit_at = self.rng.randrange(4) if self.rng.random() < self.args.abandon else None
+        played, sent = 0, None
+        while True:
+            if turn == me and sent is None:
+                if quit_at is not None and played >= quit_at:
+                    # Uscita a metà partita: l'avversario vince a tavolino.
+                    self.stats.abandoned += 1
+                    await self.quit()
+                    return False
+                pos = self.rng.choice([i for i, cell in enumerate(board) if cell is None])
+                sent = time.perf_counter()
+                await self.send({"action": "move", "pos": pos})
+            state = (await self.expect("game_state"))["data"]
+            ok = state.get("ok")
+            # Gli inviti mandano uno stato iniziale senza "ok": non è una risposta.
+            if ok is None and state.get("status") == "running": continue
+            if ok is False:
+                # Mossa rifiutata (di solito l'avversario è appena uscito): si
+                # aspetta lo stato successivo senza rigiocare.
+                self.stats.errors += 1
+                sent, turn = None, None
+                continue
+            if sent is not None and turn == me:
+                now = self.stats.last_move = time.perf_counter()
+                self.stats.latencies.append(now - sent)
+                self.stats.moves += 1
+                played += 1
+            sent = None
+            # Con move_delta arriva solo la mossa: X ha giocato le mosse dispari.
+            if "board" in state: board = state["board"]
+            elif "move" in state: board[state["move"]] = "X" if state["moves"] % 2 else "O"
+            turn = state.get("turn")
+            if state.get("status") == "ended": break
+
+        if ok:
+            self.stats.games += 1 if me == "X" else 0
+            # Chiude la stanza solo X; O aspetta l'avviso di uscita, così non
+            # gli arriva durante la partita successiva.
+            if me == "X": await self.send({"action": "leave_game", "room_id": game_id})
+            else:
+                try: await self.expect("game_state", timeout=2)
+                except asyncio.TimeoutError: pass
+        await self.send({"action": "back_to_lobby"})
+        return True
+
+
+async def connect_all(clients, concurrency, stats):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(client):
+        async with gate:
+            try: await client.connect()
+            except Exception:
+                stats.refused += 1
+                client.close()
+
+    await asyncio.gather(*(one(c) for c in clients))
+
+
+async def load(args, server_pid):
+    stats = Stats()
+    peers = [None] * args.clients
+    clients = [Client(i, args, stats, peers) for i in range(args.clients)]
+    peers[:] = clients
+
+    base = proc_usage(server_pid)
+    own = os.times()
+    t0 = time.perf_counter()
+    await connect_all(clients, args.concurrency, stats)
+    t1 = time.perf_counter()
+    connected_usage = proc_usage(server_pid)
+
+    start = asyncio.Event()
+    alive = [c for c in clients if not c.gone]
+    tasks = [asyncio.ensure_future(c.run(start)) for c in alive]
+    start.set()
+    await asyncio.gather(*tasks)
+    end = proc_usage(server_pid)
+    own = sum(os.times()[:2]) - sum(own[:2])
+    # Fino all'ultima mossa: chi resta senza avversario non allunga la misura.
+    t2 = stats.last_move or time.perf_counter()
+    return stats, t1 - t0, t2 - t1, base, connected_usage, end, own
+
+
+def report(label, args, result):
+    stats, connect_secs, play_secs, base, connected_usage, end, own = result
+    connected = len(stats.connect_times)
+    row = {
+        "mode": label,
+        "conn_s": connected / connect_secs if connect_secs else 0,
+        "moves_s": stats.moves / play_secs if play_secs else 0,
+        "p50_ms": percentile(stats.latencies, 0.50) * 1000,
+        "p99_ms": percentile(stats.latencies, 0.99) * 1000,
+        "kib_conn": None,
+        "cpu_pct": None,
+        "failed": stats.unmatched + stats.timeouts + stats.errors,
+    }
+    print(f"[{label}] {connected}/{args.clients} client connessi in {connect_secs:.2f} s "
+          f"({row['conn_s']:,.0f} conn/s), rifiutati {stats.refused}")
+    print(f"  partite {stats.games} (via invito {stats.invites}, abbandonate {stats.abandoned}), "
+          f"chat {stats.chats}, mosse {stats.moves} in {play_secs:.2f} s ({row['moves_s']:,.0f} mosse/s)")
+    print(f"  latenza mossa -> game_state: p50 {row['p50_ms']:.2f} ms, p99 {row['p99_ms']:.2f} ms")
+    if base and connected_usage and end:
+        row["kib_conn"] = (connected_usage[0] - base[0]) / 1024 / max(1, connected)
+        cpu = end[1] - base[1]
+        row["cpu_pct"] = cpu / (connect_secs + play_secs) * 100
+        print(f"  server: RSS {connected_usage[0] / 2**20:.1f} MiB, {row['kib_conn']:.1f} KiB/connessione, "
+              f"CPU {cpu:.2f} s ({row['cpu_pct']:.0f}% di un core)")
+    print(f"  loadgen CPU {own:.2f} s, senza avversario {stats.unmatched}, "
+          f"timeout {stats.timeouts}, errori {stats.errors}")
+    return row
+
+
+# --- Server avviati dal loadgen ---
+def spawn_server(mode, args):
+    cmd = [sys.executable, os.path.join(HERE, "server.py"), "--mode", mode,
+           "--host", args.host, "--port", str(args.port), "--quiet"]
+    if mode == "cluster": cmd += ["--workers", str(args.workers)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((args.host, args.port), timeout=1).close()
+            break
+        except OSError:
+            if proc.poll() is not None: raise SystemExit(f"Il server '{mode}' non è partito")
+            time.sleep(0.1)
+    # In cluster la porta risponde appena parte il primo worker: si aspettano gli altri.
+    time.sleep(1.0 if mode == "cluster" else 0.2)
+    return proc
+
+
+def stop_server(proc):
+    proc.send_signal(signal.SIGINT)
+    try: proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generatore di carico per il server Tris")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--games", type=int, default=3, help="partite per client")
+    parser.add_argument("--concurrency", type=int, default=200, help="connessioni aperte in parallelo")
+    parser.add_argument("--chat", type=float, default=0.2, help="probabilità di un messaggio in lobby prima di ogni partita")
+    parser.add_argument("--abandon", type=float, default=0.05, help="probabilità di disconnettersi a metà partita")
+    parser.add_argument("--invites", type=float, default=0.2, help="quota di client che gioca su invito")
+    parser.add_argument("--invite-wait", type=float, default=2.0)
+    parser.add_argument("--match-wait", type=float, default=5.0, help="attesa massima in coda prima di rinunciare")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--codec", choices=SUPPORTED_CODECS, default="pickle")
+    parser.add_argument("--legacy", action="store_true", help="lista giocatori e board complete invece dei delta")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server-pid", type=int, help="pid del server già avviato (memoria e CPU)")
+    parser.add_argument("--spawn", help=f"avvia il server in queste modalità, una dopo l'altra ({','.join(MODES)})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker in modalità cluster")
+    args = parser.parse_args()
+    args.invite_pairs = int(args.clients * args.invites) // 2
+    args.prefix = f"lg{os.getpid() % 100000}-"
+
+    raise_fd_limit()
+    rows = []
+    if not args.spawn:
+        rows.append(report(f"{args.host}:{args.port}", args, asyncio.run(load(args, args.server_pid))))
+    else:
+        for mode in args.spawn.split(","):
+            if mode not in MODES: raise SystemExit(f"Modalità sconosciuta: {mode}")
+            proc = spawn_server(mode, args)
+            try: rows.append(report(mode, args, asyncio.run(load(args, proc.pid))))
+            finally: stop_server(proc)
+
+    if len(rows) > 1:
+        print(f"\n{'modalità':<10} {'conn/s':>9} {'mosse/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'KiB/conn':>9} {'CPU %':>6} {'falliti':>8}")
+        for r in rows:
+            kib = f"{r['kib_conn']:.1f}" if r["kib_conn"] is not None else "-"
+            cpu = f"{r['cpu_pct']:.0f}" if r["cpu_pct"] is not None else "-"
+            print(f"{r['mode']:<10} {r['conn_s']:>9,.0f} {r['moves_s']:>9,.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {kib:>9} {cpu:>6} {r['failed']:>8}")
+        # Qualche client dispari resta senza avversario anche a server sano.
+        if any(r["failed"] > args.clients // 100 for r in rows):
+            print("Client senza avversario, in timeout o con errori: i numeri non misurano solo il trasporto.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# logpipe.py
+# Log non bloccante. emit() si limita ad accodare (deque.append è atomico: nessun
+# lock, nessuna attesa per chi logga); un solo thread consumatore ogni `interval`
+# secondi prende tutto il blocco accumulato e:
+# - lo stampa su stdout con una sola write;
+# - lo passa alla GUI con una sola chiamata (quindi un solo page.update);
+# - lo scrive su file a rotazione, una riga JSON per evento, filtrando per livello.
+import atexit
+import collections
+import json
+import logging
+import logging.handlers
+import sys
+import threading
+import time
+
+LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARNING": logging.WARNING, "ERROR": logging.ERROR}
+
+
+def level_of(message):
+    # I messaggi del server portano già un tag: il livello si ricava da quello.
+    if "[Errore]" in message or "[Error]" in message or message.startswith("Errore"): return logging.ERROR
+    if "[Lento]" in message: return logging.WARNING
+    if message.startswith(("[Connect]", "[Disconnect]")): return logging.DEBUG
+    return logging.INFO
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({"ts": round(record.created, 3), "level": record.levelname, "msg": record.getMessage()},
+                          ensure_ascii=False)
+
+
+class LogPipe:
+    def __init__(self, interval=0.1, max_pending=100000, echo=True):
+        self.interval = interval
+        self.echo = echo
+        self.sink = None                # callback(blocco) della GUI, dal thread consumatore
+        self.sink_level = logging.DEBUG
+        self.dropped = 0
+        # Limitata: se il consumatore resta indietro si perdono le righe più vecchie.
+        self._queue = collections.deque(maxlen=max_pending)
+        self._file = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def emit(self, message, level=None):
+        if len(self._queue) == self._queue.maxlen: self.dropped += 1
+        self._queue.append((time.time(), level or level_of(message), message))
+
+    def open_file(self, path, level="INFO", max_bytes=5 * 1024 * 1024, backups=3):
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(_JsonFormatter())
+        logger = logging.getLogger("tris")
+        logger.propagate = False
+        logger.setLevel(LEVELS[level])
+        logger.addHandler(handler)
+        self._file = logger
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try: self.flush()
+            except Exception as e: sys.stderr.write(f"[Log] Errore: {e}\n")
+
+    def flush(self):
+        batch = []
+        queue = self._queue
+        while queue:
+            try: batch.append(queue.popleft())
+            except IndexError: break
+        if not batch: return
+
+        if self.echo:
+            sys.stdout.write("\n".join(msg for _, _, msg in batch) + "\n")
+            sys.stdout.flush()
+        logger = self._file
+        if logger:
+            for ts, level, msg in batch:
+                if not logger.isEnabledFor(level): continue
+                record = logger.makeRecord(logger.name, level, "", 0, msg, None, None)
+                record.created = ts
+                logger.handle(record)
+        sink = self.sink
+        if sink:
+            shown = [entry for entry in batch if entry[1] >= self.sink_level]
+            if shown: sink(shown)
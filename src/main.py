@@ -2,288 +2,994 @@ import socket
 import threading
 import time
 import flet as ft
-from protocollo import recv_msg, send_msg
-from gameroom import GameRoom, GameRoomError
+from protocollo import FrameReader, send_msg, pack_for, choose_codec, set_codec, codec_of, recode_frame
+from gameroom import GameRoom, MAX_SIZE
+from registry import RoomRegistry
+from matchmaking import Matchmaker
+from aio_server import AsyncServer
+from presence import PresenceHub, FEATURE_DELTA
+from outbound import Outbound, queue_stats
+from logpipe import LogPipe
+from storage import GameStore
+from sessions import SessionManager, FEATURE_SESSION
+from timerwheel import TimerWheel, IdleWatch
+from spectators import SpectatorHub
+from chat import ChatHub, LOBBY, room_channel, dm_channel
+from bot import Bot, LEVELS, DEFAULT_LEVEL, is_bot, level_of
+import handoff
+from handoff import HandoffError
+import metrics
+from metrics import InstrumentedLock, BROADCAST_FANOUT, BROADCAST_SECONDS
 
 # STATI GLOBALI 
-rooms = {}              
-waiting_room = None     
+rooms = RoomRegistry(lock=lambda: InstrumentedLock("rooms"))  # stanze + indice player_id -> room_id, con lock a partizioni
 
 # Dizionario: player_id -> {"conn": conn, "status": "online" | "waiting" | "ingame"}
 players_data = {} 
 
 # Locks
-players_lock = threading.Lock() 
-rooms_lock = threading.Lock()
-waiting_lock = threading.Lock()
+players_lock = InstrumentedLock("players")
 active_conn_lock = threading.Lock()
 
-# Tracking Socket Attivi
+# Tracking Socket Attivi (socket nel server threaded, LoopOutbound in quello asyncio)
 active_connections = []     
 
 # Stato Server
 server_running = False
 server_socket = None
-gui_log_callback = None
+
+# Modalità: "threaded" (un thread per client) oppure "asyncio" (un solo event loop);
+# in entrambe ogni connessione è un Client, cambia solo chi legge e scrive i socket.
+SERVER_MODES = ("threaded", "asyncio")
+server_mode = "threaded"
+aio_server = None
+
+# Bus verso il coordinatore quando il processo è un worker del cluster (vedi cluster.py)
+cluster = None
+
+# Log: i thread dei client accodano e basta, stdout/GUI/file li serve un solo consumatore
+logpipe = LogPipe()
+GUI_LOG_LINES = 500     # righe tenute nella console, le più vecchie si eliminano
 
 def log(message):
-    print(message) 
-    if gui_log_callback:
-        gui_log_callback(message)
+    logpipe.emit(message)
+
+# Storico partite (SQLite in WAL): le partite finite si accodano, le scrive un thread
+STORE_PATH = "tris_games.db"
+store = GameStore(log=log)
+
+# Scadenze (heartbeat, connessioni inattive, ricerche, inviti, periodi di grazia):
+# tutte su una sola ruota, nessun thread o timer per connessione.
+HEARTBEAT_INTERVAL = 20.0   # silenzio dopo cui il server manda un ping (feature "heartbeat")
+IDLE_TIMEOUT = 60.0         # silenzio dopo cui la connessione si considera morta (idem, e prima del login)
+SEARCH_TIMEOUT = 120.0      # ricerca di partita senza avversario
+INVITE_TIMEOUT = 30.0       # invito senza risposta
+INVITE_START_DELAY = 0.5    # tra match_found e lo stato iniziale di una partita da invito
+wheel = TimerWheel(log=log)
+
+# Sessioni riprendibili (feature "session" al login): chi cade resta in gioco per SESSION_GRACE secondi
+SESSION_GRACE = 30.0
+sessions = SessionManager(grace=SESSION_GRACE, log=log, wheel=wheel)
+
+# Bot: chi cerca partita da BOT_AFTER secondi senza trovare nessuno gioca contro il
+# server (livello scelto con "bot" in start_search, false per non volerlo)
+BOT_AFTER = 15.0
+BOT_THINK = 0.6         # pausa prima di ogni mossa del bot
+BOTS = {level: Bot(level) for level in LEVELS}
+
+# Inviti in attesa di risposta: (invitato, chi invita) -> (timer di scadenza, variante)
+pending_invites = {}
+invites_lock = threading.Lock()
+
+# Lista giocatori: delta versionati inviati in batch da un thread dedicato
+presence = PresenceHub(log=log)
+
+# Client che dichiarano questa feature al login ricevono solo le mosse, non la board
+FEATURE_MOVE_DELTA = "move_delta"
+# ... e questa se rispondono ai ping del server con {"action": "ping"}
+FEATURE_HEARTBEAT = "heartbeat"
+
+# Spettatori: l'ultimo stato di ogni stanza osservata, inviato da un thread dedicato
+spectators = SpectatorHub(log=log)
+
+# Chat a canali (lobby, stanze, privati) con storico e limite di messaggi per utente
+channels = ChatHub(log=log)
+
+# Riavvio senza interruzioni (server.py --handoff): gate davanti alle recv dei client
+handoff_gate = None
+HANDOFF_FREEZE_TIMEOUT = 5.0   # attesa massima perché tutti i client si fermino
 
 # --- FUNZIONI DI UTILITÀ ---
 def broadcast_player_list():
+    # I client locali ricevono la lista da PresenceHub (delta in batch, fuori dai
+    # thread dei client). Qui resta solo la pubblicazione verso il coordinatore.
+    if cluster:
+        with players_lock:
+            cluster.publish_presence({pid: data["status"] for pid, data in players_data.items()})
+
+def send_to_all(conns, msg_obj):
+    # Serializza una volta per codec e accoda: nessun invio blocca sul socket di un altro.
+    start = time.perf_counter()
+    frames = {}
+    failed = []
+    for c in conns:
+        try: c.sendall(pack_for(c, msg_obj, frames))
+        except Exception: failed.append(c)
+    BROADCAST_FANOUT.observe(len(conns), msg_obj["type"])
+    BROADCAST_SECONDS.observe(time.perf_counter() - start, msg_obj["type"])
+    return failed
+
+def spectate_state(room, data):
+    # Messaggio per gli spettatori; da chiamare col lock della stanza.
+    by_symbol = {s: pid for pid, s in room.players.items()}
+    return {"type": "spectate_state", "data": {
+        "game_id": room.id, "x": by_symbol.get("X"), "o": by_symbol.get("O"), "size": room.size, "win": room.win,
+        "board": data.get("board", room.board), "turn": data.get("turn", room.turn),
+        "status": data.get("status", room.status), "result": data.get("result")}}
+
+def broadcast_game_state(room, data):
+    # Dopo una mossa i client con la feature "move_delta" ricevono solo la mossa
+    # ("move", "moves"); gli altri la board completa, costruita solo se serve.
+    with room.lock:
+        if "turn" not in data: data["turn"] = room.turn
+        targets = list(room.connections.items())
+        delta = [c for _, c in targets if "move" in data and getattr(c, "move_deltas", False)]
+        full = [c for _, c in targets if not any(c is d for d in delta)]
+        watched = room.id in spectators and data.get("ok", True)
+        full_data = data
+        if full or watched:
+            full_data = {k: v for k, v in data.items() if k not in ("move", "moves")}
+            if "board" not in full_data: full_data["board"] = room.board
+        # Sotto il lock gli stati arrivano agli spettatori nell'ordine delle mosse.
+        if watched: spectators.publish(room.id, spectate_state(room, full_data))
+    failed = send_to_all(delta, {"type": "game_state", "data": data}) if delta else []
+    if full: failed += send_to_all(full, {"type": "game_state", "data": full_data})
+    return [pid for pid, c in targets if c in failed]
+
+def set_status(player_id, status):
     with players_lock:
-        users_list = [{"name": pid, "status": data["status"]} for pid, data in players_data.items()]
-    with players_lock:
-        targets = list(players_data.values())
-    for p in targets:
-        try: send_msg(p["conn"], {"type": "player_list_update", "data": users_list})
+        if player_id not in players_data: return
+        players_data[player_id]["status"] = status
+        conn = players_data[player_id]["conn"]
+    if not cluster: presence.update(player_id, status)
+    # Chi entra in partita smette di guardare quella degli altri ed esce dalla chat di lobby.
+    if status == "ingame":
+        stop_spectating(player_id)
+        channels.leave(LOBBY, player_id)
+    else:
+        channels.join(LOBBY, player_id, conn, history=False)
+
+def stop_spectating(player_id):
+    room_id = spectators.unwatch(player_id)
+    if room_id: channels.leave(room_channel(room_id), player_id)
+
+def find_room(player_id):
+    return rooms.room_of(player_id)
+
+def notify_match(room, host_id, host_conn, player_id, conn):
+    for pid, c, opponent in ((host_id, host_conn, player_id), (player_id, conn, host_id)):
+        try: send_msg(c, {"type": "match_found", "data": {"game_id": room.id, "you_are": room.players[pid], "opponent": opponent}})
         except: pass
+    log(f"[Match] Avviato: {host_id} vs {player_id}")
 
-def broadcast_game_state(room, data):
-    if "board" not in data: data["board"] = room.board
-    if "turn" not in data: data["turn"] = room.turn
-    disconnected = []
+def start_match(host_id, host_conn, player_id, conn):
+    # Crea la stanza per una coppia e notifica entrambi (usato dal cluster).
+    room = GameRoom(host_id)
+    room.connections[host_id] = host_conn
+    room.add_player(player_id, conn)
+    rooms.add(room)
+    set_status(host_id, "ingame")
+    set_status(player_id, "ingame")
+    broadcast_player_list()
+    notify_match(room, host_id, host_conn, player_id, conn)
+    return room
+
+def start_matches(pairs):
+    # Callback del matchmaker: tutte le coppie di un passaggio in blocco.
+    ready = []
+    for host, guest in pairs:
+        with players_lock:
+            alive = [t for t in (host, guest)
+                     if t.player_id in players_data and players_data[t.player_id]["conn"] is t.conn
+                     and players_data[t.player_id]["status"] == "waiting"]
+        if len(alive) < 2:
+            # Uno dei due è uscito nel frattempo: l'altro torna in coda senza perdere il posto.
+            # Il Ticket è lo stesso: la scadenza già programmata resta valida.
+            for t in alive: matchmaker.requeue(t)
+            continue
+        room = GameRoom(host.player_id)
+        room.connections[host.player_id] = host.conn
+        room.add_player(guest.player_id, guest.conn)
+        ready.append((room, host, guest))
+    for room, host, guest in ready:
+        rooms.add(room)
+        set_status(host.player_id, "ingame")
+        set_status(guest.player_id, "ingame")
+    if ready: broadcast_player_list()
+    for room, host, guest in ready:
+        notify_match(room, host.player_id, host.conn, guest.player_id, guest.conn)
+
+matchmaker = Matchmaker(on_pairs=start_matches, log=log, lock=InstrumentedLock("matchmaking"))
+
+def expire_search(ticket):
+    # Ricerca rimasta senza avversario per SEARCH_TIMEOUT: il giocatore torna in lobby.
+    if not matchmaker.cancel(ticket.player_id, ticket): return
+    log(f"[Matchmaking] {ticket.player_id}: ricerca scaduta.")
+    set_status(ticket.player_id, "online")
+    broadcast_player_list()
+    try: send_msg(ticket.conn, {"type": "match_status", "status": "expired"})
+    except: pass
+
+def offer_bot(ticket, level):
+    # Ricerca ancora senza avversario dopo BOT_AFTER: partita contro il bot.
+    if not matchmaker.cancel(ticket.player_id, ticket): return
+    with players_lock:
+        entry = players_data.get(ticket.player_id)
+        waiting = entry is not None and entry["conn"] is ticket.conn and entry["status"] == "waiting"
+    if waiting: start_bot_match(ticket.player_id, ticket.conn, level)
+
+def start_bot_match(player_id, conn, level):
+    bot = BOTS[level]
+    room = GameRoom(player_id)
+    room.connections[player_id] = conn
+    room.add_player(bot.player_id, None)
+    del room.connections[bot.player_id]     # il bot non ha socket: gioca dalla ruota dei timer
+    rooms.add(room)
+    set_status(player_id, "ingame")
+    broadcast_player_list()
+    try: send_msg(conn, {"type": "match_found", "data": {"game_id": room.id, "you_are": room.players[player_id], "opponent": bot.player_id}})
+    except: pass
+    log(f"[Bot] Avviato: {player_id} vs {bot.player_id}")
+    schedule_bot(room)
+    return room
+
+def schedule_bot(room):
     with room.lock:
-        for pid, p_conn in room.connections.items():
-            try: send_msg(p_conn, {"type": "game_state", "data": data})
-            except: disconnected.append(pid)
-    return disconnected
+        if room.status != "running": return
+        bot_id = next((pid for pid, s in room.players.items() if s == room.turn and is_bot(pid)), None)
+    if bot_id: wheel.schedule(BOT_THINK, bot_move, room, bot_id)
 
-# --- GESTIONE CLIENT ---
-def client_handler(conn, addr):
-    global waiting_room
-    player_id = None    
-    current_room = None 
-    
-    log(f"[Connect] Connessione da {addr}")
-    with active_conn_lock:
-        active_connections.append(conn)
+def bot_move(room, bot_id):
+    if rooms.get(room.id) is not room: return
+    with room.lock: moves = bytes(room.move_history)
+    play_move(bot_id, room, BOTS[level_of(bot_id)].choose(moves))
 
+def add_invite(target_id, inviter_id, inviter_conn, variant=(3, 3)):
+    with invites_lock:
+        old = pending_invites.pop((target_id, inviter_id), None)
+        if old: wheel.cancel(old[0])
+        pending_invites[(target_id, inviter_id)] = (wheel.schedule(INVITE_TIMEOUT, expire_invite, target_id, inviter_id, inviter_conn), variant)
+
+def take_invite(target_id, inviter_id):
+    # La variante (lato, in fila) se l'invito era ancora valido, altrimenti None;
+    # in ogni caso non è più in attesa.
+    with invites_lock: entry = pending_invites.pop((target_id, inviter_id), None)
+    if entry is None: return None
+    wheel.cancel(entry[0])
+    return entry[1]
+
+def announce_start(room):
+    # Stato iniziale di una partita da invito, se nessuno ha già mosso.
+    with room.lock:
+        fresh = room.status == "running" and not room.move_history
+        initial_state = {"board": room.board, "turn": "X", "result": None, "status": "running"}
+    if fresh and rooms.get(room.id) is room: broadcast_game_state(room, initial_state)
+
+def parse_variant(msg):
+    # {"size": N, "win": K} facoltativi: default tris 3x3, senza "win" K = min(N, 5).
+    size = msg.get("size", 3)
+    if type(size) is not int: return None
+    win = msg.get("win", min(size, 5))
+    if type(win) is not int: return None
+    if not (3 <= size <= MAX_SIZE and 3 <= win <= size): return None
+    return size, win
+
+def expire_invite(target_id, inviter_id, inviter_conn):
+    with invites_lock:
+        if pending_invites.pop((target_id, inviter_id), None) is None: return
+    log(f"[Invito] {inviter_id} -> {target_id}: scaduto.")
+    try: send_msg(inviter_conn, {"type": "invite_error", "message": f"Invito a {target_id} scaduto."})
+    except: pass
+
+# --- METRICHE (metrics.py): /metrics in formato Prometheus e pannello nella console ---
+METRICS_PORT = 9100
+ACTIONS = ("ping", "presence_resync", "chat", "start_search", "send_invite", "respond_invite",
+           "move", "leave_game", "leave_queue", "back_to_lobby", "history", "stats", "replay", "logout",
+           "live_games", "spectate", "stop_spectating", "chat_history", "play_bot")
+MESSAGES = metrics.REGISTRY.counter("tris_messages_total", "Messaggi ricevuti per azione", ("action",))
+ACTION_SECONDS = metrics.REGISTRY.histogram("tris_action_seconds", "Tempo di gestione per azione", ("action",))
+MOVE_SECONDS = metrics.REGISTRY.histogram("tris_apply_move_seconds", "Durata di GameRoom.apply_move")
+metrics.REGISTRY.gauge("tris_connections", "Socket aperti", lambda: len(active_connections))
+metrics.REGISTRY.gauge("tris_players", "Giocatori loggati", lambda: len(players_data))
+metrics.REGISTRY.gauge("tris_rooms", "Stanze registrate", lambda: len(rooms))
+metrics.REGISTRY.gauge("tris_matchmaking_queue", "Giocatori in coda", lambda: len(matchmaker))
+for _key in ("queued_frames", "max_queue_depth", "dropped_frames", "overflow_disconnects"):
+    metrics.REGISTRY.gauge(f"tris_outbound_{_key}", "Code di uscita (outbound.queue_stats)", lambda k=_key: queue_stats()[k])
+metrics.REGISTRY.gauge("tris_log_dropped", "Righe di log perse", lambda: logpipe.dropped)
+metrics.REGISTRY.gauge("tris_timers", "Timer attivi sulla ruota (heartbeat, scadenze)", lambda: len(wheel))
+metrics.REGISTRY.gauge("tris_spectators", "Spettatori iscritti a una partita", lambda: len(spectators))
+metrics.REGISTRY.gauge("tris_chat_channels", "Canali di chat aperti", lambda: len(channels))
+metrics.REGISTRY.gauge("tris_pending_invites", "Inviti in attesa di risposta", lambda: len(pending_invites))
+metrics_http = None
+
+def start_metrics():
+    global metrics_http
+    if metrics_http: return
     try:
-        msg = recv_msg(conn)
-        if not msg: return
-        if msg.get("action") == "ping": return 
+        metrics_http = metrics.serve_http(port=METRICS_PORT)
+        log(f"[Metriche] http://127.0.0.1:{METRICS_PORT}/metrics")
+    except OSError as e:
+        log(f"[Errore] Endpoint metriche non avviato: {e}")
+
+def play_move(player_id, room, pos):
+    start = time.perf_counter()
+    res = room.apply_move(player_id, pos)
+    MOVE_SECONDS.observe(time.perf_counter() - start)
+    broadcast_game_state(room, res)
+    if res.get("status") == "ended":
+        store.record(room, res["result"])
+        log(f"[GameOver] Stanza {room.id[:8]}: {res.get('result')}")
+    elif res.get("ok") and not is_bot(player_id):
+        schedule_bot(room)
+
+def room_chat(player_id, room, text):
+    # Il canale della stanza nasce al primo messaggio; join() è idempotente.
+    channel = room_channel(room.id)
+    with room.lock:
+        members = list(room.connections.items())
+    for pid, c in members: channels.join(channel, pid, c, history=False)
+    channels.publish(channel, {"type": "chat_message", "data": {"sender": player_id, "message": text}})
+
+def lobby_chat(msg_obj):
+    channels.publish(LOBBY, msg_obj)
+
+def direct_chat(player_id, conn, target_id, text):
+    with players_lock:
+        target = players_data.get(target_id)
+        target_conn = target["conn"] if target else None
+    if target_conn is None or target_id == player_id:
+        send_msg(conn, {"type": "chat_error", "message": f"{target_id} non è raggiungibile."})
+        return
+    channel = dm_channel(player_id, target_id)
+    channels.join(channel, player_id, conn, history=False)
+    channels.join(channel, target_id, target_conn, history=False)
+    channels.publish(channel, {"type": "direct_message", "data": {"sender": player_id, "to": target_id, "message": text}})
+
+def leave_room(player_id, room_id):
+    game_to_close = rooms.get(room_id)
+    if not game_to_close: return False
+    log(f"[Abbandono] {player_id} esce da {room_id[:8]}")
+    with game_to_close.lock:
+        # Chi abbandona perde: la stanza si chiude qui, così l'avversario non può più
+        # muovere e la sua disconnessione non registra la partita una seconda volta.
+        abandoned = game_to_close.status == "running" and player_id in game_to_close.players
+        if abandoned:
+            result = f"{game_to_close.players[player_id]}_disconnected"
+            game_to_close.status = "ended"
+            game_to_close.ended_at = time.time()
+            store.record(game_to_close, result)
+        opponent_conn = None
+        for pid, symbol in game_to_close.players.items():
+            if pid != player_id: opponent_conn = game_to_close.connections.get(pid); break
+        if opponent_conn:
+            try: send_msg(opponent_conn, {"type": "game_state", "data": {"board": game_to_close.board, "turn": None, "result": "disconnected", "status": "ended"}})
+            except: pass
+        if abandoned:
+            spectators.publish(room_id, spectate_state(game_to_close, {"turn": None, "result": result}))
+    set_status(player_id, "online")
+    rooms.remove(room_id)
+    spectators.close_room(room_id)
+    channels.close(room_channel(room_id))
+    return True
+
+def close_player_room(player_id, room_to_close=None):
+    # Chiusura della stanza di un giocatore disconnesso: l'avversario vince a tavolino.
+    if room_to_close is None: room_to_close = find_room(player_id)
+    if not room_to_close: return
+    with room_to_close.lock:
+        if player_id in room_to_close.connections: del room_to_close.connections[player_id]
+        if room_to_close.status == "running":
+            room_to_close.status = "ended"
+            room_to_close.ended_at = time.time()
+            store.record(room_to_close, f"{room_to_close.players[player_id]}_disconnected")
+            for other_conn in room_to_close.connections.values():
+                try: send_msg(other_conn, {"type": "game_state", "data": {"status": "ended", "result": f"{room_to_close.players[player_id]}_disconnected", "board": room_to_close.board, "turn": None}})
+                except: pass
+            spectators.publish(room_to_close.id, spectate_state(room_to_close, {
+                "turn": None, "result": f"{room_to_close.players[player_id]}_disconnected"}))
+    rooms.remove(room_to_close.id)
+    spectators.close_room(room_to_close.id)
+    channels.close(room_channel(room_to_close.id))
+
+def drop_player(player_id, conn, current_room=None):
+    # Pulizia di un giocatore uscito: subito alla disconnessione, oppure allo
+    # scadere del periodo di grazia della sua sessione.
+    with players_lock:
+        if player_id in players_data and players_data[player_id]["conn"] is conn: del players_data[player_id]
+    presence.detach(player_id)
+    spectators.unwatch(player_id)
+    channels.leave_all(player_id)
+    if not cluster: presence.update(player_id, None)
+    close_player_room(player_id, current_room)
+    if cluster:
+        if player_id in cluster.remote_rooms: cluster.to_owner(player_id, "player_gone", player_id)
+        cluster.release(player_id)
+    matchmaker.cancel(player_id)
+    broadcast_player_list()
+
+def keep_alive(sock):
+    # Client senza heartbeat: le connessioni morte le trova il keepalive TCP,
+    # con tempi vicini a IDLE_TIMEOUT dove il sistema permette di sceglierli.
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, max(1, int(IDLE_TIMEOUT)))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, int(HEARTBEAT_INTERVAL)))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    except (OSError, AttributeError): pass
+
+def resume_session(msg, out):
+    # Ripresa con {"player_id", "resume": token, "seen": n}: None se non valida.
+    session = sessions.claim(msg["resume"], msg.get("player_id"), out)
+    if session is None: return None
+    set_codec(out, codec_of(session))
+    send_msg(out, {"ok": True, "status": "resumed", "codec": codec_of(session), "session": session.token})
+    gap = session.attach(out, msg.get("seen"))
+    room = find_room(session.player_id)
+    if gap and room:
+        # Il buffer non copriva tutta l'assenza: stato completo della partita.
+        with room.lock:
+            state = {"board": room.board, "turn": room.turn, "status": room.status, "result": None}
+        send_msg(session, {"type": "game_state", "data": state})
+    return session
+
+# --- GESTIONE CLIENT ---
+class Client:
+    # Stato e azioni di una connessione, indipendenti dal trasporto: il server
+    # threaded (client_handler) e quello asyncio (aio_server.py) leggono i frame e li
+    # passano a login() e handle(); tutto ciò che esce passa da `out` (Outbound o
+    # LoopOutbound) oppure dalla Session che la avvolge.
+    # `adopted`: connessione ereditata con l'handoff (vedi handoff_import), già loggata o no.
+    def __init__(self, out, addr, handle=None, adopted=None):
+        self.addr = addr
+        self.handle_ref = handle if handle is not None else out     # quello che la GUI chiude all'arresto
+        self.out = self.conn = out
+        self.player_id = None
+        self.current_room = None
+        self.session = None
+        self.logout = False
+        self.beats = False      # il client risponde ai ping del server (feature "heartbeat")
+        if adopted:
+            self.out, self.conn = adopted["out"], adopted["conn"]
+            self.player_id, self.session = adopted["player_id"], adopted["session"]
+            if self.player_id: self.current_room = find_room(self.player_id)
+            self.beats = adopted.get("heartbeat", False)
+        else:
+            log(f"[Connect] Connessione da {addr}")
+        if getattr(self.out, "on_overflow", None) is None:
+            self.out.on_overflow = lambda c: log(f"[Lento] {self.player_id or addr}: coda piena, disconnesso.")
+        with active_conn_lock:
+            active_connections.append(self.handle_ref)
+
+        # Fino al login e poi per i client con la feature "heartbeat": ping del server dopo
+        # HEARTBEAT_INTERVAL di silenzio e chiusura dopo IDLE_TIMEOUT (peer morto o
+        # connessione mezza aperta), così la lettura si sblocca. Gli altri client non
+        # rispondono ai ping: dopo il login li controlla il keepalive TCP (vedi keep_alive).
+        self.watch = IdleWatch(wheel, HEARTBEAT_INTERVAL, IDLE_TIMEOUT, on_heartbeat=self.heartbeat,
+                               on_idle=lambda: (log(f"[Idle] {self.player_id or addr}: nessun messaggio da {IDLE_TIMEOUT:.0f}s, disconnesso."), self.out.abort()))
+        if self.player_id and not self.beats: self.watch.stop()
+
+    def heartbeat(self):
+        if self.beats: self.out.sendall(pack_for(self.out, {"type": "ping"}), droppable=True)
+
+    def start_watch(self, features):
+        # Dopo il login: heartbeat solo su richiesta, per gli altri keepalive TCP.
+        self.beats = FEATURE_HEARTBEAT in features
+        if not self.beats:
+            self.watch.stop()
+            keep_alive(self.out.sock)
+
+    def login(self, msg):
+        # Primo frame della connessione. True se il giocatore è entrato (o ha ripreso la sessione).
+        if not msg: return False
+        if msg.get("action") == "ping": return False
 
         requested_id = msg.get("player_id")
-        if not requested_id: return
+        if not requested_id: return False
+        conn, out = self.conn, self.out
+        if is_bot(requested_id):
+            send_msg(conn, {"ok": False, "reason": "Nickname riservato ai bot."})
+            return False
+        # Negoziazione del codec: i client che non lo dichiarano restano su pickle.
+        codec_name = choose_codec(msg.get("codecs"))
+        set_codec(conn, codec_name)
+        features = msg.get("features") or ()
 
+        if msg.get("resume") and not cluster:
+            session = resume_session(msg, out)
+            if session:
+                self.session = self.conn = session
+                self.player_id = requested_id
+                self.current_room = find_room(requested_id)
+                log(f"[Sessione] {requested_id} ha ripreso la sessione.")
+                presence.attach(requested_id, session, deltas=FEATURE_DELTA in features)
+                self.start_watch(features)
+                return True
+
+        with players_lock:
+            taken = requested_id in players_data
+        if not taken and cluster: taken = not cluster.claim(requested_id)
         with players_lock:
-            if requested_id in players_data:
+            if taken or requested_id in players_data:
                 log(f"[Login] Rifiutato: '{requested_id}' già connesso.")
                 try: send_msg(conn, {"ok": False, "reason": "Nickname già in uso!"})
                 except: pass
-                return 
-            else:
-                players_data[requested_id] = {"conn": conn, "status": "online"}
-                player_id = requested_id
+                return False
+            if FEATURE_SESSION in features and not cluster:
+                # Solo su richiesta: chi non sa riprendere deve uscire subito e liberare il nickname.
+                # In cluster la ripresa finirebbe quasi sempre su un altro worker.
+                self.session = conn = self.conn = sessions.create(requested_id, out)
+                set_codec(conn, codec_name)
+            players_data[requested_id] = {"conn": conn, "status": "online"}
+            self.player_id = player_id = requested_id
 
         log(f"[Login] Entrato in Lobby: {player_id}")
-        send_msg(conn, {"ok": True, "status": "lobby"}) 
-        broadcast_player_list() 
+        reply = {"ok": True, "status": "lobby", "codec": codec_name}
+        if self.session: reply["session"] = self.session.token
+        send_msg(out, reply)
+        presence.attach(player_id, conn, deltas=FEATURE_DELTA in features)
+        channels.join(LOBBY, player_id, conn)
+        if FEATURE_MOVE_DELTA in features: conn.move_deltas = True
+        if not cluster: presence.update(player_id, "online")
+        broadcast_player_list()
+        self.start_watch(features)
+        return True
 
-        while True:
-            msg = recv_msg(conn)
-            if msg is None: break 
-            
-            action = msg.get("action")
-            if action == "ping": continue
+    def handle(self, msg):
+        # Un messaggio dopo il login. False se la connessione va chiusa.
+        if msg is None: return False
+        self.watch.touch()
+        started = time.perf_counter()
+        action = msg.get("action")
+        if action not in ACTIONS: action = "other"
+        MESSAGES.inc(action)
+        try: return self.dispatch(action, msg) is not False
+        finally: ACTION_SECONDS.observe(time.perf_counter() - started, action)
 
-            if action == "chat":
-                text = msg.get("message", "").strip()
-                if text:
+    def dispatch(self, action, msg):
+        player_id, conn = self.player_id, self.conn
+        if action == "ping": return
+
+        if action == "presence_resync":
+            # Il client ha visto un buco di versione nei delta: lista completa.
+            presence.resync(player_id)
+
+        elif action == "chat":
+            text = str(msg.get("message", "")).strip()[:channels.max_length]
+            to = msg.get("to")
+            if to and not isinstance(to, str):
+                send_msg(conn, {"type": "chat_error", "message": "Destinatario non valido."})
+            elif text and not channels.allow(player_id):
+                send_msg(conn, {"type": "chat_error", "message": "Stai scrivendo troppo velocemente."})
+            elif text and to:
+                direct_chat(player_id, conn, to, text)
+            elif text:
+                # Chi ha invitato o è stato abbinato dal matchmaker scopre qui la stanza.
+                room = self.current_room or find_room(player_id)
+                if room and (room is self.current_room or room.status == "running"):
+                    self.current_room = room
+                    room_chat(player_id, room, text)
+                elif cluster and player_id in cluster.remote_rooms:
+                    cluster.to_owner(player_id, "room_chat", player_id, text)
+                else:
                     msg_obj = {"type": "chat_message", "data": {"sender": player_id, "message": text}}
-                    if current_room:
-                        with current_room.lock:
-                            for p_conn in current_room.connections.values():
-                                try: send_msg(p_conn, msg_obj)
-                                except: pass
-                    else:
-                        with players_lock:
-                            targets = [p["conn"] for p in players_data.values() if p["status"] != "ingame"]
-                        for c in targets:
-                            try: send_msg(c, msg_obj)
-                            except: pass
-            
-            elif action == "start_search":
-                log(f"[Matchmaking] {player_id} cerca partita...")
-                with players_lock:
-                    if player_id in players_data: players_data[player_id]["status"] = "waiting"
-                broadcast_player_list()
+                    if cluster: cluster.lobby_chat(msg_obj)
+                    else: lobby_chat(msg_obj)
+
+        elif action == "start_search":
+            log(f"[Matchmaking] {player_id} cerca partita...")
+            set_status(player_id, "waiting")
+            broadcast_player_list()
+
+            if cluster:
+                # La coda è globale: l'abbinamento lo fa il coordinatore.
+                cluster.search(player_id)
+                return
+
+            # L'abbinamento avviene nel thread del matchmaker: la stanza si
+            # ritrova poi con find_room().
+            self.current_room = None
+            ticket = matchmaker.enqueue(player_id, conn)
+            if ticket:
+                wheel.schedule(SEARCH_TIMEOUT, expire_search, ticket)
+                level = msg.get("bot", DEFAULT_LEVEL)
+                if isinstance(level, str) and level in LEVELS: wheel.schedule(BOT_AFTER, offer_bot, ticket, level)
+            send_msg(conn, {"type": "match_status", "status": "waiting"})
 
-                with waiting_lock:
-                    if waiting_room is None:
-                        room = GameRoom(player_id)
-                        room.connections[player_id] = conn
-                        rooms[room.id] = room
-                        waiting_room = room
-                        current_room = room
-                        send_msg(conn, {"type": "match_status", "status": "waiting"})
+        elif action == "play_bot":
+            level = msg.get("level", DEFAULT_LEVEL)
+            own = find_room(player_id)     # una partita già finita non blocca
+            if cluster or not isinstance(level, str) or level not in LEVELS or (own and own.status == "running"):
+                send_msg(conn, {"type": "invite_error", "message": "Partita contro il bot non disponibile."})
+                return
+            if matchmaker.cancel(player_id): log(f"[Matchmaking] {player_id} ha annullato la ricerca.")
+            self.current_room = start_bot_match(player_id, conn, level)
+
+        elif action == "send_invite":
+            target_id = msg.get("target_id")
+            target_conn = None
+            can_invite = False
+            variant = parse_variant(msg)
+            with players_lock:
+                if target_id in players_data and players_data[target_id]["status"] == "online":
+                    target_conn = players_data[target_id]["conn"]
+                    can_invite = True
+            if variant is None:
+                send_msg(conn, {"type": "invite_error", "message": f"Variante non valida (lato da 3 a {MAX_SIZE}, in fila da 3 al lato)."})
+            elif can_invite and target_conn:
+                log(f"[Invito] {player_id} -> {target_id}")
+                add_invite(target_id, player_id, conn, variant)
+                invite = {"type": "incoming_invite", "from": player_id}
+                if variant != (3, 3): invite["size"], invite["win"] = variant
+                send_msg(target_conn, invite)
+            elif variant != (3, 3):
+                send_msg(conn, {"type": "invite_error", "message": f"Impossibile invitare {target_id} (Occupato o Offline)."})
+            elif cluster and target_id not in players_data and cluster.invite(player_id, target_id):
+                log(f"[Invito] {player_id} -> {target_id} (remoto)")
+            else:
+                send_msg(conn, {"type": "invite_error", "message": f"Impossibile invitare {target_id} (Occupato o Offline)."})
+
+        elif action == "respond_invite":
+            target_id = msg.get("target_id")
+            response = msg.get("response")
+            inviter_conn = None
+            inviter_status = "offline"
+            with players_lock:
+                if target_id in players_data:
+                    inviter_conn = players_data[target_id]["conn"]
+                    inviter_status = players_data[target_id]["status"]
+            # Un invito locale vale solo se è ancora in attesa; quelli remoti (cluster)
+            # scadono sul worker di chi li ha mandati.
+            variant = take_invite(player_id, target_id)
+            if variant is None:
+                if inviter_conn is not None: inviter_status = "expired"
+                variant = (3, 3)
+            if inviter_conn is None and cluster and target_id in cluster.directory:
+                inviter_conn = cluster.remote_conn(target_id)
+                inviter_status = cluster.directory[target_id]
+
+            if response == "decline":
+                log(f"[Invito] {player_id} rifiuta {target_id}")
+                if inviter_conn and inviter_status != "expired": send_msg(inviter_conn, {"type": "invite_declined", "from": player_id})
+
+            elif response == "accept":
+                log(f"[Invito] {player_id} ha accettato {target_id}")
+                if inviter_conn:
+                    if inviter_status in ["online", "waiting"]:
+                        new_room = GameRoom(target_id, size=variant[0], win=variant[1])
+                        new_room.add_player(player_id, conn)
+                        new_room.turn = "X"
+                        new_room.connections[target_id] = inviter_conn
+                        new_room.connections[player_id] = conn
+
+                        rooms.add(new_room)
+                        # Chi era in coda smette di cercare: niente scadenza o bot a partita iniziata.
+                        for pid in (target_id, player_id):
+                            matchmaker.cancel(pid)
+                            if cluster: cluster.unsearch(pid)
+                        if cluster and target_id not in players_data: cluster.attach(target_id)
+                        set_status(target_id, "ingame")
+                        set_status(player_id, "ingame")
+                        broadcast_player_list()
+
+                        for pid, c, opponent in ((target_id, inviter_conn, player_id), (player_id, conn, target_id)):
+                            found = {"game_id": new_room.id, "you_are": new_room.players[pid], "opponent": opponent}
+                            if variant != (3, 3): found["size"], found["win"] = variant
+                            send_msg(c, {"type": "match_found", "data": found})
+
+                        self.current_room = new_room
+                        # Lo stato iniziale arriva dopo che i client hanno aperto la board:
+                        # dalla ruota dei timer, senza fermare chi legge da questa connessione.
+                        wheel.schedule(INVITE_START_DELAY, announce_start, new_room)
+                        log(f"[Match Invite] Avviato: {target_id} vs {player_id}")
                     else:
-                        room = waiting_room
-                        host_id = list(room.players.keys())[0]
-                        host_conn = room.connections.get(host_id)
-                        try:
-                            room.add_player(player_id, conn)
-                            waiting_room = None 
-                            current_room = room
-                            with players_lock:
-                                players_data[host_id]["status"] = "ingame"
-                                players_data[player_id]["status"] = "ingame"
-                            broadcast_player_list()
-                            host_symbol = room.players[host_id]
-                            joiner_symbol = room.players[player_id]
-                            send_msg(host_conn, {"type": "match_found", "data": {"game_id": room.id, "you_are": host_symbol, "opponent": player_id}})
-                            send_msg(conn, {"type": "match_found", "data": {"game_id": room.id, "you_are": joiner_symbol, "opponent": host_id}})
-                            log(f"[Match] Avviato: {host_id} vs {player_id}")
-                        except GameRoomError as e:
-                            send_msg(conn, {"ok": False, "reason": str(e)})
-
-            elif action == "send_invite":
-                target_id = msg.get("target_id")
-                target_conn = None
-                can_invite = False
-                with players_lock:
-                    if target_id in players_data and players_data[target_id]["status"] == "online":
-                        target_conn = players_data[target_id]["conn"]
-                        can_invite = True
-                if can_invite and target_conn:
-                    log(f"[Invito] {player_id} -> {target_id}")
-                    send_msg(target_conn, {"type": "incoming_invite", "from": player_id})
-                else:
-                    send_msg(conn, {"type": "invite_error", "message": f"Impossibile invitare {target_id} (Occupato o Offline)."})
-
-            elif action == "respond_invite":
-                target_id = msg.get("target_id")
-                response = msg.get("response")
-                inviter_conn = None
-                with players_lock:
-                    if target_id in players_data: inviter_conn = players_data[target_id]["conn"]
-                
-                if response == "decline":
-                    log(f"[Invito] {player_id} rifiuta {target_id}")
-                    if inviter_conn: send_msg(inviter_conn, {"type": "invite_declined", "from": player_id})
-                
-                elif response == "accept":
-                    log(f"[Invito] {player_id} ha accettato {target_id}")
-                    if inviter_conn:
-                        inviter_status = "offline"
-                        with players_lock:
-                            if target_id in players_data: inviter_status = players_data[target_id]["status"]
-                        
-                        if inviter_status in ["online", "waiting"]:
-                            new_room = GameRoom(target_id)
-                            new_room.add_player(player_id, conn)
-                            new_room.turn = "X"
-                            new_room.connections[target_id] = inviter_conn
-                            new_room.connections[player_id] = conn
-                            
-                            with rooms_lock: rooms[new_room.id] = new_room
-                            with players_lock:
-                                players_data[target_id]["status"] = "ingame"
-                                players_data[player_id]["status"] = "ingame"
-                            broadcast_player_list()
-                            
-                            send_msg(inviter_conn, {"type": "match_found", "data": {"game_id": new_room.id, "you_are": "X", "opponent": player_id}})
-                            send_msg(conn, {"type": "match_found", "data": {"game_id": new_room.id, "you_are": "O", "opponent": target_id}})
-                            
-                            current_room = new_room
-                            time.sleep(0.5) 
-                            initial_state = {"board": new_room.board, "turn": "X", "result": None, "status": "running"}
-                            broadcast_game_state(new_room, initial_state)
-                            log(f"[Match Invite] Avviato: {target_id} vs {player_id}")
-                        else:
-                            send_msg(conn, {"type": "invite_error", "message": "Invito scaduto."})
-
-            elif action == "move":
-                pos = msg.get("pos")
-                if not current_room:
-                    with rooms_lock:
-                        for r in rooms.values():
-                            if player_id in r.players: current_room = r; break
-                if current_room:
-                    res = current_room.apply_move(player_id, pos)
-                    broadcast_game_state(current_room, res)
-                    if res.get("status") == "ended":
-                        log(f"[GameOver] Stanza {current_room.id[:8]}: {res.get('result')}")
-
-            elif action == "leave_game":
-                room_id = msg.get("room_id")
-                if room_id in rooms:
-                    game_to_close = rooms[room_id]
-                    log(f"[Abbandono] {player_id} esce da {room_id[:8]}")
-                    with game_to_close.lock:
-                        opponent_conn = None
-                        for pid, symbol in game_to_close.players.items():
-                            if pid != player_id: opponent_conn = game_to_close.connections.get(pid); break
-                        if opponent_conn:
-                            try: send_msg(opponent_conn, {"type": "game_state", "data": {"board": game_to_close.board, "turn": None, "result": "disconnected", "status": "ended"}})
-                            except: pass
-                    with players_lock:
-                        if player_id in players_data: players_data[player_id]["status"] = "online"
-                    with rooms_lock:
-                        if room_id in rooms: del rooms[room_id]
-                    current_room = None
-                    broadcast_player_list()
-
-            elif action == "leave_queue":
-                with waiting_lock:
-                    if waiting_room and list(waiting_room.players.keys())[0] == player_id:
-                        waiting_room = None
-                        log(f"[Matchmaking] {player_id} ha annullato la ricerca.")
-                with players_lock:
-                    if player_id in players_data: players_data[player_id]["status"] = "online"
-                broadcast_player_list()
+                        send_msg(conn, {"type": "invite_error", "message": "Invito scaduto."})
+
+        elif action == "move":
+            pos = msg.get("pos")
+            if not self.current_room: self.current_room = find_room(player_id)
+            if self.current_room:
+                play_move(player_id, self.current_room, pos)
+            elif cluster and player_id in cluster.remote_rooms:
+                cluster.to_owner(player_id, "move", player_id, pos)
 
-            elif action == "back_to_lobby":
-                log(f"[Lobby] {player_id} è tornato in lobby.")
-                with players_lock:
-                    if player_id in players_data: players_data[player_id]["status"] = "online"
-                current_room = None
+        elif action == "leave_game":
+            room_id = msg.get("room_id")
+            if leave_room(player_id, room_id):
+                self.current_room = None
+                broadcast_player_list()
+            elif cluster and player_id in cluster.remote_rooms:
+                cluster.to_owner(player_id, "leave_game", player_id, room_id)
+                cluster.remote_rooms.pop(player_id, None)
+                set_status(player_id, "online")
                 broadcast_player_list()
 
-    except Exception as e:
+        elif action == "leave_queue":
+            if matchmaker.cancel(player_id):
+                log(f"[Matchmaking] {player_id} ha annullato la ricerca.")
+            if cluster: cluster.unsearch(player_id)
+            set_status(player_id, "online")
+            broadcast_player_list()
+
+        elif action == "back_to_lobby":
+            log(f"[Lobby] {player_id} è tornato in lobby.")
+            set_status(player_id, "online")
+            self.current_room = None
+            if cluster: cluster.remote_rooms.pop(player_id, None)
+            broadcast_player_list()
+
+        # --- Storico (storage.py) ---
+        # Gli id arrivano dal client e finiscono in una query: solo stringhe.
+        elif action in ("history", "stats"):
+            target = msg.get("player_id") or player_id
+            if not isinstance(target, str):
+                send_msg(conn, {"type": "history_error", "message": "Giocatore non valido."})
+            elif action == "history":
+                limit = msg.get("limit")
+                limit = min(max(limit, 1), 50) if type(limit) is int else 20
+                send_msg(conn, {"type": "game_history", "data": store.recent_games(target, limit)})
+            else:
+                send_msg(conn, {"type": "player_stats", "data": store.stats(target)})
+
+        elif action == "replay":
+            game_id = msg.get("game_id")
+            if not isinstance(game_id, str):
+                send_msg(conn, {"type": "history_error", "message": "Partita non valida."})
+            else:
+                send_msg(conn, {"type": "game_replay", "data": store.replay(game_id)})
+
+        # --- Spettatori (spectators.py) ---
+        elif action == "live_games":
+            games = []
+            for room in rooms.values():
+                with room.lock:
+                    if room.status != "running": continue
+                    by_symbol = {s: pid for pid, s in room.players.items()}
+                    games.append({"game_id": room.id, "x": by_symbol.get("X"), "o": by_symbol.get("O"),
+                                  "moves": len(room.move_history), "spectators": spectators.count(room.id)})
+            games.sort(key=lambda g: -g["spectators"])
+            send_msg(conn, {"type": "live_games", "data": games[:50]})
+
+        elif action == "spectate":
+            room = rooms.get(msg.get("game_id"))
+            # Una partita propria già finita resta indicizzata fino all'uscita: non blocca.
+            own = find_room(player_id)
+            if room is None or (own and own.status == "running"):
+                send_msg(conn, {"type": "spectate_error", "message": "Partita non disponibile."})
+                return
+            stop_spectating(player_id)
+            with room.lock:
+                spectators.watch(room.id, player_id, conn, spectate_state(room, {}))
+            # Gli spettatori leggono la chat della partita (e ne ricevono lo storico).
+            channels.join(room_channel(room.id), player_id, conn)
+            log(f"[Spettatori] {player_id} guarda {room.id[:8]}")
+
+        elif action == "stop_spectating":
+            stop_spectating(player_id)
+
+        elif action == "chat_history":
+            to = msg.get("to")
+            if to and not isinstance(to, str):
+                send_msg(conn, {"type": "chat_error", "message": "Destinatario non valido."})
+                return
+            if to: channel = dm_channel(player_id, to)
+            elif self.current_room: channel = room_channel(self.current_room.id)
+            else: channel = LOBBY
+            send_msg(conn, {"type": "chat_history", "data": {"channel": channel, "messages": channels.history_of(channel)}})
+
+        elif action == "logout":
+            # Uscita volontaria: nessun periodo di grazia.
+            self.logout = True
+            return False
+
+    def error(self, e):
         if server_running and "10054" not in str(e):
-            log(f"[Error] {player_id}: {e}")
+            log(f"[Error] {self.player_id}: {e}")
 
-    finally:
+    def close(self):
+        # Fine della connessione, comunque sia finita.
+        self.watch.stop()
         with active_conn_lock:
-            if conn in active_connections: active_connections.remove(conn)
-        log(f"[Disconnect] {player_id if player_id else addr}")
-        with players_lock:
-            if player_id in players_data: del players_data[player_id]
-        
-        if player_id:
-            room_to_close = None
-            if current_room: room_to_close = current_room
-            else:
-                with rooms_lock:
-                    for r in rooms.values():
-                        if player_id in r.players: room_to_close = r; break
-            if room_to_close:
-                with room_to_close.lock:
-                    if player_id in room_to_close.connections: del room_to_close.connections[player_id]
-                    if room_to_close.status == "running":
-                        room_to_close.status = "ended"
-                        for other_conn in room_to_close.connections.values():
-                            try: send_msg(other_conn, {"type": "game_state", "data": {"status": "ended", "result": f"{room_to_close.players[player_id]}_disconnected", "board": room_to_close.board, "turn": None}})
-                            except: pass
-                with rooms_lock:
-                    if room_to_close.id in rooms: del rooms[room_to_close.id]
-
-        with waiting_lock:
-            if waiting_room and player_id in waiting_room.players: waiting_room = None
-        try: conn.close()
+            if self.handle_ref in active_connections: active_connections.remove(self.handle_ref)
+        player_id, session = self.player_id, self.session
+        log(f"[Disconnect] {player_id if player_id else self.addr}")
+
+        # Sessione: stanza, coda e stato restano per il periodo di grazia.
+        held = bool(session and server_running and not self.logout
+                    and sessions.detach(session, self.out, lambda: drop_player(player_id, session)))
+        if held:
+            log(f"[Sessione] {player_id}: in attesa di ripresa per {sessions.grace:.0f}s.")
+        elif player_id:
+            if session: sessions.forget(session)
+            drop_player(player_id, self.conn, self.current_room)
+        self.out.close()
+
+def client_handler(sock, addr, adopted=None):
+    # Server threaded: un thread per connessione che legge dal socket; le scritture
+    # passano dalla coda di uscita (Outbound) e, con le sessioni, dalla Session.
+    reader = FrameReader(sock, initial=adopted["pending"] if adopted else b"")
+    client = Client(adopted["out"] if adopted else Outbound(sock), addr, sock, adopted)
+
+    def handoff_state():
+        # Quello che serve al processo nuovo per riprendere la connessione.
+        session = client.session
+        return {"player_id": client.player_id, "codec": codec_of(client.conn), "session": session.token if session else None,
+                "seq": session.seq if session else 0, "move_delta": getattr(client.conn, "move_deltas", False),
+                "pending": reader.pending(), "out": client.out, "heartbeat": client.beats}
+
+    if handoff_gate: reader.wait = lambda: handoff_gate.wait(sock, handoff_state)
+    try:
+        if client.player_id or client.login(reader.recv_msg()):
+            while client.handle(reader.recv_msg()): pass
+    except Exception as e:
+        client.error(e)
+    finally:
+        client.close()
+        try: sock.close()
         except: pass
-        broadcast_player_list()
+
+# --- RIAVVIO SENZA INTERRUZIONI (handoff.py) ---
+def handoff_export(channel):
+    # Processo in servizio: ferma client, matchmaker e timer, svuota le code di
+    # uscita e passa socket e stato al processo nuovo. False = si riprende come prima.
+    if not server_running or server_socket is None: return False
+    log("[Handoff] Richiesta di passaggio: congelamento dei client...")
+    handoff_gate.freeze()
+    paused = False
+    try:
+        parked = handoff_gate.wait_parked(lambda: len(active_connections), HANDOFF_FREEZE_TIMEOUT)
+        if parked is None: raise HandoffError("client non fermi entro il tempo limite")
+        matchmaker.stop()
+        wheel.stop()
+        paused = True
+        presence.flush()
+        spectators.flush()
+        channels.flush()
+        for state in parked.values():
+            if not state["out"].drain(HANDOFF_FREEZE_TIMEOUT): raise HandoffError("code di uscita non svuotate")
+        socks = list(parked)
+        handoff.send(channel, server_socket, socks, handoff_snapshot([parked[s] for s in socks]))
+        if not handoff.confirmed(channel): raise HandoffError("nessuna conferma dal processo nuovo")
+    except Exception as e:
+        log(f"[Handoff] Passaggio annullato: {e}")
+        if paused:
+            matchmaker.start()
+            wheel.start()
+        handoff_gate.thaw()
+        return False
+    log(f"[Handoff] {len(socks)} connessioni e {len(rooms)} stanze passate al processo nuovo.")
+    handoff_gate.finish()
+    return True
+
+def handoff_snapshot(states):
+    # Solo tipi base: viaggia col pickle ristretto di protocollo.py.
+    now = matchmaker.clock()
+    with players_lock:
+        players = [(pid, data["status"]) for pid, data in players_data.items()]
+    connections = []
+    for state in states:
+        state = {k: v for k, v in state.items() if k != "out"}
+        state["presence_delta"] = presence.deltas(state["player_id"]) if state["player_id"] else None
+        state["spectating"] = spectators.room_of(state["player_id"]) if state["player_id"] else None
+        connections.append(state)
+    detached = [(s.token, s.player_id, s.seq, getattr(s, "move_deltas", False), presence.deltas(s.player_id))
+                for s in sessions.detached()]
+    room_list = []
+    for room in rooms.values():
+        with room.lock:
+            room_list.append((room.id, room.size, room.win, list(room.players.items()), room.turn, room.status,
+                              bytes(room.move_history), room.created_at, room.ended_at))
+    queue = [(t.player_id, t.rating, now - t.enqueued_at) for t in matchmaker.tickets()]
+    with invites_lock:
+        invites = [(target, inviter, variant) for (target, inviter), (_, variant) in pending_invites.items()]
+    return {"version": 1, "players": players, "connections": connections, "sessions": detached,
+            "rooms": room_list, "queue": queue, "invites": invites}
+
+def handoff_import(socks, snapshot):
+    # Processo nuovo: ricostruisce lo stato del vecchio attorno ai suoi socket.
+    # Restituisce [(socket, adopted)] per client_handler, da avviare dopo la conferma.
+    if snapshot.get("version") != 1: raise HandoffError(f"Fotografia non supportata: {snapshot.get('version')}")
+    conns = {}          # player_id -> Session (o Outbound)
+    deltas = {}         # player_id -> usa i delta della lista giocatori (None = non iscritto)
+    adopted = []
+    for sock, state in zip(socks, snapshot["connections"]):
+        pid = state["player_id"]
+        out = conn = Outbound(sock, on_overflow=lambda c, pid=pid: log(f"[Lento] {pid}: coda piena, disconnesso."))
+        set_codec(out, state["codec"])
+        session = None
+        if pid and state["session"]:
+            session = conn = sessions.restore(state["session"], pid, state["seq"], out)
+            set_codec(session, state["codec"])
+        if pid:
+            if state["move_delta"]: conn.move_deltas = True
+            conns[pid], deltas[pid] = conn, state["presence_delta"]
+        adopted.append((sock, {"player_id": pid, "session": session, "out": out, "conn": conn,
+                               "pending": state["pending"], "spectating": state["spectating"],
+                               "heartbeat": state.get("heartbeat", False)}))
+    for token, pid, seq, move_delta, presence_delta in snapshot["sessions"]:
+        session = sessions.restore(token, pid, seq)
+        if move_delta: session.move_deltas = True
+        sessions.detach(session, None, lambda pid=pid, session=session: drop_player(pid, session))
+        conns[pid], deltas[pid] = session, presence_delta
+
+    with players_lock:
+        for pid, status in snapshot["players"]:
+            if pid in conns: players_data[pid] = {"conn": conns[pid], "status": status}
+        statuses = {pid: data["status"] for pid, data in players_data.items()}
+    for pid, status in statuses.items():
+        if deltas[pid] is not None: presence.attach(pid, conns[pid], deltas=deltas[pid])
+        presence.update(pid, status)
+        if status != "ingame": channels.join(LOBBY, pid, conns[pid], history=False)
+
+    # In ordine di creazione: l'indice giocatore -> stanza punta alla più recente.
+    for room_id, size, win, players, turn, status, moves, created_at, ended_at in sorted(snapshot["rooms"], key=lambda r: r[7]):
+        room = GameRoom(players[0][0], size=size, win=win)
+        room.id = room_id
+        room.players = dict(players)
+        room.replay_moves(moves)
+        room.turn, room.status, room.created_at, room.ended_at = turn, status, created_at, ended_at
+        room.connections = {pid: conns[pid] for pid in room.players if pid in conns}
+        rooms.add(room)
+        if status == "running":
+            for pid, c in room.connections.items(): channels.join(room_channel(room.id), pid, c, history=False)
+            schedule_bot(room)
+
+    for sock, state in adopted:
+        room = rooms.get(state["spectating"]) if state["spectating"] else None
+        if room is None: continue
+        with room.lock: spectators.watch(room.id, state["player_id"], state["conn"], spectate_state(room, {}))
+        channels.join(room_channel(room.id), state["player_id"], state["conn"], history=False)
+
+    # La ricerca mantiene anzianità e scadenza; il ripiego sul bot non si riprogramma.
+    now = matchmaker.clock()
+    for pid, rating, waited in snapshot["queue"]:
+        if pid not in conns: continue
+        ticket = matchmaker.enqueue(pid, conns[pid], rating, now - waited)
+        if ticket: wheel.schedule(max(0.0, SEARCH_TIMEOUT - waited), expire_search, ticket)
+    for target, inviter, variant in snapshot["invites"]:
+        if inviter in conns: add_invite(target, inviter, conns[inviter], variant)
+    return adopted
+
+def handoff_takeover(path):
+    # Avvio con --handoff: se su `path` c'è un processo in servizio se ne prende il
+    # posto. Il socket in ascolto ereditato, oppure None.
+    global handoff_gate
+    handoff_gate = handoff.Gate()
+    received = handoff.receive(path)
+    if received is None: return None
+    channel, listen_sock, socks, snapshot = received
+    with channel:
+        adopted = handoff_import(socks, snapshot)
+        channel.sendall(handoff.ACK)
+    # Solo dopo la conferma: fino ad allora il vecchio processo può ancora riprendere.
+    for sock, state in adopted:
+        try: addr = sock.getpeername()
+        except OSError: addr = None
+        threading.Thread(target=client_handler, args=(sock, addr, state), daemon=True).start()
+    log(f"[Handoff] Ripresi {len(adopted)} client, {len(players_data)} giocatori e {len(rooms)} stanze.")
+    return listen_sock
+
+def handoff_serve(path):
+    handoff.serve(path, handoff_export, log)
 
 # --- SERVER THREAD LISTENER ---
 def run_server_listener(sock):
     global server_running
     try:
-        log(f"--- SERVER ONLINE SU PORTA 5000 ---")
+        store.open(STORE_PATH)
+        log(f"--- SERVER ONLINE SU PORTA {sock.getsockname()[1]} ---")
         while server_running:
+            if handoff_gate and not handoff_gate.accepting(sock): break
             try:
                 conn, addr = sock.accept()
                 threading.Thread(target=client_handler, args=(conn, addr), daemon=True).start()
@@ -293,31 +999,45 @@ def run_server_listener(sock):
         log("--- SERVER OFFLINE ---")
         server_running = False
 
+def run_async_listener(sock):
+    # Modalità asyncio: stessi Client, trasporto di aio_server.py.
+    global server_running, aio_server
+    try:
+        store.open(STORE_PATH)
+        aio_server = AsyncServer(Client, log)
+        aio_server.run(sock)
+    except Exception as e: log(f"Errore listener: {e}")
+    finally: server_running = False
+
 # --- GUI ---
 def main(page: ft.Page):
     page.window.icon = "icon.ico"
-    global gui_log_callback, server_running, server_socket
+    global server_running, server_socket
     page.title = "Tris Server Console"; page.theme_mode = ft.ThemeMode.DARK; page.window_width = 700; page.window_height = 550; page.bgcolor = "#1f2128"
     
     logs_view = ft.ListView(expand=True, spacing=5, padding=15, auto_scroll=True)
     
-    def add_log_line(text):
-        color = "#e0e0e0"
-        if "[Errore]" in text: color = "#ff5252"
-        elif "[Match]" in text: color = "#69f0ae"
-        elif "[Login]" in text: color = "#40c4ff"
-        elif "[Connect]" in text: color = "#9e9e9e"
-        elif "--- SERVER" in text: color = "#ffd740"
-        elif "[Invito]" in text: color = "orange"
-        logs_view.controls.append(ft.Text(f"{time.strftime('%H:%M:%S')} | {text}", color=color, font_family="Consolas", size=13))
+    def add_log_lines(batch):
+        # Chiamata dal consumatore di logpipe: un blocco di righe, un solo page.update.
+        for ts, level, text in batch:
+            color = "#e0e0e0"
+            if "[Errore]" in text: color = "#ff5252"
+            elif "[Match]" in text: color = "#69f0ae"
+            elif "[Login]" in text: color = "#40c4ff"
+            elif "[Connect]" in text: color = "#9e9e9e"
+            elif "--- SERVER" in text: color = "#ffd740"
+            elif "[Invito]" in text: color = "orange"
+            logs_view.controls.append(ft.Text(f"{time.strftime('%H:%M:%S', time.localtime(ts))} | {text}", color=color, font_family="Consolas", size=13))
+        overflow = len(logs_view.controls) - GUI_LOG_LINES
+        if overflow > 0: del logs_view.controls[:overflow]
         page.update()
         
-    gui_log_callback = add_log_line
+    logpipe.sink = add_log_lines
     status_indicator = ft.Container(width=15, height=15, border_radius=15, bgcolor="red", animate=ft.Animation(500, "bounceOut"))
     status_text = ft.Text("SERVER FERMO", weight="bold", color="red")
     
     def start_server_click(e):
-        global server_running, server_socket
+        global server_running, server_socket, aio_server
         if server_running: return
         try:
             temp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -334,19 +1054,26 @@ def main(page: ft.Page):
         server_running = True
         btn_start.disabled = True
         btn_stop.disabled = False
+        mode_dropdown.disabled = True
         status_indicator.bgcolor = "green"
-        status_text.value = "SERVER ATTIVO (Port 5000)"
+        status_text.value = f"SERVER ATTIVO (Port 5000, {server_mode})"
         status_text.color = "green"
         page.update()
         
-        threading.Thread(target=run_server_listener, args=(server_socket,), daemon=True).start()
+        listener = run_async_listener if server_mode == "asyncio" else run_server_listener
+        threading.Thread(target=listener, args=(server_socket,), daemon=True).start()
+        start_metrics()
 
     def stop_server_click(e):
-        global server_running, server_socket
+        global server_running, server_socket, aio_server
         if not server_running: return
         log("Arresto server richiesto...")
         server_running = False
         
+        if aio_server:
+            aio_server.stop()
+            aio_server = None
+
         if server_socket: 
             try: server_socket.close()
             except: pass
@@ -361,6 +1088,7 @@ def main(page: ft.Page):
             
         btn_start.disabled = False
         btn_stop.disabled = True
+        mode_dropdown.disabled = False
         status_indicator.bgcolor = "red"
         status_text.value = "SERVER FERMO"
         status_text.color = "red"
@@ -368,10 +1096,48 @@ def main(page: ft.Page):
 
     btn_start = ft.ElevatedButton("Avvia Server", icon="play_arrow", on_click=start_server_click, bgcolor="green", color="white")
     btn_stop = ft.ElevatedButton("Ferma Server", icon="stop", on_click=stop_server_click, bgcolor="red", color="white", disabled=True)
+
+    def mode_change(e):
+        global server_mode
+        server_mode = mode_dropdown.value
+
+    mode_dropdown = ft.Dropdown(value=server_mode, width=160, options=[ft.dropdown.Option(m) for m in SERVER_MODES], on_change=mode_change)
+
+    # --- Pannello metriche: aggiornato una volta al secondo da un thread ---
+    metrics_text = ft.Text("", font_family="Consolas", size=12, color="#b0bec5")
+
+    def profiler_change(e):
+        if profiler_switch.value:
+            metrics.PROFILER.start()
+            log("[Profiler] Avviato (report su /profile).")
+        else:
+            metrics.PROFILER.stop()
+            for line in metrics.PROFILER.report(top=8).splitlines()[:10]: log(f"[Profiler] {line}")
+
+    profiler_switch = ft.Switch(label="Profiler", value=False, on_change=profiler_change)
+
+    def refresh_metrics():
+        last_total, last_t = MESSAGES.total(), time.monotonic()
+        while True:
+            time.sleep(1)
+            total, now = MESSAGES.total(), time.monotonic()
+            rate, last_total, last_t = (total - last_total) / (now - last_t), total, now
+            g = metrics.REGISTRY.gauges()
+            moves, avg, p99 = MOVE_SECONDS.summary()
+            waits = ", ".join(f"{n} {metrics.LOCK_CONTENDED.value(n)}" for n in ("players", "rooms", "matchmaking"))
+            metrics_text.value = (
+                f"Connessioni {g['tris_connections']} | Giocatori {g['tris_players']} | Stanze {g['tris_rooms']} | "
+                f"In coda {g['tris_matchmaking_queue']} | Frame in uscita {g['tris_outbound_queued_frames']}\n"
+                f"Messaggi/s {rate:.0f} | apply_move {avg * 1e6:.0f} µs medi, p99 ≤ {p99 * 1e6:.0f} µs | Lock contesi: {waits}")
+            try: page.update()
+            except Exception: return
+
+    threading.Thread(target=refresh_metrics, daemon=True).start()
     
     page.add(
         ft.Container(content=ft.Row([ft.Row([ft.Icon("dns", size=30, color="blue"), ft.Text("Tris Server", size=24, weight="bold")]), ft.Row([status_indicator, status_text], alignment="center")], alignment=ft.MainAxisAlignment.SPACE_BETWEEN), padding=10, bgcolor="#2c2f38", border_radius=10),
-        ft.Container(content=ft.Row([btn_start, btn_stop], alignment=ft.MainAxisAlignment.CENTER, spacing=20), padding=10),
+        ft.Container(content=ft.Row([mode_dropdown, btn_start, btn_stop], alignment=ft.MainAxisAlignment.CENTER, spacing=20), padding=10),
+        ft.Container(content=ft.Row([metrics_text, profiler_switch], alignment=ft.MainAxisAlignment.SPACE_BETWEEN), padding=10, bgcolor="#2c2f38", border_radius=10),
         ft.Text("Console Logs:", size=14, color="grey"),
         ft.Container(content=logs_view, expand=True, bgcolor="#121212", border=ft.border.all(1, "#333333"), border_radius=10, margin=ft.margin.only(top=10)),
         ft.Text("v1.0 by Giuseppe E. Giuffrida - Raffaele Romeo - Karol Scandurra", size=10, color="grey", text_align="center")
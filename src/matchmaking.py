@@ -0,0 +1,146 @@
+# matchmaking.py
+# Coda di matchmaking a fasce di punteggio.
+# - enqueue/cancel sono O(1): ogni fascia è un dict ordinato per arrivo (FIFO);
+# - un thread esegue a ogni tick un passaggio di abbinamento su tutta la coda,
+#   dal giocatore che aspetta da più tempo, e consegna le coppie in blocco a on_pairs;
+# - la finestra di punteggio accettata si allarga col tempo di attesa.
+# Per ora nessuno assegna un punteggio: tutti entrano con DEFAULT_RATING, quindi
+# stanno in una sola fascia e l'abbinamento è per ordine di arrivo. Fasce e
+# finestra servono solo quando enqueue() riceverà un rating vero.
+import threading
+import time
+
+DEFAULT_RATING = 1000     # l'unico in uso finché non esiste una fonte di punteggio
+
+
+class Ticket:
+    __slots__ = ("player_id", "conn", "rating", "enqueued_at", "bucket")
+
+    def __init__(self, player_id, conn, rating, enqueued_at, bucket):
+        self.player_id = player_id
+        self.conn = conn
+        self.rating = rating
+        self.enqueued_at = enqueued_at
+        self.bucket = bucket
+
+
+class Matchmaker:
+    def __init__(self, on_pairs, tick=0.1, bucket_width=100, initial_window=100,
+                 widen_per_sec=50, max_window=1000, log=print, clock=time.monotonic, autostart=True, lock=None):
+        self.on_pairs = on_pairs
+        self.tick = tick
+        self.bucket_width = bucket_width
+        self.initial_window = initial_window
+        self.widen_per_sec = widen_per_sec
+        self.max_window = max_window
+        self.log = log
+        self.clock = clock
+        self._lock = lock or threading.Lock()
+        self._tickets = {}      # player_id -> Ticket, in ordine di arrivo
+        self._buckets = {}      # indice fascia -> {player_id: Ticket}
+        self._stop = threading.Event()
+        self._thread = None
+        if autostart: self.start()
+
+    # --- Coda ---
+    def enqueue(self, player_id, conn, rating=DEFAULT_RATING, enqueued_at=None):
+        # Il Ticket (None se già in coda): serve a cancel() per annullare proprio questa ricerca.
+        ticket = Ticket(player_id, conn, rating, self.clock() if enqueued_at is None else enqueued_at,
+                        int(rating // self.bucket_width))
+        return self._insert(ticket)
+
+    def requeue(self, ticket):
+        # Rimette in coda un giocatore abbinato a qualcuno sparito nel frattempo,
+        # mantenendo la sua anzianità (e lo stesso Ticket).
+        return self._insert(ticket)
+
+    def _insert(self, ticket):
+        with self._lock:
+            if ticket.player_id in self._tickets: return None
+            self._tickets[ticket.player_id] = ticket
+            self._buckets.setdefault(ticket.bucket, {})[ticket.player_id] = ticket
+            return ticket
+
+    def cancel(self, player_id, ticket=None):
+        # Con `ticket` annulla solo se in coda c'è ancora quella ricerca (scadenze).
+        with self._lock:
+            current = self._tickets.get(player_id)
+            if current is None or (ticket is not None and current is not ticket): return False
+            del self._tickets[player_id]
+            self._unlink(current)
+            return True
+
+    def _unlink(self, ticket):
+        bucket = self._buckets[ticket.bucket]
+        del bucket[ticket.player_id]
+        if not bucket: del self._buckets[ticket.bucket]
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def __contains__(self, player_id):
+        return player_id in self._tickets
+
+    def tickets(self):
+        with self._lock: return list(self._tickets.values())
+
+    def window(self, ticket, now):
+        return min(self.max_window, self.initial_window + self.widen_per_sec * (now - ticket.enqueued_at))
+
+    # --- Abbinamento ---
+    def match_once(self, now=None):
+        now = self.clock() if now is None else now
+        pairs = []
+        with self._lock:
+            for ticket in list(self._tickets.values()):
+                if ticket.player_id not in self._tickets: continue  # già abbinato in questo passaggio
+                window = self.window(ticket, now)
+                partner = self._find_partner(ticket, window)
+                if partner is None: continue
+                for t in (ticket, partner):
+                    del self._tickets[t.player_id]
+                    self._unlink(t)
+                pairs.append((ticket, partner))
+        return pairs
+
+    def _find_partner(self, ticket, window):
+        # Fasce dalla più vicina alla più lontana, solo quelle che toccano la finestra;
+        # in ogni fascia il più anziano. Una fascia tutta dentro la finestra si ferma
+        # al primo ticket; solo le due ai bordi saltano quelli fuori portata.
+        width = self.bucket_width
+        lo, hi = ticket.rating - window, ticket.rating + window
+        first, last = int(lo // width), int(hi // width)
+        best = None
+        for distance in range(max(ticket.bucket - first, last - ticket.bucket) + 1):
+            for b in {ticket.bucket - distance, ticket.bucket + distance}:
+                if not first <= b <= last: continue
+                bucket = self._buckets.get(b)
+                if not bucket: continue
+                inside = lo <= b * width and (b + 1) * width <= hi
+                for other in bucket.values():
+                    if other is ticket or not (inside or lo <= other.rating <= hi): continue
+                    if best is None or other.enqueued_at < best.enqueued_at: best = other
+                    break
+            if best is not None: return best
+        return None
+
+    def run(self):
+        while not self._stop.wait(self.tick):
+            try:
+                pairs = self.match_once()
+                if pairs: self.on_pairs(pairs)
+            except Exception as e:
+                self.log(f"[Matchmaking] Errore: {e}")
+
+    def start(self):
+        # Anche dopo stop(): il riavvio con handoff ferma il thread e, se fallisce, lo riprende.
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # Al ritorno nessun abbinamento è in corso.
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread(): thread.join()
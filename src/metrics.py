@@ -0,0 +1,252 @@
+# metrics.py
+# Metriche del server in memoria, esposte in formato testo Prometheus:
+# - Counter e Histogram con etichette (un lock per metrica, aggiornamenti O(1));
+# - gauge calcolati al momento della lettura (connessioni, stanze, coda...);
+# - InstrumentedLock: un Lock che misura l'attesa solo quando è conteso;
+# - un profiler a campionamento (sys._current_frames) attivabile a caldo;
+# - un endpoint HTTP locale: /metrics, /profile, /profile/start, /profile/stop.
+import bisect
+import collections
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _labels(names, values):
+    if not names: return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def total(self):
+        with self._lock: return sum(self._values.values())
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock: items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labels, k)} {v}" for k, v in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}   # etichette -> [conteggi per bucket (+Inf in coda), somma, totale]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None: series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def summary(self, *labels):
+        # (totale, media, p99 approssimato al limite del bucket)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None: return 0, 0.0, 0.0
+            counts, total, n = list(series[0]), series[1], series[2]
+        target, seen = n * 0.99, 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):
+            seen += c
+            if seen >= target: break
+        return n, total / n, bound
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock: items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        for key, (counts, total, n) in items:
+            names, cumulative = self.labels + ("le",), 0
+            for bound, c in zip(self.buckets + ("+Inf",), counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []   # (nome, help, funzione)
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn):
+        self._gauges.append((name, help, fn))
+
+    def gauges(self):
+        values = {}
+        for name, _, fn in self._gauges:
+            try: values[name] = fn()
+            except Exception: values[name] = float("nan")
+        return values
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics: lines += metric.expose()
+        helps = {name: help for name, help, _ in self._gauges}
+        for name, value in self.gauges().items():
+            lines += [f"# HELP {name} {helps[name]}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+LOCK_WAIT = REGISTRY.histogram("tris_lock_wait_seconds", "Attesa sui lock contesi", ("lock",))
+LOCK_CONTENDED = REGISTRY.counter("tris_lock_contended_total", "Acquisizioni che hanno dovuto aspettare", ("lock",))
+BROADCAST_FANOUT = REGISTRY.histogram("tris_broadcast_fanout", "Destinatari per broadcast", ("kind",), FANOUT_BUCKETS)
+BROADCAST_SECONDS = REGISTRY.histogram("tris_broadcast_seconds", "Durata dei broadcast (serializzazione e accodamento)", ("kind",))
+
+
+class InstrumentedLock:
+    # Stessa interfaccia di threading.Lock. Il caso non conteso costa un acquire
+    # non bloccante; solo se il lock è occupato si misura l'attesa.
+    __slots__ = ("name", "_lock")
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self._lock.acquire(False): return True
+        if not blocking: return False
+        start = time.perf_counter()
+        ok = self._lock.acquire(True, timeout)
+        LOCK_WAIT.observe(time.perf_counter() - start, self.name)
+        LOCK_CONTENDED.inc(self.name)
+        return ok
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+# --- Profiler a campionamento ---
+class SamplingProfiler:
+    # Wall-clock: campiona tutti i thread, anche quelli fermi in recv o in attesa
+    # di un lock (la foglia è la funzione Python che sta aspettando).
+    def __init__(self, interval=0.005, depth=12):
+        self.interval = interval
+        self.depth = depth
+        self.samples = 0
+        self.stacks = collections.Counter()     # "f1;f2;...;foglia" -> campioni
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running: return
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me: continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self, top=25):
+        # Stack compressi (formato flamegraph) in ordine di campioni, più le funzioni foglia.
+        stacks = self.stacks.most_common()
+        total = sum(c for _, c in stacks) or 1
+        leaves = collections.Counter()
+        for stack, c in stacks: leaves[stack.rsplit(";", 1)[-1]] += c
+        lines = [f"# campioni: {self.samples}, profiler {'attivo' if self.running else 'fermo'}", "# funzioni foglia"]
+        lines += [f"{c * 100 / total:6.2f}% {name}" for name, c in leaves.most_common(top)]
+        lines.append("# stack compressi")
+        lines += [f"{stack} {c}" for stack, c in stacks[:top]]
+        return "\n".join(lines) + "\n"
+
+
+PROFILER = SamplingProfiler()
+
+
+# --- Endpoint HTTP ---
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = REGISTRY.expose()
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        elif path in ("/profile", "/profile/start", "/profile/stop"):
+            if path.endswith("/start"): PROFILER.start()
+            elif path.endswith("/stop"): PROFILER.stop()
+            body = PROFILER.report()
+            ctype = "text/plain; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_http(host="127.0.0.1", port=9100):
+    # Solo in locale per default: niente autenticazione.
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
@@ -0,0 +1,219 @@
+# outbound.py
+# Coda di uscita per connessione. Chi invia (broadcast, chat, presence) accoda
+# il frame e torna subito; un thread writer dedicato svuota la coda e scrive in
+# un solo sendall tutti i frame accumulati. Un client lento quindi rallenta solo
+# il proprio writer.
+# LoopOutbound fa lo stesso per le connessioni del server asyncio.
+# Politica per i consumatori lenti:
+#   - oltre `soft_limit` frame in coda si scartano gli aggiornamenti "droppable"
+#     (lista giocatori: il client si risincronizza con presence_resync);
+#   - oltre `high_water` frame la connessione viene chiusa.
+import collections
+import socket
+import threading
+import weakref
+
+_live = weakref.WeakSet()
+_totals = {"dropped": 0, "overflow_disconnects": 0}
+_totals_lock = threading.Lock()
+
+
+class Outbound:
+    supports_droppable = True
+
+    def __init__(self, sock, soft_limit=64, high_water=256, on_overflow=None):
+        self.sock = sock
+        self.soft_limit = soft_limit
+        self.high_water = high_water
+        self.on_overflow = on_overflow
+        self.closed = False
+        self.max_depth = 0
+        self.dropped = 0
+        self._queue = collections.deque()  # (frame, droppable)
+        self._busy = False      # il writer sta scrivendo un blocco già tolto dalla coda
+        lock = threading.RLock()
+        self._cond = threading.Condition(lock)
+        self._idle = threading.Condition(lock)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        _live.add(self)
+
+    def depth(self):
+        return len(self._queue)
+
+    # Stessa firma di socket.sendall: send_msg() funziona invariato.
+    def sendall(self, data, droppable=False):
+        with self._cond:
+            if self.closed: raise OSError("Connessione chiusa")
+            depth = len(self._queue)
+            if depth >= self.soft_limit:
+                if droppable:
+                    self._drop(1)
+                    return
+                # Prima si sacrificano gli aggiornamenti già in coda.
+                kept = [item for item in self._queue if not item[1]]
+                if len(kept) != depth:
+                    self._drop(depth - len(kept))
+                    self._queue = collections.deque(kept)
+                    depth = len(kept)
+            if depth >= self.high_water:
+                overflow = True
+            else:
+                overflow = False
+                self._queue.append((data, droppable))
+                if depth + 1 > self.max_depth: self.max_depth = depth + 1
+                self._cond.notify()
+        if overflow:
+            with _totals_lock: _totals["overflow_disconnects"] += 1
+            if self.on_overflow: self.on_overflow(self)
+            self.abort()
+            raise OSError("Coda di uscita piena: client troppo lento")
+
+    def _drop(self, n):
+        self.dropped += n
+        with _totals_lock: _totals["dropped"] += n
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._idle.notify_all()
+                while not self._queue and not self.closed: self._cond.wait()
+                if not self._queue: return
+                batch = self._queue
+                self._queue = collections.deque()
+                self._busy = True
+            data = b"".join(frame for frame, _ in batch) if len(batch) > 1 else batch[0][0]
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                self.abort()    # al giro dopo la coda è vuota e il writer esce
+
+    def drain(self, timeout=None):
+        # Aspetta che il writer abbia scritto tutta la coda (riavvio con handoff).
+        with self._cond:
+            return self._idle.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self, timeout=1.0):
+        # Chiusura ordinata: il writer invia quanto già in coda, poi esce.
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+    def abort(self):
+        # Chiusura immediata: si scarta la coda e si fa lo shutdown del socket,
+        # così anche il thread che legge da questa connessione si sblocca ed esce.
+        with self._cond:
+            self.closed = True
+            self._queue.clear()
+            self._cond.notify()
+        try: self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+
+
+class LoopOutbound:
+    # Stessa interfaccia di Outbound per le connessioni del server asyncio: niente
+    # thread writer, i frame finiscono nel buffer del transport dal thread del loop.
+    # Chi invia da altri thread (matchmaker, ruota dei timer, chat) accoda e sveglia
+    # il loop; i frame escono nell'ordine delle chiamate, uniti in una sola write.
+    # I limiti sono in byte non ancora scritti sul socket (coda + buffer del transport).
+    supports_droppable = True
+
+    def __init__(self, loop, transport, soft_limit=256 * 1024, high_water=1024 * 1024, on_overflow=None):
+        self.loop = loop
+        self.transport = transport
+        self.sock = transport.get_extra_info("socket")
+        self.soft_limit = soft_limit
+        self.high_water = high_water
+        self.on_overflow = on_overflow
+        self.closed = False
+        self.max_depth = 0
+        self.dropped = 0
+        self._queue = []
+        self._bytes = 0
+        self._scheduled = False
+        self._owner = threading.get_ident()    # creata nel thread del loop
+        self._lock = threading.Lock()
+        _live.add(self)
+
+    def depth(self):
+        return len(self._queue)
+
+    def sendall(self, data, droppable=False):
+        with self._lock:
+            if self.closed: raise OSError("Connessione chiusa")
+            backlog = self._bytes + self.transport.get_write_buffer_size()
+            if droppable and backlog >= self.soft_limit:
+                self._drop(1)
+                return
+            overflow = backlog >= self.high_water
+            if not overflow:
+                self._queue.append(data)
+                self._bytes += len(data)
+                if len(self._queue) > self.max_depth: self.max_depth = len(self._queue)
+                wake, self._scheduled = not self._scheduled, True
+        if overflow:
+            with _totals_lock: _totals["overflow_disconnects"] += 1
+            if self.on_overflow: self.on_overflow(self)
+            self.abort()
+            raise OSError("Coda di uscita piena: client troppo lento")
+        if wake: self._call(self._flush)
+
+    def _drop(self, n):
+        self.dropped += n
+        with _totals_lock: _totals["dropped"] += n
+
+    def _call(self, fn):
+        try:
+            if threading.get_ident() == self._owner: self.loop.call_soon(fn)
+            else: self.loop.call_soon_threadsafe(fn)
+        except RuntimeError: pass      # loop già chiuso: il server è fermo
+
+    def _flush(self):
+        with self._lock:
+            batch, self._queue = self._queue, []
+            self._bytes = 0
+            self._scheduled = False
+        if batch and not self.transport.is_closing():
+            self.transport.write(b"".join(batch) if len(batch) > 1 else batch[0])
+
+    def close(self, timeout=None):
+        # Chiusura ordinata: il transport scrive quanto già in coda, poi chiude.
+        with self._lock:
+            if self.closed: return
+            self.closed = True
+        self._call(self._close)
+
+    def _close(self):
+        self._flush()
+        self.transport.close()
+
+    def abort(self):
+        # Chiusura immediata: la lettura della connessione si interrompe.
+        with self._lock:
+            self.closed = True
+            self._queue = []
+            self._bytes = 0
+        self._call(self.transport.abort)
+
+
+def post(conn, data, droppable=False):
+    # Invio di un frame già serializzato verso Outbound (o Session) o verso un oggetto socket-like.
+    if getattr(conn, "supports_droppable", False): conn.sendall(data, droppable=droppable)
+    else: conn.sendall(data)
+
+
+def queue_stats():
+    conns = list(_live)
+    depths = [c.depth() for c in conns if not c.closed]
+    with _totals_lock: totals = dict(_totals)
+    return {
+        "connections": len(depths),
+        "queued_frames": sum(depths),
+        "max_queue_depth": max(depths, default=0),
+        "peak_queue_depth": max((c.max_depth for c in conns), default=0),
+        "dropped_frames": totals["dropped"],
+        "overflow_disconnects": totals["overflow_disconnects"],
+    }
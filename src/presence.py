@@ -0,0 +1,121 @@
+# presence.py
+# Lista giocatori a delta versionati. I cambi di stato (entrato, uscito, stato
+# cambiato) si accumulano e un solo thread li invia ogni `window` secondi:
+# un frame per destinatario, qualunque sia il numero di cambi nella finestra.
+# - client con feature "presence_delta": player_list_delta {base, version, joined, left, changed}
+#   e una lista completa solo al login o quando chiedono un resync (buco di versione);
+# - client storici: player_list_update completo, ma al massimo uno per finestra.
+import threading
+import time
+from protocollo import pack_for
+from outbound import post
+from metrics import BROADCAST_FANOUT, BROADCAST_SECONDS
+
+FEATURE_DELTA = "presence_delta"
+
+
+class PresenceHub:
+    def __init__(self, window=0.05, log=print):
+        self.window = window
+        self.log = log
+        self.version = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._published = {}    # player_id -> status già comunicato ai client
+        self._pending = {}      # player_id -> nuovo status (None = uscito)
+        self._recipients = {}   # player_id -> (conn, usa_delta)
+        self._resync = set()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # --- Destinatari ---
+    def attach(self, player_id, conn, deltas=False):
+        with self._lock:
+            self._recipients[player_id] = (conn, deltas)
+            self._resync.add(player_id)
+        self._wake.set()
+
+    def detach(self, player_id):
+        with self._lock:
+            self._recipients.pop(player_id, None)
+            self._resync.discard(player_id)
+
+    def deltas(self, player_id):
+        # Se il destinatario usa i delta; None se non è un destinatario.
+        with self._lock:
+            entry = self._recipients.get(player_id)
+            return entry[1] if entry else None
+
+    def resync(self, player_id):
+        with self._lock:
+            if player_id in self._recipients: self._resync.add(player_id)
+        self._wake.set()
+
+    # --- Cambi di stato ---
+    def update(self, player_id, status):
+        with self._lock:
+            self._pending[player_id] = status
+        self._wake.set()
+
+    def sync(self, statuses):
+        # Sostituisce l'intera directory (modalità cluster: la manda il coordinatore).
+        with self._lock:
+            current = dict(self._published)
+            current.update(self._pending)
+            for pid in current:
+                if pid not in statuses and current[pid] is not None: self._pending[pid] = None
+            for pid, status in statuses.items():
+                if current.get(pid) != status: self._pending[pid] = status
+        self._wake.set()
+
+    # --- Invio ---
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.window)   # coalesce dei cambi nella finestra
+            self._wake.clear()
+            try: self.flush()
+            except Exception as e: self.log(f"[Presence] Errore flush: {e}")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            resync, self._resync = self._resync, set()
+            joined, left, changed = [], [], []
+            for pid, status in pending.items():
+                old = self._published.get(pid)
+                if status is None:
+                    if pid in self._published:
+                        del self._published[pid]
+                        left.append(pid)
+                elif old is None:
+                    self._published[pid] = status
+                    joined.append({"name": pid, "status": status})
+                elif old != status:
+                    self._published[pid] = status
+                    changed.append({"name": pid, "status": status})
+            base = self.version
+            if joined or left or changed: self.version += 1
+            version = self.version
+            users_list = [{"name": pid, "status": s} for pid, s in self._published.items()]
+            recipients = list(self._recipients.items())
+
+        if not (joined or left or changed or resync): return
+        start = time.perf_counter()
+        sent = 0
+        full = {"type": "player_list_update", "data": users_list, "version": version}
+        legacy = {"type": "player_list_update", "data": users_list}
+        delta = {"type": "player_list_delta", "data": {"base": base, "version": version, "joined": joined, "left": left, "changed": changed}}
+        frames = ({}, {}, {})
+        changed_any = version != base
+        for pid, (conn, deltas) in recipients:
+            if deltas and pid in resync: obj, cache = full, frames[0]
+            elif deltas and changed_any: obj, cache = delta, frames[1]
+            elif not deltas and (changed_any or pid in resync): obj, cache = legacy, frames[2]
+            else: continue
+            # droppable: con la coda piena la lista è la prima cosa che si sacrifica
+            try: post(conn, pack_for(conn, obj, cache), droppable=True)
+            except Exception: pass
+            sent += 1
+        BROADCAST_FANOUT.observe(sent, "presence")
+        BROADCAST_SECONDS.observe(time.perf_counter() - start, "presence")
@@ -1,46 +1,129 @@
 # protocollo.py
+import io
 import pickle
 import struct
+import weakref
+import codec
 
-# Frame format: [4-byte length prefix][pickle payload]
+# Frame format: [4-byte length prefix][payload]
+# Il payload è pickle (client storici) oppure binario (codec.py, primo byte 0xB7):
+# il formato si riconosce frame per frame, quindi in ricezione convivono entrambi.
+# In invio si usa il codec negoziato al login per quella connessione.
+
+# Limite sulla dimensione di un singolo frame: il prefisso a 4 byte
+# permetterebbe altrimenti a un client di forzare un'allocazione da 4 GB.
+MAX_FRAME_SIZE = 1 << 20
+
+_LEN = struct.Struct('!I')
+
+CODEC_PICKLE = "pickle"
+CODEC_BINARY = "bin1"
+SUPPORTED_CODECS = (CODEC_BINARY, CODEC_PICKLE)  # in ordine di preferenza
+
+_codecs = weakref.WeakKeyDictionary()
 
 
 class ProtocolError(Exception):
     pass
 
 
-def send_msg(sock, obj):
+class _SafeUnpickler(pickle.Unpickler):
+    # I messaggi sono solo dict/list/str/int/None: nessuna classe da importare,
+    # quindi un client non può far eseguire codice arbitrario al server.
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Tipo non ammesso: {module}.{name}")
+
+
+def choose_codec(offered):
+    if isinstance(offered, (list, tuple)):
+        for name in SUPPORTED_CODECS:
+            if name in offered: return name
+    return CODEC_PICKLE
+
+
+def set_codec(sock, name):
+    if name not in SUPPORTED_CODECS:
+        raise ProtocolError(f"Codec non supportato: {name}")
+    try: _codecs[sock] = name
+    except TypeError: sock.codec = name
+
+
+def codec_of(sock):
+    return getattr(sock, "codec", None) or _codecs.get(sock, CODEC_PICKLE)
+
+
+def pack_msg(obj, codec_name=CODEC_PICKLE):
     try:
-        payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        if codec_name == CODEC_BINARY:
+            payload = codec.encode(obj)
+        else:
+            payload = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
     except Exception as e:
         raise ProtocolError(f"Serialization error: {e}")
 
-    length = struct.pack('!I', len(payload))
+    return _LEN.pack(len(payload)) + payload
+
+
+def pack_for(sock, obj, cache=None):
+    # Serializza una sola volta per codec: utile nei broadcast.
+    name = codec_of(sock)
+    if cache is None: return pack_msg(obj, name)
+    frame = cache.get(name)
+    if frame is None: frame = cache[name] = pack_msg(obj, name)
+    return frame
+
+
+def unpack_payload(payload):
+    try:
+        if payload[:1] == bytes((codec.BIN_MAGIC,)):
+            return codec.decode(payload)
+        return _SafeUnpickler(io.BytesIO(payload)).load()
+    except Exception as e:
+        raise ProtocolError(f"Deserialization error: {e}")
+
+
+def recode_frame(frame, codec_name):
+    # Riconverte un frame già serializzato nel codec richiesto (se serve).
+    is_binary = frame[4:5] == bytes((codec.BIN_MAGIC,))
+    if is_binary == (codec_name == CODEC_BINARY): return frame
+    return pack_msg(unpack_payload(frame[4:]), codec_name)
+
+
+def send_msg(sock, obj):
+    frame = pack_msg(obj, codec_of(sock))
 
     try:
-        sock.sendall(length + payload)
+        sock.sendall(frame)
     except Exception as e:
         raise ProtocolError(f"Send error: {e}")
 
 
 def recv_exact(sock, n):
-    data = b""
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
-        if not chunk:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if not k:
             raise ProtocolError("Connection closed unexpectedly during recv_exact.")
-        data += chunk
-    return data
+        got += k
+    return buf
 
 
-def recv_msg(sock):
+def _check_length(length, max_frame):
+    if length > max_frame:
+        raise ProtocolError(f"Frame too large: {length} bytes (max {max_frame})")
+
+
+def recv_msg(sock, max_frame=MAX_FRAME_SIZE):
     # Read length prefix
     try:
         header = recv_exact(sock, 4)
     except Exception as e:
         raise ProtocolError(f"Header read error: {e}")
 
-    (length,) = struct.unpack('!I', header)
+    (length,) = _LEN.unpack(header)
+    _check_length(length, max_frame)
 
     # Read payload
     try:
@@ -49,9 +132,108 @@ def recv_msg(sock):
         raise ProtocolError(f"Payload read error: {e}")
 
     # Deserialize
+    return unpack_payload(payload)
+
+
+class FrameReader:
+    # Lettore di frame per connessione: un solo bytearray preallocato riempito
+    # con recv_into. Una read può consegnare più frame interi, che vengono
+    # restituiti uno alla volta senza altre syscall. I payload sono memoryview
+    # sul buffer interno: restano validi solo fino alla chiamata successiva.
+    # `initial`: byte già letti da un altro processo (riavvio con handoff).
+    def __init__(self, sock, max_frame=MAX_FRAME_SIZE, bufsize=64 * 1024, initial=b""):
+        self.sock = sock
+        self.max_frame = max_frame
+        self.bufsize = bufsize
+        self.wait = None        # se impostata, chiamata prima di ogni recv (vedi handoff.Gate)
+        self._buf = bytearray(max(bufsize, len(initial)))
+        self._buf[:len(initial)] = initial
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = len(initial)
+
+    def pending(self):
+        # Byte letti ma non ancora restituiti come frame.
+        return bytes(self._view[self._start:self._end])
+
+    def _make_room(self, need):
+        pending = self._end - self._start
+        size = len(self._buf)
+        if pending == 0 and size > self.bufsize:
+            # Dopo un frame grande si torna alla dimensione di partenza.
+            self._buf = bytearray(self.bufsize)
+            self._view = memoryview(self._buf)
+            self._start = self._end = 0
+            size = self.bufsize
+        if self._start + need <= size and self._end < size:
+            return
+        if need > size:
+            # Il buffer non può essere ridimensionato mentre ci sono view esportate:
+            # se ne alloca uno nuovo e si copiano solo i byte pendenti.
+            buf = bytearray(max(need, 2 * size))
+            buf[:pending] = self._view[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        elif self._start:
+            self._view[:pending] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    def _fill(self):
+        if self.wait is not None: self.wait()
+        try:
+            n = self.sock.recv_into(self._view[self._end:])
+        except Exception as e:
+            raise ProtocolError(f"Read error: {e}")
+        if not n:
+            raise ProtocolError("Connection closed unexpectedly.")
+        self._end += n
+
+    def next_payload(self):
+        while True:
+            avail = self._end - self._start
+            if avail >= 4:
+                (length,) = _LEN.unpack_from(self._buf, self._start)
+                _check_length(length, self.max_frame)
+                if avail >= 4 + length:
+                    begin = self._start + 4
+                    self._start = begin + length
+                    if self._start == self._end: self._start = self._end = 0
+                    return self._view[begin:begin + length]
+                need = 4 + length
+            else:
+                need = 4
+            self._make_room(need)
+            self._fill()
+
+    def recv_msg(self):
+        return unpack_payload(self.next_payload())
+
+
+# --- Varianti asyncio (StreamReader / StreamWriter) ---
+
+async def send_msg_async(writer, obj):
+    frame = pack_msg(obj, codec_of(writer))
+
     try:
-        obj = pickle.loads(payload)
+        writer.write(frame)
+        await writer.drain()
     except Exception as e:
-        raise ProtocolError(f"Deserialization error: {e}")
+        raise ProtocolError(f"Send error: {e}")
+
+
+async def recv_msg_async(reader, max_frame=MAX_FRAME_SIZE):
+    try:
+        header = await reader.readexactly(4)
+    except Exception as e:
+        raise ProtocolError(f"Header read error: {e}")
+
+    (length,) = _LEN.unpack(header)
+    _check_length(length, max_frame)
+
+    try:
+        payload = await reader.readexactly(length)
+    except Exception as e:
+        raise ProtocolError(f"Payload read error: {e}")
 
-    return obj
+    return unpack_payload(payload)
@@ -0,0 +1,77 @@
+# registry.py
+# Registro delle stanze con indice player_id -> room_id.
+# Stanze e indice sono divisi in `stripes` partizioni, ognuna col proprio lock:
+# partite diverse finiscono (quasi sempre) su lock diversi e non si contendono
+# un unico rooms_lock. Le operazioni che toccano più chiavi prendono i lock delle
+# partizioni coinvolte in ordine crescente, così stanza e indice cambiano insieme.
+import threading
+from contextlib import contextmanager
+
+
+class RoomRegistry:
+    def __init__(self, stripes=64, lock=threading.Lock):
+        self._locks = [lock() for _ in range(stripes)]
+        self._rooms = [{} for _ in range(stripes)]      # room_id -> GameRoom
+        self._players = [{} for _ in range(stripes)]    # player_id -> room_id
+
+    def _stripe(self, key):
+        return hash(key) % len(self._locks)
+
+    @contextmanager
+    def _locked(self, *keys):
+        idx = sorted({self._stripe(k) for k in keys})
+        for i in idx: self._locks[i].acquire()
+        try: yield
+        finally:
+            for i in reversed(idx): self._locks[i].release()
+
+    def add(self, room):
+        # Registra la stanza e indicizza tutti i giocatori che contiene ora.
+        players = list(room.players)
+        with self._locked(room.id, *players):
+            self._rooms[self._stripe(room.id)][room.id] = room
+            for pid in players: self._players[self._stripe(pid)][pid] = room.id
+
+    def bind(self, room, player_id):
+        with self._locked(room.id, player_id):
+            if room.id in self._rooms[self._stripe(room.id)]:
+                self._players[self._stripe(player_id)][player_id] = room.id
+
+    def remove(self, room_id):
+        while True:
+            room = self.get(room_id)
+            if room is None: return None
+            players = list(room.players)
+            with self._locked(room_id, *players):
+                shard = self._rooms[self._stripe(room_id)]
+                # Se nel frattempo è entrato un giocatore si riprova con i lock giusti.
+                if shard.get(room_id) is not room or list(room.players) != players: continue
+                del shard[room_id]
+                for pid in players:
+                    index = self._players[self._stripe(pid)]
+                    # Il giocatore potrebbe essere già in una stanza più recente.
+                    if index.get(pid) == room_id: del index[pid]
+                return room
+
+    def get(self, room_id):
+        i = self._stripe(room_id)
+        with self._locks[i]:
+            return self._rooms[i].get(room_id)
+
+    def room_of(self, player_id):
+        i = self._stripe(player_id)
+        with self._locks[i]:
+            room_id = self._players[i].get(player_id)
+        return self.get(room_id) if room_id is not None else None
+
+    def __contains__(self, room_id):
+        return self.get(room_id) is not None
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._rooms)
+
+    def values(self):
+        rooms = []
+        for lock, shard in zip(self._locks, self._rooms):
+            with lock: rooms.extend(shard.values())
+        return rooms
@@ -0,0 +1,85 @@
+# server.py
+# Avvio del server senza GUI, per benchmark e macchine senza display.
+#
+#   python server.py --mode threaded --port 5000
+#   python server.py --mode asyncio --port 5000 --quiet
+#   python server.py --mode cluster --workers 4 --port 5000
+#   python server.py --handoff /tmp/tris.sock   (rilanciato uguale, prende il posto
+#                                                 del processo in servizio senza chiudere le partite)
+import argparse
+import os
+import socket
+import sys
+from handoff import available
+
+MODES = ("threaded", "asyncio", "cluster")
+
+
+def raise_fd_limit():
+    # Migliaia di client: porta il limite dei file aperti al massimo consentito.
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard: resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def listen(host, port, backlog=1024):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def run(mode, host, port, workers, log_file=None, log_level="INFO", metrics_port=None, db=None, handoff=None):
+    if mode == "cluster":
+        from cluster import run_cluster
+        run_cluster(workers, host, port)
+        return
+
+    import main as server
+    if log_file: server.logpipe.open_file(log_file, log_level)
+    if db: server.STORE_PATH = db
+    if metrics_port:
+        server.METRICS_PORT = metrics_port
+        server.start_metrics()
+    server.server_running = True
+    sock = server.handoff_takeover(handoff) if handoff else None
+    if sock is None: sock = listen(host, port)
+    server.server_socket = sock
+    if handoff: server.handoff_serve(handoff)
+    try:
+        if mode == "asyncio":
+            server.run_async_listener(sock)
+        else:
+            server.run_server_listener(sock)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # asyncio.run chiude già le connessioni all'uscita dal loop.
+        server.server_running = False
+        sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tris server senza GUI")
+    parser.add_argument("--mode", choices=MODES, default="threaded")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="solo modalità cluster")
+    parser.add_argument("--quiet", action="store_true", help="niente log su stdout")
+    parser.add_argument("--log-file", help="log JSON a rotazione (threaded e asyncio)")
+    parser.add_argument("--log-level", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="INFO")
+    parser.add_argument("--db", help="file SQLite dello storico partite (threaded e asyncio)")
+    parser.add_argument("--metrics-port", type=int, help="endpoint /metrics su 127.0.0.1 (threaded e asyncio)")
+    parser.add_argument("--handoff", metavar="PATH", help="socket Unix per il riavvio senza interruzioni (threaded, solo Unix)")
+    args = parser.parse_args()
+    if args.handoff and args.mode != "threaded": parser.error("--handoff vale solo in modalità threaded")
+    if args.handoff and not available(): parser.error("--handoff richiede socket Unix con SCM_RIGHTS")
+
+    raise_fd_limit()
+    print(f"[Server] pid {os.getpid()}, modalità {args.mode}, porta {args.port}", flush=True)
+    if args.quiet: sys.stdout = open(os.devnull, "w")
+    run(args.mode, args.host, args.port, args.workers, args.log_file, args.log_level, args.metrics_port, args.db, args.handoff)
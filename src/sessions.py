@@ -0,0 +1,137 @@
+# sessions.py
+# Sessioni riprendibili, solo per i client che al login dichiarano la feature
+# "session" (gli altri alla disconnessione escono subito, come sempre). Il client
+# riceve un token; stanze, coda di matchmaking e lista giocatori tengono la
+# Session (non il socket), quindi se la connessione cade il giocatore resta in
+# gioco per `grace` secondi:
+# - i frame non droppable (game_state, chat, match_found...) finiscono sempre in
+#   un buffer circolare numerato, anche mentre la sessione è staccata;
+# - al login con {"resume": token, "seen": n} la sessione passa al nuovo socket
+#   e gli rimanda solo i frame con numero > n (n = frame ricevuti esclusi quelli
+#   droppable: lista giocatori, ping e spectate_state, che non passano dal buffer);
+# - allo scadere del periodo di grazia si esegue la pulizia di una disconnessione.
+# I periodi di grazia sono timer di una TimerWheel condivisa (niente thread per sessione).
+import collections
+import secrets
+import threading
+from timerwheel import TimerWheel
+
+FEATURE_SESSION = "session"
+
+
+class Session:
+    # Si comporta come una Outbound: send_msg/post/pack_for la usano invariati.
+    supports_droppable = True
+
+    def __init__(self, token, player_id, size):
+        self.token = token
+        self.player_id = player_id
+        self.owner = None       # Outbound della connessione che possiede la sessione
+        self.out = None         # dove consegnare i frame; None = solo buffer
+        self.seq = 0
+        self.detached_seq = None
+        self.replay = collections.deque(maxlen=size)   # (numero, frame)
+        self.lock = threading.Lock()
+        self.timer = None
+        self.expired = False
+
+    def sendall(self, data, droppable=False):
+        with self.lock:
+            if not droppable:
+                self.seq += 1
+                self.replay.append((self.seq, data))
+            # Sotto il lock: l'ordine rispetto al replay di attach() è garantito.
+            if self.out is not None: self.out.sendall(data, droppable)
+
+    def depth(self):
+        out = self.out
+        return out.depth() if out is not None else 0
+
+    def attach(self, out, seen=None):
+        # Rimanda i frame persi e consegna i prossimi a `out`. True se il buffer
+        # non bastava (il chiamante manda allora uno stato completo).
+        with self.lock:
+            if type(seen) is not int or not 0 <= seen <= self.seq:
+                seen = self.detached_seq if self.detached_seq is not None else self.seq
+            missed = [frame for n, frame in self.replay if n > seen]
+            gap = self.seq - seen > len(missed)
+            for frame in missed: out.sendall(frame)
+            self.out = out
+            self.detached_seq = None
+            return gap
+
+
+class SessionManager:
+    def __init__(self, grace=30.0, buffer=64, log=print, wheel=None):
+        self.grace = grace
+        self.buffer = buffer
+        self.log = log
+        self.wheel = wheel or TimerWheel(log=log)
+        self._sessions = {}     # token -> Session
+        self._lock = threading.Lock()
+
+    def create(self, player_id, out):
+        session = Session(secrets.token_urlsafe(16), player_id, self.buffer)
+        session.owner = session.out = out
+        with self._lock: self._sessions[session.token] = session
+        return session
+
+    def claim(self, token, player_id, out):
+        # Primo passo della ripresa: il nuovo socket diventa proprietario, i frame
+        # intanto si accumulano nel buffer. Se il vecchio socket è ancora aperto
+        # (il server non si è accorto della caduta) lo si chiude.
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None or session.expired or session.player_id != player_id: return None
+            self.wheel.cancel(session.timer)
+            session.timer = None
+            old, session.owner = session.owner, out
+        with session.lock:
+            if session.out is not None:
+                session.out = None
+                session.detached_seq = session.seq
+        if old is not None and old is not out: old.abort()
+        return session
+
+    def detach(self, session, out, on_expire):
+        # Dalla finally del vecchio handler. True se la sessione resta viva
+        # (periodo di grazia o già ripresa da un altro socket): niente pulizia.
+        with self._lock:
+            if session.owner is not out: return not session.expired
+            if self.grace <= 0 or session.token not in self._sessions:
+                self._sessions.pop(session.token, None)
+                return False
+            session.owner = None
+            session.timer = self.wheel.schedule(self.grace, self._expire, session, on_expire)
+        with session.lock:
+            session.out = None
+            session.detached_seq = session.seq
+        return True
+
+    def _expire(self, session, on_expire):
+        with self._lock:
+            if session.owner is not None or session.expired: return
+            session.expired = True
+            self._sessions.pop(session.token, None)
+        self.log(f"[Sessione] {session.player_id}: periodo di grazia scaduto.")
+        on_expire()
+
+    def restore(self, token, player_id, seq, out=None):
+        # Riavvio con handoff: la stessa sessione (token e numerazione dei frame) nel
+        # processo nuovo. Senza `out` va poi staccata con detach() (periodo di grazia).
+        session = Session(token, player_id, self.buffer)
+        session.seq = seq
+        session.owner = session.out = out
+        with self._lock: self._sessions[token] = session
+        return session
+
+    def detached(self):
+        # Sessioni nel periodo di grazia, senza socket.
+        with self._lock: return [s for s in self._sessions.values() if s.owner is None and not s.expired]
+
+    def forget(self, session):
+        # Logout esplicito: la prossima disconnessione non tiene niente in sospeso.
+        with self._lock: self._sessions.pop(session.token, None)
+
+    def __len__(self):
+        return len(self._sessions)
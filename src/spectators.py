@@ -0,0 +1,138 @@
+# spectators.py
+# Spettatori delle partite. I due giocatori ricevono game_state direttamente da
+# broadcast_game_state; per gli spettatori il thread della mossa si limita a
+# pubblicare l'ultimo stato della stanza (O(1)). Un thread dedicato lo serializza
+# una volta per codec e accoda gli stessi byte alle Outbound di tutti gli iscritti.
+# - gli stati pubblicati nella stessa finestra si fondono: parte solo l'ultimo;
+# - uno spettatore con più di `lag_limit` frame in coda viene saltato e riceve
+#   l'istantanea più recente appena la sua coda si svuota (niente replay).
+import threading
+import time
+from protocollo import pack_for
+from outbound import post
+from metrics import BROADCAST_FANOUT, BROADCAST_SECONDS
+
+
+def lagging(conn, limit):
+    depth = getattr(conn, "depth", None)
+    return depth is not None and depth() >= limit
+
+
+class SpectatorHub:
+    def __init__(self, window=0.05, lag_limit=8, log=print):
+        self.window = window
+        self.lag_limit = lag_limit
+        self.log = log
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._rooms = {}        # room_id -> {spectator_id: conn}
+        self._watching = {}     # spectator_id -> room_id
+        self._latest = {}       # room_id -> ultimo messaggio pubblicato
+        self._dirty = set()     # stanze con uno stato non ancora inviato
+        self._closing = set()   # stanze chiuse: ultimo invio, poi via gli iscritti
+        self._behind = {}       # room_id -> spettatori in attesa di un'istantanea
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # --- Iscrizioni ---
+    def watch(self, room_id, spectator_id, conn, snapshot):
+        # `snapshot` va letto sotto il lock della stanza, come le publish():
+        # così non si perde una mossa tra la lettura e l'iscrizione.
+        with self._lock:
+            self._unwatch(spectator_id)
+            self._rooms.setdefault(room_id, {})[spectator_id] = conn
+            self._watching[spectator_id] = room_id
+            self._latest[room_id] = snapshot
+            self._behind.setdefault(room_id, set()).add(spectator_id)
+        self._wake.set()
+
+    def unwatch(self, spectator_id):
+        with self._lock: return self._unwatch(spectator_id)
+
+    def _unwatch(self, spectator_id):
+        room_id = self._watching.pop(spectator_id, None)
+        if room_id is None: return None
+        subscribers = self._rooms.get(room_id)
+        if subscribers is not None:
+            subscribers.pop(spectator_id, None)
+            if not subscribers:
+                del self._rooms[room_id]
+                self._latest.pop(room_id, None)
+        behind = self._behind.get(room_id)
+        if behind: behind.discard(spectator_id)
+        return room_id
+
+    def room_of(self, spectator_id):
+        with self._lock: return self._watching.get(spectator_id)
+
+    def __contains__(self, room_id):
+        return room_id in self._rooms
+
+    def count(self, room_id):
+        return len(self._rooms.get(room_id, ()))
+
+    def __len__(self):
+        return len(self._watching)
+
+    # --- Pubblicazione ---
+    def publish(self, room_id, msg):
+        with self._lock:
+            if room_id not in self._rooms: return
+            self._latest[room_id] = msg
+            self._dirty.add(room_id)
+        self._wake.set()
+
+    def close_room(self, room_id):
+        with self._lock:
+            if room_id not in self._rooms: return
+            self._closing.add(room_id)
+        self._wake.set()
+
+    # --- Invio ---
+    def _run(self):
+        while True:
+            self._wake.wait(self.window if self._behind else None)
+            time.sleep(self.window)   # coalesce delle mosse nella finestra
+            self._wake.clear()
+            try: self.flush()
+            except Exception as e: self.log(f"[Spettatori] Errore flush: {e}")
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            closing, self._closing = self._closing, set()
+            behind, self._behind = self._behind, {}
+            work = []
+            for room_id in dirty | closing | set(behind):
+                subscribers = self._rooms.get(room_id)
+                msg = self._latest.get(room_id)
+                if not subscribers or msg is None: continue
+                if room_id in dirty or room_id in closing: targets = list(subscribers.items())
+                else: targets = [(sid, subscribers[sid]) for sid in behind[room_id] if sid in subscribers]
+                work.append((room_id, msg, targets, room_id in closing))
+            for room_id in closing:
+                for sid in self._rooms.pop(room_id, {}): self._watching.pop(sid, None)
+                self._latest.pop(room_id, None)
+
+        if not work: return
+        start = time.perf_counter()
+        sent = 0
+        still_behind = {}
+        for room_id, msg, targets, final in work:
+            frames = {}
+            for sid, conn in targets:
+                # L'ultimo stato di una stanza chiusa parte comunque.
+                if not final and lagging(conn, self.lag_limit):
+                    still_behind.setdefault(room_id, set()).add(sid)
+                    continue
+                try: post(conn, pack_for(conn, msg, frames), droppable=True)
+                except Exception: pass
+                sent += 1
+        if still_behind:
+            with self._lock:
+                for room_id, sids in still_behind.items():
+                    subscribers = self._rooms.get(room_id, {})
+                    kept = {sid for sid in sids if sid in subscribers}
+                    if kept: self._behind.setdefault(room_id, set()).update(kept)
+        BROADCAST_FANOUT.observe(sent, "spectators")
+        BROADCAST_SECONDS.observe(time.perf_counter() - start, "spectators")
@@ -0,0 +1,172 @@
+# storage.py
+# Storico delle partite su SQLite (WAL). record() accoda soltanto: un thread
+# scrittore raccoglie le partite finite e le inserisce a blocchi, una transazione
+# per blocco, quindi il percorso di gioco non aspetta mai il disco.
+# Le letture (storico, statistiche, replay) usano una connessione per thread:
+# in WAL non si bloccano con lo scrittore.
+#
+# Mosse: due per byte (4 bit per cella, 0xF come riempitivo), al massimo 5 byte
+# per partita; X muove sempre per primo, quindi il giocatore si ricava dall'indice.
+# Le varianti più grandi (gomoku...) hanno 0xFF, lato e lunghezza della fila in
+# testa e poi una mossa per byte: 0xFF non può aprire una partita di tris.
+import atexit
+import collections
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id TEXT PRIMARY KEY,
+    x TEXT NOT NULL,
+    o TEXT NOT NULL,
+    result TEXT NOT NULL,
+    moves BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    ended_at REAL NOT NULL
+);
+-- Una riga per giocatore e partita: lo storico di un giocatore è una scansione d'indice.
+CREATE TABLE IF NOT EXISTS game_players (
+    player TEXT NOT NULL,
+    ended_at REAL NOT NULL,
+    game_id TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    PRIMARY KEY (player, ended_at, game_id)
+) WITHOUT ROWID;
+-- Contatori aggiornati nella stessa transazione: le statistiche sono una lettura per chiave.
+CREATE TABLE IF NOT EXISTS player_stats (
+    player TEXT PRIMARY KEY,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""
+
+_PAD = 0xF
+_VARIANT = 0xFF
+
+
+def encode_moves(moves, size=3, win=3):
+    if (size, win) != (3, 3): return bytes((_VARIANT, size, win)) + bytes(moves)
+    out = bytearray()
+    for i in range(0, len(moves), 2):
+        lo = moves[i]
+        hi = moves[i + 1] if i + 1 < len(moves) else _PAD
+        out.append(hi << 4 | lo)
+    return bytes(out)
+
+
+def decode_moves(data):
+    # -> (mosse, lato, in fila)
+    if data[:1] == bytes((_VARIANT,)): return list(data[3:]), data[1], data[2]
+    moves = []
+    for byte in data:
+        for nibble in (byte & 0xF, byte >> 4):
+            if nibble == _PAD: return moves, 3, 3
+            moves.append(nibble)
+    return moves, 3, 3
+
+
+def outcomes(result):
+    # result della partita -> (esito di X, esito di O)
+    if result == "draw": return "draw", "draw"
+    if result in ("X_wins", "O_disconnected"): return "win", "loss"
+    return "loss", "win"
+
+
+class GameStore:
+    def __init__(self, batch=256, interval=0.5, log=print):
+        self.batch = batch
+        self.interval = interval
+        self.log = log
+        self.path = None
+        self.written = 0
+        self._pending = collections.deque()
+        self._wake = threading.Event()
+        self._local = threading.local()
+        self._thread = None
+
+    def open(self, path):
+        if self.path: return
+        self.path = path
+        db = self._connect()
+        db.executescript(SCHEMA)
+        db.commit()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _reader(self):
+        db = getattr(self._local, "db", None)
+        if db is None: db = self._local.db = self._connect()
+        return db
+
+    # --- Scrittura ---
+    def record(self, room, result):
+        # Dal thread di gioco: copia i dati della stanza e accoda, niente I/O.
+        # Una stanza si registra una volta sola, qualunque sia il percorso che la chiude.
+        if not self.path or getattr(room, "recorded", False): return
+        room.recorded = True
+        by_symbol = {s: pid for pid, s in room.players.items()}
+        self._pending.append((room.id, by_symbol.get("X"), by_symbol.get("O"), result,
+                              encode_moves(room.move_history, room.size, room.win), room.created_at, room.ended_at or time.time()))
+        if len(self._pending) >= self.batch: self._wake.set()
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try: self._write(db)
+            except Exception as e: self.log(f"[Errore] Salvataggio partite: {e}")
+
+    def _write(self, db):
+        while self._pending:
+            rows = []
+            while self._pending and len(rows) < self.batch: rows.append(self._pending.popleft())
+            players, stats = [], []
+            for game_id, x, o, result, _, _, ended_at in rows:
+                for player, outcome in zip((x, o), outcomes(result)):
+                    players.append((player, ended_at, game_id, outcome))
+                    stats.append((player, outcome == "win", outcome == "loss", outcome == "draw"))
+            with db:
+                db.executemany("INSERT OR IGNORE INTO games VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                db.executemany("INSERT OR IGNORE INTO game_players VALUES (?, ?, ?, ?)", players)
+                db.executemany("INSERT INTO player_stats VALUES (?, ?, ?, ?) ON CONFLICT(player) DO UPDATE SET "
+                               "wins = wins + excluded.wins, losses = losses + excluded.losses, draws = draws + excluded.draws",
+                               stats)
+            self.written += len(rows)
+
+    def flush(self):
+        # Scrive subito quello che è in coda (uscita dal processo, benchmark).
+        if self.path: self._write(self._reader())
+
+    # --- Letture per la lobby ---
+    def recent_games(self, player, limit=20):
+        if not self.path: return []
+        rows = self._reader().execute(
+            "SELECT g.id, g.x, g.o, g.result, gp.outcome, g.ended_at FROM game_players gp "
+            "JOIN games g ON g.id = gp.game_id WHERE gp.player = ? ORDER BY gp.ended_at DESC LIMIT ?",
+            (player, limit)).fetchall()
+        return [{"game_id": r[0], "x": r[1], "o": r[2], "result": r[3], "outcome": r[4], "ended_at": r[5]} for r in rows]
+
+    def stats(self, player):
+        row = self._reader().execute("SELECT wins, losses, draws FROM player_stats WHERE player = ?",
+                                     (player,)).fetchone() if self.path else None
+        wins, losses, draws = row or (0, 0, 0)
+        return {"player": player, "wins": wins, "losses": losses, "draws": draws}
+
+    def replay(self, game_id):
+        if not self.path: return None
+        row = self._reader().execute("SELECT x, o, result, moves, created_at, ended_at FROM games WHERE id = ?",
+                                     (game_id,)).fetchone()
+        if row is None: return None
+        moves, size, win = decode_moves(row[3])
+        return {"game_id": game_id, "x": row[0], "o": row[1], "result": row[2], "moves": moves,
+                "size": size, "win": win, "created_at": row[4], "ended_at": row[5]}
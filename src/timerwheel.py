@@ -0,0 +1,122 @@
+# timerwheel.py
+# Scheduler a ruota (hashed timer wheel): un solo thread, `slots` caselle da
+# `tick` secondi. schedule() e cancel() sono O(1); a ogni tick si guarda solo la
+# casella corrente, quindi il costo non dipende da quanti timer sono attivi ma
+# solo da quanti scadono (i timer oltre un giro completo aspettano `rounds` giri).
+#
+# IdleWatch usa un solo timer per connessione, spostato in avanti solo quando
+# scade: touch() a ogni messaggio ricevuto si limita a salvare l'ora.
+import math
+import threading
+import time
+
+
+class Timer:
+    __slots__ = ("slot", "rounds", "fn", "args", "cancelled")
+
+    def __init__(self, slot, rounds, fn, args):
+        self.slot = slot
+        self.rounds = rounds
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+
+class TimerWheel:
+    def __init__(self, tick=0.5, slots=512, log=print, clock=time.monotonic, autostart=True):
+        self.tick = tick
+        self.log = log
+        self.clock = clock
+        self._slots = [set() for _ in range(slots)]
+        self._cursor = 0
+        self._next = clock() + tick     # ora di scadenza della casella corrente
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if autostart: self.start()
+
+    def schedule(self, delay, fn, *args):
+        with self._lock:
+            # Caselle da saltare contando dalla corrente (che scade a self._next).
+            ticks = max(0, math.ceil((self.clock() + delay - self._next) / self.tick))
+            rounds, offset = divmod(ticks, len(self._slots))
+            timer = Timer((self._cursor + offset) % len(self._slots), rounds, fn, args)
+            self._slots[timer.slot].add(timer)
+        return timer
+
+    def cancel(self, timer):
+        if timer is None: return
+        with self._lock:
+            timer.cancelled = True
+            self._slots[timer.slot].discard(timer)
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+    def advance(self, now=None):
+        # Esegue le caselle scadute fino a `now`; chiamata dal thread (o dai test).
+        now = self.clock() if now is None else now
+        while True:
+            with self._lock:
+                if now < self._next: return
+                slot = self._slots[self._cursor]
+                due = [t for t in slot if t.rounds == 0]
+                for t in slot: t.rounds -= 1
+                slot.difference_update(due)
+                self._cursor = (self._cursor + 1) % len(self._slots)
+                self._next += self.tick
+            for t in due:
+                if t.cancelled: continue
+                try: t.fn(*t.args)
+                except Exception as e: self.log(f"[Timer] Errore in {getattr(t.fn, '__name__', t.fn)}: {e}")
+
+    def run(self):
+        while not self._stop.wait(max(0.0, self._next - self.clock())):
+            self.advance()
+
+    def start(self):
+        # Anche dopo stop(): i timer scaduti nel frattempo partono al primo giro.
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # Al ritorno nessun timer è in esecuzione.
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread(): thread.join()
+
+
+class IdleWatch:
+    # Heartbeat dopo `heartbeat` secondi di silenzio, on_idle dopo `timeout`.
+    def __init__(self, wheel, heartbeat, timeout, on_heartbeat, on_idle):
+        self.wheel = wheel
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.on_heartbeat = on_heartbeat
+        self.on_idle = on_idle
+        self.last = wheel.clock()
+        self._beat_for = None
+        self._timer = wheel.schedule(heartbeat, self._check)
+
+    def touch(self):
+        self.last = self.wheel.clock()
+
+    def stop(self):
+        self.wheel.cancel(self._timer)
+        self._timer = None
+
+    def _check(self):
+        if self._timer is None: return
+        last = self.last
+        idle = self.wheel.clock() - last
+        if idle >= self.timeout:
+            self._timer = None
+            self.on_idle()
+            return
+        if idle >= self.heartbeat and self._beat_for != last:
+            self._beat_for = last
+            self.on_heartbeat()
+        deadline = last + (self.heartbeat if idle < self.heartbeat else self.timeout)
+        self._timer = self.wheel.schedule(deadline - self.wheel.clock(), self._check)